@@ -147,6 +147,8 @@ while running:
             change_password(console, C, alg)
         else:
             C.send_packet({"type": "text", "text": i})
+    for i in console.get_completion_requests():
+        C.send_packet({"type": "complete", "text": i})
     for p in C.get_all_packets():
         if p["type"] == "text":
             console.print(p["text"], p["newline"], p["loop"])
@@ -154,6 +156,8 @@ while running:
             console.update_prefix(p.get("text"))
         elif p["type"] == "clear_console":
             console.clear_console()
+        elif p["type"] == "completions":
+            console.complete(p.get("text", ""), p.get("options", []))
 C.stop()
 console.stop()
 
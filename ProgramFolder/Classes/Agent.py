@@ -0,0 +1,183 @@
+from .Client import Client
+from .UserData import UserData
+from .UserHandle import UserHandle
+from threading import Thread, Event
+from time import time, sleep
+from socket import gethostname
+
+
+class AgentUserHandle(UserHandle):
+    # Stands in for a coordinator user while their command runs here, whatever it prints goes back to the
+    # coordinator tagged with the id of the command being run
+    def __init__(self, user_data, agent, username, permissions):
+        super().__init__(user_data)
+        self.agent = agent
+        self.set_username(username)
+        self.permissions = min(permissions, self.max_permission)
+        self.logged_in = True
+        self.command_id = None
+
+    def get_permissions(self):
+        # The coordinator already decided what this user may do, a local user with the same name doesn't count
+        return self.permissions
+
+    def set_command_id(self, id_):
+        self.command_id = id_
+
+    def print(self, data, newline=True, loop=True):
+        if self.command_id is not None:
+            self.agent.send_packet({"type": "agent_output", "id": self.command_id, "text": f"{data}"})
+
+    def get_input(self):
+        return []
+
+    def clear_console(self):
+        pass
+
+    def set_prefix(self, prefix):
+        pass
+
+    def get_prefix(self):
+        return self.default_prefix
+
+
+class Agent(Thread):
+    # Runs this ServerServer as a node of a coordinator. It logs in over the normal socket protocol, reports its
+    # controllers, instances and load, runs the commands it is sent and forwards its instances' output.
+    login_timeout = 10
+
+    def __init__(self, manager, user_data, config, command_runner):
+        super(Agent, self).__init__(daemon=True)
+        self.manager = manager
+        self.user_data = user_data
+        self.config = config
+        self.command_runner = command_runner
+
+        self.name = config.get("agentName") or gethostname()
+        self.client = None
+        self.connected = False
+        self.stopping = Event()
+
+        self.handles = {}   # format {(coordinator username, permission): AgentUserHandle}
+        self.last_status = None
+        self.last_status_time = 0
+
+        manager.add_output_listener(self.forward_output)
+
+    def get_name(self):
+        return self.name
+
+    def get_connected(self):
+        return self.connected
+
+    def stop(self):
+        self.stopping.set()
+        if self.client:
+            self.client.stop()
+
+    def run(self):
+        address = f"{self.config['coordinatorIp']}:{self.config['coordinatorPort']}"
+        while not self.stopping.is_set():
+            if not self.connect():
+                self.stopping.wait(self.config.get("agentReconnectInterval", 5))
+                continue
+            self.manager.print_all(f"Registered as agent {self.name} with coordinator at {address}")
+            while self.client.get_running() and not self.stopping.is_set():
+                for packet in self.client.get_all_packets():
+                    if packet.get("type") == "agent_command":
+                        self.run_command(packet)
+                self.send_status()
+                sleep(0.05)
+            self.connected = False
+            if not self.stopping.is_set():
+                self.manager.print_all(f"Lost connection to coordinator at {address}")
+
+    def connect(self):
+        client = Client()
+        client.set_ip(self.config["coordinatorIp"])
+        client.set_port(self.config["coordinatorPort"])
+        client.set_ssl(self.config.get("coordinatorSsl", False))
+        client.set_secure(self.config.get("coordinatorVerifyCert", True))
+        client.wait_time = 0.01
+        client.start()
+        if not client.get_running():
+            return False
+
+        username = self.config["agentUsername"]
+        client.send_packet({"type": "login_username", "username": username})
+        packet = self.wait_for_packet(client, "login_alg_and_salt")
+        if packet:
+            hash_ = UserData.generate_hash(packet["salt"] + self.config["agentPassword"], packet["alg"])
+            client.send_packet({"type": "final_login", "username": username, "hash": hash_})
+            packet = self.wait_for_packet(client, "login_response")
+        if not packet or packet.get("response") != "success":
+            self.manager.print_all("Agent login to coordinator failed")
+            client.stop()
+            return False
+
+        self.client = client
+        self.connected = True
+        self.last_status = self.get_status()
+        self.last_status_time = time()
+        self.send_packet({"type": "agent_register", "name": self.name, **self.last_status})
+        return True
+
+    def wait_for_packet(self, client, type_):
+        end = time() + self.login_timeout
+        while time() < end and client.get_running():
+            for packet in client.get_all_packets():
+                if packet.get("type") == type_:
+                    return packet
+            sleep(0.05)
+        return None
+
+    def send_packet(self, packet):
+        if self.connected:
+            self.client.send_packet(packet)
+
+    def get_status(self):
+        instances = []
+        for ins in self.manager.get_instance_registry().get_instances():
+            if ins.remote:
+                continue
+            instances.append({"type": ins.type, "name": ins.get_name(), "running": ins.get_running(),
+                              "address": ins.get_address(), "info": ins.get_info(),
+                              "resources": ins.get_resource_lines()})
+        return {"controllers": self.manager.get_server_names(), "instances": instances,
+                "load": self.manager.get_load()}
+
+    def send_status(self):
+        # Only sent when something changed, at most once per agentStatusInterval
+        if time() - self.last_status_time < self.config.get("agentStatusInterval", 2):
+            return
+        self.last_status_time = time()
+        status = self.get_status()
+        if status != self.last_status:
+            self.last_status = status
+            self.send_packet({"type": "agent_status", **status})
+
+    def run_command(self, packet):
+        user = packet.get("user") or "coordinator"
+        permission = packet.get("permission", 0)
+        handle = self.handles.get((user, permission))
+        if not handle:
+            handle = AgentUserHandle(self.user_data, self, f"{user}@coordinator", permission)
+            self.handles[(user, permission)] = handle
+        path = packet.get("path", [])
+        command = packet.get("command", "")
+        args = packet.get("args", [])
+
+        def run(path_, id_=packet.get("id")):
+            # Commands from one user run in order so the handle only ever has one command id at a time
+            handle.set_command_id(id_)
+            try:
+                self.command_runner(self.manager, handle, path_, command, args)
+            finally:
+                self.send_packet({"type": "agent_output", "id": id_, "done": True})
+                handle.set_command_id(None)
+
+        self.manager.submit_command(handle, command, run, path=path)
+
+    def forward_output(self, focus, items):
+        self.send_packet({"type": "agent_output", "instance": list(focus), "lines": [i[0] for i in items],
+                          "levels": [i[1] for i in items]})
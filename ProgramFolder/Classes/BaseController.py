@@ -1,16 +1,31 @@
-from .functions import remove_chars
-from queue import Queue, Empty
+from .ProcessIO import ProcessIO
+from .CommandRegistry import CommandRegistry
+from .InstanceLog import InstanceLog
+from .ResourceSampler import ResourceSampler
+from .ProcessHandover import FifoProcess
+from .OutputQueue import OutputQueue
+from .OutputFilter import OutputFilter
+from subprocess import Popen, PIPE
 from os import path as ospath
-from os import makedirs
+from os import makedirs, environ
 from shutil import rmtree
 
 
 class BaseController:
     commands = []
     class_commands = []
+    command_registry = CommandRegistry()
+    class_command_registry = CommandRegistry()
     objects = []
     manager = None
+    process_io = None
+    resource_sampler = None
     type = "Default"
+    remote = False
+    stop_grace = None   # seconds a stop gets before the process is terminated, None uses the stopGracePeriod config
+    output_policy = None    # block, drop_oldest or coalesce once the output queue is full, None uses the config
+    output_filters = []     # regex patterns of output lines that are never sent to users
+    output_level_pattern = None     # regex whose first matching group is a line's level, None uses OutputFilter's
 
     # <editor-fold desc="Class Methods">
 
@@ -29,15 +44,17 @@ class BaseController:
         cls.objects.remove(obj)
 
     @classmethod
-    def add_command(cls, keywords, ignore_chars=None, permission=0, default="", help_info=""):
+    def add_command(cls, keywords, ignore_chars=None, permission=0, default="", help_info="", fast=False):
         if not ignore_chars:
             ignore_chars = []
         if not default:
             default = keywords[0]
 
         def f(func):
-            cls.commands.append({"keywords": keywords, "function": func, "ignore": ignore_chars,
-                                 "permission": permission, "default": default, "help_info": help_info})
+            command = {"keywords": keywords, "function": func, "ignore": ignore_chars,
+                       "permission": permission, "default": default, "help_info": help_info, "fast": fast}
+            cls.commands.append(command)
+            cls.command_registry.add(command)
             return func
 
         return f
@@ -46,17 +63,21 @@ class BaseController:
     def reset_commands(cls):
         cls.commands = []
         cls.class_commands = []
+        cls.command_registry = CommandRegistry()
+        cls.class_command_registry = CommandRegistry()
 
     @classmethod
-    def add_class_command(cls, keywords, ignore_chars=None, permission=0, default="", help_info=""):
+    def add_class_command(cls, keywords, ignore_chars=None, permission=0, default="", help_info="", fast=False):
         if not ignore_chars:
             ignore_chars = []
         if not default:
             default = keywords[0]
 
         def f(func):
-            cls.class_commands.append({"keywords": keywords, "function": func, "ignore": ignore_chars,
-                                       "permission": permission, "default": default, "help_info": help_info})
+            command = {"keywords": keywords, "function": func, "ignore": ignore_chars,
+                       "permission": permission, "default": default, "help_info": help_info, "fast": fast}
+            cls.class_commands.append(command)
+            cls.class_command_registry.add(command)
             return func
 
         return f
@@ -64,17 +85,19 @@ class BaseController:
     @classmethod
     def find_command(cls, command, class_commands=True, instance_commands=True):
         if class_commands:
-            for i in cls.class_commands:
-                temp_name = remove_chars(command, i["ignore"])
-                if temp_name.lower() in i["keywords"]:
-                    return i
+            i = cls.class_command_registry.find(command)
+            if i:
+                return i
         if instance_commands:
-            for i in cls.commands:
-                temp_name = remove_chars(command, i["ignore"])
-                if temp_name.lower() in i["keywords"]:
-                    return i
+            return cls.command_registry.find(command)
         return None
 
+    @classmethod
+    def get_registry(cls, class_commands=True):
+        if class_commands:
+            return cls.class_command_registry
+        return cls.command_registry
+
     @classmethod
     def get_commands(cls, class_commands=True, instance_commands=True):
         out = []
@@ -86,19 +109,17 @@ class BaseController:
 
     @classmethod
     def run_class_command(cls, name, handle, *args, **kwargs):
-        for i in cls.class_commands:
-            temp_name = remove_chars(name, i["ignore"])
-            if temp_name.lower() in i["keywords"]:
-                if handle.get_permissions() < i["permission"]:
-                    handle.print("You don't have permission to run that command")
-                    return True
-                try:
-                    i["function"](cls, handle, *args, **kwargs)
-                    return True
-                except Exception as e:
-                    handle.print(f"Error running {name}, Error: {e.__repr__()}")
-                    return True
-        return False
+        i = cls.class_command_registry.find(name)
+        if not i:
+            return False
+        if handle.get_permissions() < i["permission"]:
+            handle.print("You don't have permission to run that command")
+            return True
+        try:
+            i["function"](cls, handle, *args, **kwargs)
+        except Exception as e:
+            handle.print(f"Error running {name}, Error: {e.__repr__()}")
+        return True
 
     @classmethod
     def set_manager(cls, manager):
@@ -108,12 +129,30 @@ class BaseController:
     def get_manager(cls):
         return cls.manager
 
+    @classmethod
+    def get_process_io(cls):
+        # Shared by every controller type so all instances are read from one thread
+        if not BaseController.process_io:
+            BaseController.process_io = ProcessIO(logger=cls.manager.get_console().print if cls.manager else None)
+        return BaseController.process_io
+
+    @staticmethod
+    def get_resource_sampler():
+        if not BaseController.resource_sampler:
+            interval = 5
+            if BaseController.manager:
+                interval = BaseController.manager.get_config().get("resourceSampleInterval", 5)
+            BaseController.resource_sampler = ResourceSampler(interval)
+        return BaseController.resource_sampler
+
     @classmethod
     def init(cls):
         pass
 
     @classmethod
     def init_class(cls):
+        # Gives every controller type its own command lists instead of appending to the ones on BaseController
+        cls.reset_commands()
         cls.init_commands()
         cls.init()
 
@@ -124,7 +163,7 @@ class BaseController:
     @classmethod
     def init_commands(cls):
 
-        @cls.add_class_command(["test"])
+        @cls.add_class_command(["test"], fast=True)
         def test_command(cls_, user, *args):
             user.print("TestSuccess")
             return True
@@ -135,6 +174,7 @@ class BaseController:
         self.objects.append(self)
         self.name = name
         self.port_handler = port_handler
+        self.port_handler.set_update_callback(self.port_updated)
         self.base_dir = self.manager.get_server_dir()
 
         self.address = ""
@@ -145,12 +185,25 @@ class BaseController:
 
         self._data = data
 
+        self.log = None
+        if self.manager.get_config().get("instanceLogs", True):
+            self.log = InstanceLog(ospath.join(self.path, ".serverserver"))
+
         self.running = False
+        self.process = None
 
-        self.queue = Queue()
+        config = self.manager.get_config()
+        self.queue = OutputQueue(f"[{self.type}/{self.name}]:", config.get("outputQueueLines", 5000),
+                                 self.output_policy or config.get("outputQueuePolicy", "coalesce"),
+                                 self.pause_output, self.resume_output)
+        self.output_filter = OutputFilter(ospath.join(self.path, ".serverserver", "filters.json"),
+                                          self.output_filters + config.get("outputDropPatterns", []),
+                                          self.output_level_pattern)
 
     def remove(self):
         self.parent_object.objects.remove(self)
+        if self.log:
+            self.log.close(flush=False)
         rmtree(self.path)
         self.port_handler.remove(delete=True)
 
@@ -159,6 +212,7 @@ class BaseController:
 
     def set_data(self, data):
         self._data = data
+        self.manager.instance_changed(self)
 
     def get_data(self):
         return self._data
@@ -167,37 +221,113 @@ class BaseController:
         return self.name
 
     def set_running(self, running):
+        changed = running != self.running
         self.running = running
+        if changed and self.manager:
+            self.manager.running_changed(self, running)
 
     def get_running(self):
         return self.running
 
     def run_command(self, name, handle, *args, **kwargs):
-        for i in self.parent_object.commands:
-            temp_name = remove_chars(name, i["ignore"])
-            if temp_name.lower() in i["keywords"]:
-                if handle.get_permissions() < i["permission"]:
-                    handle.print("You don't have permission to run that command")
-                    return True
-                try:
-                    i["function"](self, handle, *args, **kwargs)
-                    return True
-                except Exception as e:
-                    handle.print(f"Error running {name}, Error: {e.__repr__()}")
-                    return True
-        return False
+        i = self.parent_object.command_registry.find(name)
+        if not i:
+            return False
+        if handle.get_permissions() < i["permission"]:
+            handle.print("You don't have permission to run that command")
+            return True
+        try:
+            i["function"](self, handle, *args, **kwargs)
+        except Exception as e:
+            handle.print(f"Error running {name}, Error: {e.__repr__()}")
+        return True
+
+    def launch_process(self, args, env=None, cwd=None):
+        # Never chdir here, the working directory is shared by every thread in the process
+        if env:
+            env = {**environ, **{key: str(val) for key, val in env.items()}}
+        if not cwd:
+            cwd = self.path
+        return Popen(args, cwd=cwd, env=env, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+
+    def launch_server_process(self, args, env=None, cwd=None):
+        # For the long running server itself, its stdio goes through fifos so it can outlive a daemon restart
+        if not self.manager.get_config().get("processHandover", True) or not FifoProcess.get_supported():
+            return self.launch_process(args, env=env, cwd=cwd)
+        if env:
+            env = {**environ, **{key: str(val) for key, val in env.items()}}
+        return FifoProcess.launch(args, ospath.join(self.path, ".serverserver"), cwd=cwd or self.path, env=env)
+
+    def adopt_process(self, process):
+        self.set_running(True)
+        self.attach_process(process)
+        self.add_to_queue("Re-attached to the running server after a daemon restart")
+
+    def get_handover_record(self):
+        process = self.process
+        if not self.running or not isinstance(process, FifoProcess) or process.poll() is not None:
+            return None
+        return {"type": self.type, "name": self.name, **process.get_record()}
+
+    def attach_process(self, process):
+        self.process = process
+        self.get_process_io().register(process, [process.stdout, process.stderr], self.add_to_queue,
+                                       self.process_closed)
+        self.get_resource_sampler().track(self, process.pid)
+        self.manager.process_started(self, process)
+
+    def process_closed(self, process):
+        try:
+            process.stdin.close()
+        except (OSError, AttributeError):
+            pass
+        self.add_to_queue("Server Closed")
+        if self.process is process:
+            self.get_resource_sampler().untrack(self)
+            self.manager.process_stopped(self)
+            self.process = None
+            self.set_running(False)
 
     def add_to_queue(self, item):
-        self.queue.put(f"[{self.type}/{self.name}]:{item}", block=True, timeout=-1)
+        # The log keeps every line, only what users are sent is filtered and bounded
+        if self.log:
+            self.log.append(item)
+        level = self.output_filter.classify(item)
+        if level is None:
+            return
+        wanted = self.manager.get_output_level((self.type, self.name))
+        if wanted is None or level < wanted:
+            self.output_filter.add_skipped()
+            return
+        self.queue.put(item, level)
+        self.manager.output_ready(self)
 
     def get_queue(self):
-        out = []
-        while self.queue.qsize() > 0:
-            try:
-                out.append(self.queue.get(False))
-            except Empty:
-                break
-        return out
+        return self.queue.get_all()
+
+    def pause_output(self):
+        # Back-pressure for the block policy, the server's output waits in its pipe instead of holding up the
+        # reader every other instance shares
+        if self.process:
+            self.get_process_io().pause(self.process)
+
+    def resume_output(self):
+        if self.process:
+            self.get_process_io().resume(self.process)
+
+    def get_output_filter(self):
+        return self.output_filter
+
+    def get_output_lines(self):
+        return [self.queue.get_line(), self.output_filter.get_line()]
+
+    def get_log(self):
+        return self.log
+
+    def port_updated(self, port, previous):
+        # Called once a port reserved during a deferred restore has been forwarded, port differs from previous if
+        # the reserved one had been taken by another upnp mapping in the meantime
+        self.set_address(self.port_handler.get_connection_to_port(port))
 
     def set_address(self, address):
         self.address = address
@@ -208,12 +338,51 @@ class BaseController:
     def get_info(self):
         return ""
 
+    def get_memory(self):
+        # MiB the instance commits while running, counted against the memoryBudget config
+        return 0
+
+    def get_resources(self):
+        return self.get_resource_sampler().get_sample(self)
+
+    def get_resource_lines(self):
+        sample = self.get_resources()
+        if not sample:
+            return []
+        return ResourceSampler.format_sample(sample)
+
     def start(self):
         raise NotImplemented
 
     def stop(self):
         raise NotImplemented
 
+    def get_stop_grace(self):
+        if self.stop_grace is not None:
+            return self.stop_grace
+        return self.manager.get_config().get("stopGracePeriod", 30)
+
+    def terminate(self):
+        # Sends SIGTERM (TerminateProcess on windows) to the attached process if it is still alive
+        process = self.process
+        if not process or process.poll() is not None:
+            return False
+        try:
+            process.terminate()
+        except OSError:
+            return False
+        return True
+
+    def kill(self):
+        process = self.process
+        if not process or process.poll() is not None:
+            return False
+        try:
+            process.kill()
+        except OSError:
+            return False
+        return True
+
     def shutdown(self):
         raise NotImplemented
 
@@ -17,6 +17,7 @@ class CertManager:
         self.account_key = "account.key"
 
         self.selfSigned = False
+        self.generated_self_signed = False
 
         self.cloudflare_email = ""
         self.cloudflare_api_key = ""
@@ -52,6 +53,7 @@ class CertManager:
         if not os.path.isfile(self._cert_file_path()) or not os.path.isfile(self._key_file_path()):
             if self.selfSigned:
                 cert, pem = self.generate_selfsigned_cert()
+                self.generated_self_signed = True
             else:
                 cert, pem = self.generate_signed_cert()
             with open(self._cert_file_path(), "wb") as f:
@@ -59,6 +61,16 @@ class CertManager:
             with open(self._key_file_path(), "wb") as f:
                 f.write(pem)
 
+    def replace_self_signed(self):
+        # For when setup is run again once cloudflare is connected, swaps out the fallback certificate from earlier
+        if not self.generated_self_signed or self.selfSigned:
+            return
+        for file in (self._cert_file_path(), self._key_file_path()):
+            if os.path.isfile(file):
+                os.remove(file)
+        self.generated_self_signed = False
+        self.create_files_if_missing()
+
     def generate_selfsigned_cert(self, key=None):
         """Generates self signed certificate for a hostname, and optional IP addresses."""
         from cryptography import x509
@@ -152,6 +164,7 @@ class CertManager:
 
         client = self.get_client(k)
         if not client:
+            self.generated_self_signed = True
             return self.generate_selfsigned_cert()
         certificate = client.get_certificate()
         return certificate.encode(), k.to_pem()
@@ -7,6 +7,7 @@ from json import loads as j_loads
 from queue import Queue, Empty
 from threading import Thread
 from io import BytesIO
+from .PacketBuffer import PacketBuffer
 import ssl
 
 
@@ -28,10 +29,17 @@ class Client(Thread):
         self.running = False
         self.ssl = False
         self.secure = True
+        self.framed = True
 
         self.bytes = b""
         self.bytes_queue = Queue()
 
+        self.packet_buffer = None
+        self.packets = Queue()
+
+    def set_framed(self, framed):
+        self.framed = framed
+
     def set_ssl(self, ssl):
         self.ssl = ssl
 
@@ -51,11 +59,15 @@ class Client(Thread):
 
             version = int(self.socket.recv(1).decode())
             encoded = str(self.version_to_use).encode()
-            if len(encoded) == 1:
+            if self.framed:
+                encoded = (b"J" if self.version_to_use == -1 else encoded) + b"F"
+            elif len(encoded) == 1:
                 encoded += b" "
             self.socket.send(encoded)
 
             self.version = min(version, self.version_to_use)
+            if self.framed:
+                self.packet_buffer = PacketBuffer(self.version)
             self.running = True
             super(Client, self).start()
         except error:
@@ -80,19 +92,33 @@ class Client(Thread):
             try:
                 read_sockets, write_sockets, error_sockets = select([self.socket], [], [], 0)
                 for sock in read_sockets:
+                    if self.framed:
+                        self.receive()
+                        continue
                     data = sock.recv(1024)
                     if len(data) == 0:
                         self.stopping = True
                     else:
                         self.add_bytes(data)
-            except error:
+            except (error, ValueError, EOFError, PickleError, UnicodeDecodeError):
                 self.stopping = True
                 continue
         self.running = False
 
+    def receive(self):
+        received = self.packet_buffer.recv_into(self.socket)
+        while received and isinstance(self.socket, ssl.SSLSocket) and self.socket.pending():
+            received += self.packet_buffer.recv_into(self.socket)
+        if received == 0:
+            self.stopping = True
+        for packet in self.packet_buffer.get_packets():
+            self.packets.put(packet)
+
     def send_packet(self, packet):
         try:
-            if self.version != -1:
+            if self.framed:
+                self.socket.send(PacketBuffer.encode(packet, self.version))
+            elif self.version != -1:
                 self.socket.send(dumps(packet, protocol=self.version))
             else:
                 self.socket.send(j_dumps(packet).encode() + b"\x00")
@@ -110,6 +136,12 @@ class Client(Thread):
                 break
 
     def get_packet(self):
+        if self.framed:
+            try:
+                return self.packets.get(False)
+            except Empty:
+                return None
+
         self.gather_bytes()
         if len(self.bytes) == 0:
             return None
@@ -0,0 +1,93 @@
+from threading import Thread, Lock
+from queue import Queue
+from collections import deque
+from time import monotonic
+
+
+class CommandExecutor:
+    def __init__(self, workers=4):
+        self.worker_count = workers
+        self.workers = []
+        self.running = False
+
+        self.ready = Queue()    # handles that have queued commands and no worker running them
+        self.pending = {}       # format {handle: deque([(name, function), ...])}, kept while a command is in flight
+        self.in_flight = {}     # format {handle: (name, start_time)}
+        self.lock = Lock()
+
+        self.completed = 0
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        for _ in range(self.worker_count):
+            worker = Thread(target=self.work, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self, timeout=None):
+        # Waits up to timeout seconds in total for the commands already running, queued ones that haven't started
+        # are dropped
+        self.running = False
+        for _ in self.workers:
+            self.ready.put(None)
+        end = monotonic() + timeout if timeout is not None else None
+        for worker in self.workers:
+            worker.join(None if end is None else max(0, end - monotonic()))
+        self.workers = []
+
+    def get_running(self):
+        return self.running
+
+    def submit(self, handle, name, function, fast=False):
+        # Fast commands run inline unless the handle already has work queued, which would break its ordering
+        with self.lock:
+            inline = not self.running or (fast and handle not in self.pending)
+            if not inline:
+                if handle in self.pending:
+                    self.pending[handle].append((name, function))
+                else:
+                    self.pending[handle] = deque([(name, function)])
+                    self.ready.put(handle)
+        if inline:
+            self.execute(handle, name, function)
+
+    def work(self):
+        while self.running:
+            handle = self.ready.get()
+            if handle is None or not self.running:
+                break
+            with self.lock:
+                name, function = self.pending[handle].popleft()
+            self.execute(handle, name, function)
+            with self.lock:
+                if self.pending[handle]:
+                    self.ready.put(handle)
+                else:
+                    del self.pending[handle]
+
+    def execute(self, handle, name, function):
+        with self.lock:
+            self.in_flight[handle] = (name, monotonic())
+        try:
+            function()
+        except Exception as e:
+            handle.print(f"Error running {name}, Error: {e.__repr__()}")
+        finally:
+            with self.lock:
+                del self.in_flight[handle]
+                self.completed += 1
+
+    def get_in_flight(self):
+        now = monotonic()
+        with self.lock:
+            in_flight = list(self.in_flight.items())
+        return [(handle, name, now - start) for handle, (name, start) in in_flight]
+
+    def get_queued_count(self):
+        with self.lock:
+            return sum(len(i) for i in self.pending.values())
+
+    def get_completed(self):
+        return self.completed
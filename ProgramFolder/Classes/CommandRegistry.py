@@ -0,0 +1,68 @@
+from .functions import remove_chars
+
+
+class CommandRegistry:
+    # Keywords are indexed once per distinct set of ignore chars so a lookup strips the typed name once per set
+    # instead of once per command. Lookups keep the first-registered-wins order of the old linear scans.
+    def __init__(self, commands=None):
+        self.commands = []
+        self.tables = {}    # format {ignore chars: {keyword: [(index, command), ...]}}
+        self.trie = {}      # format {char: {char: ..., None: [(keyword, index, command), ...]}}
+        self.sorted = None
+        for command in commands or []:
+            self.add(command)
+
+    def add(self, command):
+        index = len(self.commands)
+        self.commands.append(command)
+        ignore = tuple(sorted(command["ignore"]))
+        table = self.tables.setdefault(ignore, {})
+        for keyword in command["keywords"]:
+            keyword = keyword.lower()
+            table.setdefault(keyword, []).append((index, command))
+
+            node = self.trie
+            for char in remove_chars(keyword, command["ignore"]):
+                node = node.setdefault(char, {})
+            node.setdefault(None, []).append((keyword, index, command))
+        self.sorted = None
+
+    def find(self, name, check=None):
+        found = None
+        for ignore, table in self.tables.items():
+            for index, command in table.get(remove_chars(name, ignore).lower(), ()):
+                if check and not check(command):
+                    continue
+                if not found or index < found[0]:
+                    found = (index, command)
+                break
+        return found[1] if found else None
+
+    def complete(self, prefix, check=None):
+        node = self.trie
+        for char in prefix.lower():
+            if char in node:
+                node = node[char]
+            elif char not in ["-", "_", " "]:
+                return []
+        out = set()
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            for key, value in node.items():
+                if key is None:
+                    out.update(keyword for keyword, index, command in value if not check or check(command))
+                else:
+                    nodes.append(value)
+        return sorted(out)
+
+    def get_commands(self):
+        return self.commands
+
+    def get_sorted(self):
+        if self.sorted is None:
+            self.sorted = sorted(self.commands, key=lambda i: i["default"])
+        return self.sorted
+
+    def get_size(self):
+        return len(self.commands)
@@ -3,6 +3,7 @@ import curses
 from curses import ascii
 from pyperclip import paste, copy
 from math import ceil
+from os.path import commonprefix
 from typing import List
 from threading import Thread
 import time
@@ -47,6 +48,16 @@ class ConsoleUI(Thread):
         self.obscure_input = False
         self.obscure_char = "*"
 
+        self._event_queue = None
+        self._completion_queue = Queue()
+
+    def set_event_queue(self, event_queue):
+        """
+        Sets the event queue that is posted to whenever the user submits a line of input or asks for completion.
+        :param event_queue: An EventQueue object or None.
+        """
+        self._event_queue = event_queue
+
     def set_obscure(self, obscure, character="*"):
         """
         Sets if the input of the user should be obscured and the character it should be obscured with.
@@ -81,6 +92,42 @@ class ConsoleUI(Thread):
                 break
         return out
 
+    def get_completion_requests(self) -> List[str]:
+        """
+        Get a list of the input lines the user pressed tab on, the caller finds their options and passes them to
+        complete.
+        :return: List of strings from the user.
+        """
+        out = []
+        while self._completion_queue.qsize() > 0:
+            try:
+                out.append(self._completion_queue.get(False))
+            except Empty:
+                break
+        return out
+
+    def complete(self, text: str, options: List[str]):
+        """
+        Completes the command being typed with the given options. Does nothing if the input changed since text.
+        :param text: The input line the options are for.
+        :param options: The commands that can complete the input line.
+        """
+        if not self._running or text != self._input_text or not options:
+            return
+        start = text.rfind(":") + 1
+        start += len(text[start:]) - len(text[start:].lstrip())
+        if len(options) == 1:
+            completed = options[0] + " "
+        else:
+            completed = commonprefix(options)
+            self.print("  ".join(options))
+        if len(completed) <= len(text) - start:
+            return
+        self._input_text = text[:start] + completed
+        self._input_cursor = len(self._input_text)
+        self._select_pos = -1
+        self.hard_update_input()
+
     def wait_get_input(self, timeout: float = None) -> str:
         """
         Waits till user sends input.
@@ -205,6 +252,11 @@ class ConsoleUI(Thread):
                         if curses.ascii.isctrl(inp):
                             if inp == "\n":
                                 self._push_input()
+                            elif inp == "\t":
+                                if not self.obscure_input:
+                                    self._completion_queue.put(self._input_text)
+                                    if self._event_queue:
+                                        self._event_queue.post("console")
                             elif inp == "\b":
                                 self._backspace()
                             elif inp == "\x16":
@@ -421,6 +473,8 @@ class ConsoleUI(Thread):
         self._Input.clrtoeol()
         self._Input.addstr(self._input_prefix)
         self._queue.put(self._input_text)
+        if self._event_queue:
+            self._event_queue.post("console")
         self._input_history.insert(0, self._input_text)
         if len(self._input_history) > self._input_history_cap:
             self._input_history = self._input_history[:self._input_history_cap]
@@ -1,15 +1,34 @@
 from os import path as ospath
-from os import listdir
-from .functions import module_from_file, remove_chars
+from os import listdir, cpu_count
+from .functions import module_from_file, remove_chars, parse_time
 from .EnvManager import EnvManager
+from .UserHandle import SocketUserHandle
+from .RoutingTable import RoutingTable
+from .CommandExecutor import CommandExecutor
+from .EventQueue import EventQueue
+from .LoopStats import LoopStats
+from .CommandRegistry import CommandRegistry
+from .Scrollback import Scrollback
+from .InstanceStore import InstanceStore
+from .BaseController import BaseController
+from .ResourceSampler import ResourceSampler
+from .CpuScheduler import CpuScheduler
+from .MemoryLedger import MemoryLedger
+from .InstanceRegistry import InstanceRegistry
+from .OutputFilter import OutputFilter
+from .RemoteNode import RemoteNode, RemoteController
+from .ProcessHandover import FifoProcess, HandoverFile
 from inspect import getfile
-from json import loads, dumps, decoder
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Thread, RLock
+from time import sleep, localtime, strftime, monotonic
+import re
 from sys import version
 
 
 class ControllerManager:
     commands = []
+    registry = CommandRegistry()
     objects = []
     file = ""
 
@@ -29,7 +48,8 @@ class ControllerManager:
         cls.objects.remove(obj)
 
     @classmethod
-    def add_command(cls, keywords, ignore_chars=None, global_function=False, permission=0, default="", help_info=""):
+    def add_command(cls, keywords, ignore_chars=None, global_function=False, permission=0, default="", help_info="",
+                    fast=False, locked=False):
         if not ignore_chars:
             ignore_chars = []
 
@@ -37,26 +57,27 @@ class ControllerManager:
             default = keywords[0]
 
         def f(func):
-            cls.commands.append({"keywords": keywords, "function": func, "ignore": ignore_chars,
-                                 "global": global_function, "permission": permission, "default": default,
-                                 "help_info": help_info})
+            command = {"keywords": keywords, "function": func, "ignore": ignore_chars, "global": global_function,
+                       "permission": permission, "default": default, "help_info": help_info, "fast": fast,
+                       "locked": locked}
+            cls.commands.append(command)
+            cls.registry.add(command)
             return func
 
         return f
 
     @classmethod
     def find_command(cls, command, global_func=False):
-        for i in cls.commands:
-            temp_name = remove_chars(command, i["ignore"])
-            if temp_name.lower() in i["keywords"]:
-                if not (global_func and not i["global"]):
-                    return i
-        return None
+        return cls.registry.find(command, check=(lambda i: i["global"]) if global_func else None)
 
     @classmethod
     def get_commands(cls, global_func=True):
         return [i for i in cls.commands if not global_func or i["global"]]
 
+    @classmethod
+    def get_registry(cls):
+        return cls.registry
+
     @classmethod
     def get_file(cls):
         if not cls.file:
@@ -77,12 +98,40 @@ class ControllerManager:
             if i:
                 out.append(i)
         return out
+
+    @staticmethod
+    def pop_option(args, name):
+        for index, i in enumerate(args):
+            if remove_chars(i, ["-"]).lower() == name and index + 1 < len(args):
+                value = args[index + 1]
+                del args[index:index + 2]
+                return value
+        return None
+
+    @staticmethod
+    def get_load_score(load):
+        # Fraction of the node's memory budget in use, or running instances per core where there is no budget
+        if load.get("memory_budget"):
+            return load.get("memory_used", 0) / load["memory_budget"]
+        return load.get("running", 0) / max(1, load.get("cpus", 1))
+
+    @classmethod
+    def format_node_line(cls, name, load):
+        budget = load.get("memory_budget")
+        return f"{name}: {load.get('running', 0)}/{load.get('instances', 0)} instance(s) running, " \
+               f"{load.get('cpus', 0)} core(s), {load.get('memory_used', 0)}/" \
+               f"{budget if budget is not None else 'unlimited'} MiB committed, load {cls.get_load_score(load):.2f}"
+
+    @staticmethod
+    def format_log_lines(lines):
+        return "\n".join(f"[{strftime('%Y-%m-%d %H:%M:%S', localtime(t))}] {line}" for t, line in lines)
     # </editor-fold>
 
     # <editor-fold desc="Commands">
     @classmethod
     def init_commands(cls):
         cls.commands = []
+        cls.registry = CommandRegistry()
 
         ignore = ["-", "_", " "]
 
@@ -97,12 +146,26 @@ class ControllerManager:
                 handle.print(user.server)
 
         @cls.add_command(["status"], ignore_chars=ignore, global_function=True,
-                         help_info="Displays some basic info on the status of the server server.")
+                         help_info="Displays some basic info on the status of the server server.", fast=True)
         def status(self, handle, *args, **kwargs):
             handle.print("\n".join(self.get_status()))
 
+        @cls.add_command(["loopstats"], ignore_chars=ignore, global_function=True, permission=1,
+                         help_info="Displays timing histograms for each phase of the main loop and socket server."
+                                   "\n--reset: Clears the collected timings.", fast=True)
+        def loop_stats(self, handle, *args, **kwargs):
+            if "reset" in [remove_chars(i, ignore).lower() for i in args]:
+                self.loop_stats.reset()
+                self.socket_server.get_loop_stats().reset()
+                handle.print("Reset loop stats.")
+                return True
+            handle.print("Main loop:\n" + "\n".join(self.loop_stats.get_lines()))
+            if self.socket_server.get_running():
+                handle.print("Socket server:\n" + "\n".join(self.socket_server.get_loop_stats().get_lines()))
+            return True
+
         @cls.add_command(["help", "h"], ignore_chars=ignore, global_function=True, default="help",
-                         help_info="Use this command to find out how to use a command. Ex: help <command>")
+                         help_info="Use this command to find out how to use a command. Ex: help <command>", fast=True)
         def help(self, handle, *args, controller="", instance="", **kwargs):
             if len(args) < 1:
                 handle.print("Use this command to find out how to use a command. Ex: help <command>\n"
@@ -128,11 +191,13 @@ class ControllerManager:
                                    "\n--reset: Resets the filter entries."
                                    "\n--default <on or off>: Sets the behavior of items that do not have an entry."
                                    "\n--view: Lists filter settings and entries."
+                                   "\n--level <level>: Only shows instance output at or above a level, one of "
+                                   "\nTRACE, DEBUG, INFO, WARN or ERROR."
                                    "\n--allow <controller> <instance>: Adds an allow entry to the filter."
                                    "\n--disallow <controllers> <instance>: Adds a disallow entry to the filter."
                                    "\nBoth 'allow' and 'disallow' add entries to the filter. The instance argument\n"
                                    "is optional. Without it the entry applies to the entire controller but can be\n"
-                                   "overwritten by a specific instance entry.")
+                                   "overwritten by a specific instance entry.", fast=True)
         def filter_(self, handle, *args, controller="", instance="", **kwargs):
             if len(args) == 0:
                 handle.print("Please supply an argument.")
@@ -149,8 +214,18 @@ class ControllerManager:
                 handle.print("Filter added.")
                 return True
 
+            elif args[0] == "level":
+                level = OutputFilter.get_level(args[1]) if len(args) > 1 else None
+                if level is None:
+                    handle.print(f"Error: Level must be one of {', '.join(OutputFilter.levels)}.")
+                    return False
+                handle.set_min_level(level)
+                handle.print(f"Showing instance output at {OutputFilter.get_level_name(level)} and above.")
+                return True
+
             elif "view" in args:
-                out = ["----Settings----", f"Enabled: {handle.is_filtered()}"]
+                out = ["----Settings----", f"Enabled: {handle.is_filtered()}",
+                       f"Level: {OutputFilter.get_level_name(handle.get_min_level())}"]
                 default = handle.get_filter_default()
                 if default:
                     out.append("Default: Enabled")
@@ -201,44 +276,37 @@ class ControllerManager:
                 return True
 
         @cls.add_command(["commands"], ignore_chars=ignore, global_function=True,
-                         help_info="List all available commands in current scope")
+                         help_info="List all available commands in current scope", fast=True)
         def commands(self, handle, *args, controller="", instance="", **kwargs):
             result = []
             if self.is_controller(controller):
-                c = []
-                for command in self.get_commands_from_controller(controller, instance_commands=False):
-                    c.append("-"+command["default"])
+                module = self.server_types[controller]["module"]
+                c = ["-" + command["default"] for command in module.get_registry(class_commands=True).get_sorted()]
                 if len(c) > 0:
                     result.append(f"----{controller} Controller Commands:----")
-                    c.sort()
                     result += c
 
-                c = []
-                for command in self.get_commands_from_controller(controller, class_commands=False):
-                    c.append("-" + command["default"])
+                c = ["-" + command["default"] for command in module.get_registry(class_commands=False).get_sorted()]
                 if len(c) > 0:
                     result.append(f"----{controller} Instance Commands:----")
-                    c.sort()
                     result += c
 
                 result.append("----Global Commands:----")
             else:
                 result.append("----Main Commands----")
-            c = []
-            for command in self.parent_object.get_commands():
-                c.append("-"+command["default"])
-            c.sort()
-            result += c
+            for command in self.parent_object.get_registry().get_sorted():
+                if command["global"]:
+                    result.append("-" + command["default"])
             handle.print("\n".join(result))
 
         @cls.add_command(["clear"], ignore_chars=ignore, global_function=True,
-                         help_info="Clears the console window.")
+                         help_info="Clears the console window.", fast=True)
         def clear(self, handle, *args, **kwargs):
             handle.clear_console()
             return True
 
         @cls.add_command(["message", "m", "msg"], ignore_chars=ignore, global_function=True,
-                         help_info="Send a specified user a message\nEx: message <username> <message>")
+                         help_info="Send a specified user a message\nEx: message <username> <message>", fast=True)
         def message(self, handle, *args, **kwargs):
             if len(args) < 1:
                 handle.print("Error: No username given.")
@@ -255,7 +323,7 @@ class ControllerManager:
             return False
 
         @cls.add_command(["shout", "s"], ignore_chars=ignore, global_function=True,
-                         help_info="Messages all users with a message")
+                         help_info="Messages all users with a message", fast=True)
         def shout(self, handle, *args, **kwargs):
             if len(args) < 1:
                 handle.print("Error: No message given.")
@@ -275,6 +343,13 @@ class ControllerManager:
             self.shutdown()
             return True
 
+        @cls.add_command(["restart", "handover"], ignore_chars=ignore, permission=5, global_function=True,
+                         help_info="Restarts the Server Server in place, running servers are handed over to the new "
+                                   "process instead of being stopped.")
+        def restart(self, handle, *args, **kwargs):
+            self.handover()
+            return True
+
         @cls.add_command(["fullshutdown"], ignore_chars=ignore, permission=5, default="full_shutdown",
                          global_function=True, help_info="Shuts down the Server stopping all servers and completely "
                                                          "reset network configuration to the normal state.")
@@ -288,7 +363,7 @@ class ControllerManager:
                                    "Puts all commands into the scope of specified location and limits view"
                                    " of servers to specified location. \n"
                                    "Use unfocus to return. \n"
-                                   "Ex: focus <controller> <instance> or /<controller>/<instance>:focus")
+                                   "Ex: focus <controller> <instance> or /<controller>/<instance>:focus", fast=True)
         def focus(self, handle, *args, controller="", instance="", **kwargs):
             args = self.join_args(args, [controller, instance])
             if len(args) == 0:
@@ -306,9 +381,10 @@ class ControllerManager:
                     return False
 
             handle.set_focus(c, ins)
+            self.replay_scrollback(handle)
 
         @cls.add_command(["unfocus"], ignore_chars=ignore, global_function=True,
-                         help_info="Returns focus to global focus")
+                         help_info="Returns focus to global focus", fast=True)
         def un_focus(self, handle, *args, **kwargs):
             handle.set_focus("", "")
 
@@ -362,7 +438,8 @@ class ControllerManager:
             return True
         
         @cls.add_command(["getpermissions", "checkpermissions", "checkperms", "perms", "permissions"],
-                         ignore_chars=ignore, global_function=True, help_info="Displays the users current permissions")
+                         ignore_chars=ignore, global_function=True, help_info="Displays the users current permissions",
+                         fast=True)
         def get_permissions(self, handle, *args, **kwargs):
             handle.print(f"Your permission level is {handle.get_permissions()}")
             return True
@@ -418,7 +495,7 @@ class ControllerManager:
             return True
 
         @cls.add_command(["users", "listusers"], ignore_chars=ignore, global_function=True,
-                         help_info="Lists all users currently online.")
+                         help_info="Lists all users currently online.", fast=True)
         def list_users(self, handle, *args, **kwargs):
             users_dup = [i.get_username() for i in self.handle_list if i.get_logged_in()]
             users = []
@@ -432,7 +509,7 @@ class ControllerManager:
 
         @cls.add_command(["loadcontrollers", "loadnewcontrollers", "newcontrollers"],
                          ignore_chars=ignore, global_function=True, permission=5,
-                         help_info="Checks if new controllers exist and loads them.")
+                         help_info="Checks if new controllers exist and loads them.", locked=True)
         def load_server_types(self, handle, *args, **kwargs):
             length = len(self.get_server_names())
             self.load_server_types()
@@ -441,12 +518,12 @@ class ControllerManager:
 
         @cls.add_command(["getcontrollers", "printcontrollers", "listcontrollers", "controllers"],
                          ignore_chars=ignore, global_function=True, permission=1,
-                         help_info="Lists of all controllers.")
+                         help_info="Lists of all controllers.", fast=True)
         def get_server_names(self, handle, *args, **kwargs):
             handle.print("\n".join([str(i[0] + 1) + ": " + i[1] for i in enumerate(self.get_server_names())]))
 
         @cls.add_command(["reloadcontrollers"], ignore_chars=ignore, global_function=True, permission=5,
-                         help_info="Reloads all controllers to update command code.")
+                         help_info="Reloads all controllers to update command code.", locked=True)
         def reload_all_controllers(self, handle, *args, **kwargs):
             for i in self.get_server_names():
                 self.console.print("Reloading " + i)
@@ -455,7 +532,7 @@ class ControllerManager:
 
         @cls.add_command(["reloadcontroller"], ignore_chars=ignore, global_function=True, permission=5,
                          help_info="Reloads a controller from file to update command code."
-                                   "\nEx: reloadcontroller <controller>")
+                                   "\nEx: reloadcontroller <controller>", locked=True)
         def reload_controller(self, handle, *args, controller="", **kwargs):
             args = self.join_args(args, [controller])
             if len(args) < 1:
@@ -476,11 +553,28 @@ class ControllerManager:
 
         @cls.add_command(["createserver", "makeserver", "createinstance", "makeinstance", "mkserver", "mkinstance"],
                          ignore_chars=ignore, global_function=True, permission=4,
-                         help_info="Creates an instance with a given name of a given controller type"
-                                   "\n Ex: createinstance <controller> <name> <additional args>")
+                         help_info="Creates an instance with a given name of a given controller type on the least "
+                                   "loaded node, --node picks one (\"local\" for this one)"
+                                   "\n Ex: createinstance <controller> <name> <additional args> --node <node>",
+                         locked=True)
         def create_instance(self, handle, *args, controller="", **kwargs):
             args = self.join_args(args, [controller])
+            node_name = self.pop_option(args, "node")
             if len(args) > 1:
+                if node_name and node_name != "local" and node_name not in self.nodes:
+                    handle.print(f"Error: Cannot find node with name: {node_name}.")
+                    return False
+                if node_name:
+                    node = self.nodes.get(node_name)
+                else:
+                    node = self.pick_node(args[0])
+                if node:
+                    if self.get_instance_from_type_and_name(args[0], args[1]):
+                        handle.print(f"Error: {args[0]}/{args[1]} already exists.")
+                        return False
+                    handle.print(f"Creating instance of {args[0]} with name {args[1]} on {node.get_name()}.")
+                    node.send_command(handle, [], "createinstance", [args[0], args[1], *args[2:], "--node", "local"])
+                    return True
                 if self.create_instance(args[0], args[1], *args[2:]):
                     handle.print(f"Created instance of {args[0]} with name {args[1]}.")
                     return True
@@ -490,7 +584,7 @@ class ControllerManager:
         @cls.add_command(["removeinstance", "deleteinstance", "removeserver", "deleteserver", "rminstance", "rmserver"],
                          ignore_chars=ignore, permission=4,
                          help_info="Deletes an instance if it is not running"
-                                   "\nEx: removeinstance <controller> <instance>")
+                                   "\nEx: removeinstance <controller> <instance>", locked=True)
         def remove_instance(self, handle, *args, controller="", instance="", **kwargs):
             args = self.join_args(args, [controller, instance])
             if len(args) < 2:
@@ -503,6 +597,10 @@ class ControllerManager:
             if not m:
                 handle.print(f"Error: Cannot find instance with name: {args[1]}.")
                 return False
+            if m.remote:
+                # The agent replies to the user itself and its next status drops the proxy
+                m.remove(handle)
+                return True
             if m.get_running():
                 handle.print(f"Error: Cannot delete {args[0]}/{args[1]} while it is already running.")
             else:
@@ -512,7 +610,8 @@ class ControllerManager:
             handle.print("Error: invalid arguments.")
 
         @cls.add_command(["saveinstances", 'saveservers'], ignore_chars=ignore, global_function=True, permission=2,
-                         help_info="Saves instance config to file, done automatically on shutdown.")
+                         help_info="Writes every instance's config to file now, changes are otherwise saved "
+                                   "automatically within a few seconds.")
         def save(self, handle, *args, **kwargs):
             if self.save_instances_to_file():
                 handle.print("Saved instances to file.")
@@ -521,16 +620,19 @@ class ControllerManager:
             return False
 
         @cls.add_command(["listinstances", "printinstances", "listservers", "instances", "servers"],
-                         ignore_chars=ignore, global_function=True, permission=1, help_info="Lists all instances")
+                         ignore_chars=ignore, global_function=True, permission=1, help_info="Lists all instances",
+                         fast=True)
         def list_instances(self, handle, *args, controller="", **kwargs):
             out = []
 
             for i in self.get_server_names():
                 if controller and controller != i:
                     continue
-                instances = self.get_names_of_server_from_type(i)
-                for name in instances:
-                    out.append(f"{i}: {name}")
+                for ins in self.instance_registry.get_instances(i):
+                    if ins.remote:
+                        out.append(f"{i}: {ins.get_name()} ({ins.get_node().get_name()})")
+                    else:
+                        out.append(f"{i}: {ins.get_name()}")
             if len(out) == 0:
                 handle.print("No instances to list.")
                 return False
@@ -539,7 +641,8 @@ class ControllerManager:
             return True
 
         @cls.add_command(["instanceinfo", "serverinfo"], ignore_chars=ignore, global_function=True, permission=1,
-                         help_info="Lists info of a given server.\nEx: instanceinfo <controller> <instance>")
+                         help_info="Lists info of a given server.\nEx: instanceinfo <controller> <instance>",
+                         fast=True)
         def instance_info(self, handle, *args, controller="", instance="", **kwargs):
             args = self.join_args(args, [controller, instance])
             if len(args) < 2:
@@ -556,11 +659,146 @@ class ControllerManager:
                      f"\nController: {args[0]}"\
                      f"\nRunning: {m.get_running()}"\
                      f"\nAddress: {m.get_address()}"
+            if self.memory_ledger.get_committed(m):
+                output += f"\nMemory committed: {self.memory_ledger.get_committed(m)} MiB"
+            elif self.memory_ledger.get_queue_position(m):
+                output += f"\nQueued to start at position {self.memory_ledger.get_queue_position(m)}"
+            cpus = self.cpu_scheduler.get_placement(m)
+            if cpus:
+                output += f"\nCPUs: {CpuScheduler.format_cpus(cpus)} ({self.cpu_scheduler.get_policy()})"
+            for line in m.get_resource_lines() + m.get_output_lines():
+                output += f"\n{line}"
             instance_info = m.get_info()
             if instance_info:
                 output += f"\n{instance_info}"
             handle.print(output)
 
+        @cls.add_command(["tail"], ignore_chars=ignore, global_function=True, permission=1,
+                         help_info="Shows the most recent lines from an instance's output log."
+                                   "\nEx: tail <controller> <instance> <lines>")
+        def tail(self, handle, *args, controller="", instance="", **kwargs):
+            args = self.join_args(args, [controller, instance])
+            log = self.get_instance_log(handle, args)
+            if not log:
+                return False
+            try:
+                count = min(int(args[2]), 1000) if len(args) > 2 else 20
+            except ValueError:
+                handle.print(f"Error: '{args[2]}' is not a number.")
+                return False
+            handle.print(self.format_log_lines(log.tail(count)))
+            return True
+
+        @cls.add_command(["logs"], ignore_chars=ignore, global_function=True, permission=1,
+                         help_info="Shows an instance's output log from a given time."
+                                   "\nThe time can be an age such as 30s, 15m, 2h, 3d or a date like 2021-06-01T13:30"
+                                   "\nEx: logs <controller> <instance> --since <time>")
+        def logs(self, handle, *args, controller="", instance="", **kwargs):
+            args = self.join_args(args, [controller, instance])
+            since = self.pop_option(args, "since")
+            if not since and len(args) > 2:
+                since = args[2]
+            log = self.get_instance_log(handle, args)
+            if not log:
+                return False
+            start_time = parse_time(since) if since else 0
+            if start_time is None:
+                handle.print(f"Error: Cannot parse time '{since}'.")
+                return False
+            lines = log.since(start_time)
+            if not lines:
+                handle.print("No lines found.")
+                return True
+            handle.print(self.format_log_lines(lines))
+            return True
+
+        @cls.add_command(["grep", "searchlogs"], ignore_chars=ignore, global_function=True, permission=1,
+                         help_info="Searches an instance's output log with a regular expression, newest matches "
+                                   "are shown.\nEx: grep <controller> <instance> <pattern> --since <time>")
+        def grep(self, handle, *args, controller="", instance="", **kwargs):
+            args = self.join_args(args, [controller, instance])
+            since = self.pop_option(args, "since")
+            log = self.get_instance_log(handle, args)
+            if not log:
+                return False
+            if len(args) < 3:
+                handle.print("Error: No pattern given.")
+                return False
+            try:
+                pattern = re.compile(" ".join(args[2:]))
+            except re.error as e:
+                handle.print(f"Error: Invalid pattern, {e}.")
+                return False
+            start_time = parse_time(since) if since else 0
+            if start_time is None:
+                handle.print(f"Error: Cannot parse time '{since}'.")
+                return False
+            lines = log.grep(pattern, start_time=start_time)
+            if not lines:
+                handle.print("No matches found.")
+                return True
+            handle.print(self.format_log_lines(lines))
+            return True
+
+        @cls.add_command(["outputfilter", "dropfilter"], ignore_chars=ignore, global_function=True, permission=3,
+                         help_info="Manages the patterns of an instance's output lines that are never sent to "
+                                   "users, they are still written to the instance's log.\nThere are multiple modes:"
+                                   "\n--list: Lists the patterns."
+                                   "\n--add <pattern>: Adds a regular expression."
+                                   "\n--remove <number>: Removes the pattern with the number shown by list."
+                                   "\n--clear: Removes every pattern added to the instance."
+                                   "\nEx: outputfilter <controller> <instance> add Can't keep up!")
+        def output_filter(self, handle, *args, controller="", instance="", **kwargs):
+            args = self.join_args(args, [controller, instance])
+            if len(args) < 2:
+                handle.print("Error: Requires 2 arguments.")
+                return False
+            if args[0] not in self.get_server_names():
+                handle.print(f"Error: Cannot find controller with name: {args[0]}.")
+                return False
+            m = self.get_instance_from_type_and_name(args[0], args[1])
+            if not m:
+                handle.print(f"Error: Cannot find instance with name: {args[1]}.")
+                return False
+            if m.remote:
+                return m.run_command("outputfilter", handle, *args[2:])
+            output_filter = m.get_output_filter()
+            mode = args[2] if len(args) > 2 else "list"
+
+            if mode == "add":
+                if len(args) < 4:
+                    handle.print("Error: No pattern given.")
+                    return False
+                try:
+                    output_filter.add_pattern(" ".join(args[3:]))
+                except re.error as e:
+                    handle.print(f"Error: Invalid pattern, {e}.")
+                    return False
+                handle.print("Pattern added.")
+                return True
+            elif mode == "remove":
+                try:
+                    index = int(args[3]) - 1 if len(args) > 3 else -1
+                except ValueError:
+                    index = -1
+                if not output_filter.remove_pattern(index):
+                    handle.print("Error: Give the number of a pattern from list.")
+                    return False
+                handle.print("Pattern removed.")
+                return True
+            elif mode == "clear":
+                output_filter.clear_patterns()
+                handle.print("Patterns cleared.")
+                return True
+
+            out = [f"{i + 1}: {v}" for i, v in enumerate(output_filter.get_patterns())]
+            base = output_filter.get_base_patterns()
+            if base:
+                out.append("----Controller and config patterns----")
+                out += base
+            handle.print("\n".join(out) if out else "No patterns.")
+            return True
+
         @cls.add_command(["start"], ignore_chars=ignore, global_function=True, permission=3,
                          help_info="Starts an instance.\nEx: start <controller> <instance>")
         def start_instance(self, handle, *args, controller="", instance="", **kwargs):
@@ -576,11 +814,12 @@ class ControllerManager:
                 handle.print(f"Error: Cannot find instance with name: {args[1]}.")
                 return False
 
-            if m.get_running():
+            if m.remote:
+                m.start(handle)
+            elif m.get_running():
                 handle.print(f"Error: {args[0]}/{args[1]} is already running.")
             else:
-                m.start()
-                handle.print(f"Starting {args[0]}/{args[1]}.")
+                handle.print(self.request_start(m)[1])
 
         @cls.add_command(["setup"], ignore_chars=ignore, global_function=True, permission=3,
                          help_info="Runs the setup of an instance without running it if possible."
@@ -598,6 +837,9 @@ class ControllerManager:
                 handle.print(f"Error: Cannot find instance with name: {args[1]}.")
                 return False
 
+            if m.remote:
+                m.setup(handle)
+                return True
             if m.get_running():
                 handle.print(f"Error: {args[0]}/{args[1]} is running.")
                 return False
@@ -606,7 +848,7 @@ class ControllerManager:
             return True
 
         @cls.add_command(["stop"], ignore_chars=ignore, global_function=True, permission=3,
-                         help_info="Stops an instance.\nEx: stop <controller> <instance>")
+                         help_info="Stops an instance.\nEx: stop <controller> <instance>", fast=True)
         def stop_instance(self, handle, *args, controller="", instance="", **kwargs):
             args = self.join_args(args, [controller, instance])
             if len(args) < 2:
@@ -620,13 +862,28 @@ class ControllerManager:
                 handle.print(f"Error: Cannot find instance with name: {args[1]}.")
                 return False
 
+            if m.remote:
+                m.stop(handle)
+                return True
             if not m.get_running():
+                if self.memory_ledger.dequeue(m):
+                    handle.print(f"Removed {args[0]}/{args[1]} from the start queue.")
+                    return True
                 handle.print(f"Error: {args[0]}/{args[1]} is not running.")
                 return False
             m.stop()
             handle.print(f"Stopping {args[0]}/{args[1]}.")
             return True
 
+        @cls.add_command(["nodes", "agents", "listnodes"], ignore_chars=ignore, global_function=True, permission=1,
+                         help_info="Lists this node and every connected agent with its load.", fast=True)
+        def list_nodes(self, handle, *args, **kwargs):
+            out = [self.format_node_line("local", self.get_load())]
+            for name, node in list(self.nodes.items()):
+                out.append(self.format_node_line(name, node.get_load()))
+            handle.print("\n".join(out))
+            return True
+
     # </editor-fold>
 
     def __init__(self, ConsoleObj, handle_list, port_handler, env_path, socket_server, user_data, gui, config):
@@ -639,8 +896,9 @@ class ControllerManager:
         self.server_types = {}  # format {type: {"module": module, "file": filename}}
 
         self.instances_data_file = ""
+        self.instance_store = InstanceStore(flush_interval=config.get("instanceSaveInterval", 2))
         self.server_dir = ""
-        self.instances = {}     # format {type: [instance1, instance2, ...]}
+        self.instance_registry = InstanceRegistry()
 
         self.env_manager = EnvManager(env_path)
         self.socket_server = socket_server
@@ -649,16 +907,55 @@ class ControllerManager:
 
         self.config = config
         self.handle_list = handle_list
+        self.routing_table = RoutingTable()
+        self.scrollback = Scrollback(config.get("globalScrollbackBytes", 1048576))
+        self.instance_scrollback = {}   # format {(type, name): Scrollback}
+        for handle in self.handle_list:
+            self.add_handle(handle, append=False)
+
+        self.event_queue = EventQueue()
+        self.loop_stats = LoopStats()
+        self.command_executor = CommandExecutor(config.get("commandWorkers", 4))
+        # Held by commands that add, remove or reload instances and controllers so two workers never interleave them
+        self.state_lock = RLock()
+        self.command_executor.start()
+        self.cpu_scheduler = CpuScheduler(config.get("cpuPolicy", "none"), config.get("cpuCoresPerInstance", 0),
+                                          config.get("instanceNice", 0))
+        self.memory_ledger = MemoryLedger(config.get("memoryBudget", 0), config.get("memoryReserve", 1024))
+        self.nodes = {}     # format {agent name: RemoteNode}
+        self.output_listeners = []
+        # Scrollback counts as a subscriber so users that connect later still get recent lines at this level
+        self.scrollback_level = OutputFilter.get_level(config.get("scrollbackMinLevel", "INFO"))
 
         self.reload_needed = False
         self.shutdown_needed = False
+        self.handover_needed = False
+        self.unadopted_records = []     # handover records of servers no instance re-attached to
 
     def get_handle_list(self):
         return self.handle_list
 
+    def add_handle(self, handle, append=True):
+        if append:
+            self.handle_list.append(handle)
+        handle.set_route_callback(self.routing_table.update_handle)
+        self.routing_table.add_handle(handle)
+
+    def remove_handle(self, handle):
+        if handle in self.handle_list:
+            self.handle_list.remove(handle)
+        handle.set_route_callback(None)
+        self.routing_table.remove_handle(handle)
+        node = self.get_node_from_handle(handle)
+        if node:
+            self.remove_node(node)
+
     def get_config(self):
         return self.config
 
+    def get_console(self):
+        return self.console
+
     def get_user_data(self):
         return self.user_data
 
@@ -668,11 +965,26 @@ class ControllerManager:
     def get_env_manager(self):
         return self.env_manager
 
+    def get_event_queue(self):
+        return self.event_queue
+
+    def get_loop_stats(self):
+        return self.loop_stats
+
     def reload(self):
         self.reload_needed = True
+        self.event_queue.post("manager")
 
     def shutdown(self):
         self.shutdown_needed = True
+        self.event_queue.post("manager")
+
+    def handover(self):
+        self.handover_needed = True
+        self.shutdown()
+
+    def get_handover_needed(self):
+        return self.handover_needed
 
     def get_reload_needed(self):
         return self.reload_needed
@@ -691,22 +1003,74 @@ class ControllerManager:
 
     def run_command(self, name, handle, *args, **kwargs):
         path_given = "module_name" in kwargs or "controller" in kwargs
-        for i in self.parent_object.commands:
-            temp_name = remove_chars(name, i["ignore"])
-            if temp_name.lower() in i["keywords"]:
-                if handle.get_permissions() < i["permission"]:
-                    handle.print("You don't have permission to run that command")
-                    return True
-                if path_given:
-                    if not i["global"]:
-                        continue
-                try:
-                    i["function"](self, handle, *args, **kwargs)
-                    return True
-                except Exception as e:
-                    handle.print(f"Error running {name}, Error: {e.__repr__()}")
-                    return True
-        return False
+        i = self.parent_object.find_command(name, global_func=path_given)
+        if not i:
+            return False
+        if handle.get_permissions() < i["permission"]:
+            handle.print("You don't have permission to run that command")
+            return True
+        try:
+            i["function"](self, handle, *args, **kwargs)
+        except Exception as e:
+            handle.print(f"Error running {name}, Error: {e.__repr__()}")
+        return True
+
+    def complete_command(self, handle, text):
+        text = handle.get_focus_prefix() + text
+        path = []
+        if text.startswith("/"):
+            if ":" not in text:
+                return []
+            spl = text.split(":")
+            path = [i for i in spl[0].split("/") if len(i) > 0]
+            text = ":".join(spl[1:])
+        if " " in text.lstrip():
+            return []
+        text = text.lstrip()
+
+        permissions = handle.get_permissions()
+        options = []
+        if len(path) > 0 and path[0] in self.server_types:
+            module = self.server_types[path[0]]["module"]
+            registry = module.get_registry(class_commands=len(path) == 1)
+            options += registry.complete(text, check=lambda i: i["permission"] <= permissions)
+        options += self.parent_object.get_registry().complete(
+            text, check=lambda i: i["permission"] <= permissions and (i["global"] or not path))
+        return sorted(set(options))
+
+    def get_command_executor(self):
+        return self.command_executor
+
+    def submit_command(self, handle, name, function, path=None):
+        # function is called with the path it runs in. Without one that's the handle's focus when the command is
+        # dispatched rather than when it's submitted, so a focus queued ahead of it still applies
+        def get_path():
+            return path if path is not None else [i for i in handle.get_focus() if i]
+
+        def dispatch():
+            path_ = get_path()
+            c_ = self.find_submitted_command(name, *path_[:2])
+            if c_ and c_.get("locked", False):
+                with self.state_lock:
+                    function(path_)
+            else:
+                function(path_)
+
+        # Only commands with nothing queued ahead of them run inline, so for those the focus can't change in between
+        c = self.find_submitted_command(name, *get_path()[:2])
+        self.command_executor.submit(handle, name, dispatch, fast=bool(c) and c.get("fast", False))
+
+    def find_submitted_command(self, name, controller="", instance=""):
+        c = None
+        if controller:
+            c = self.find_command_from_controller(controller, name, class_commands=not instance,
+                                                  instance_commands=bool(instance))
+        if not c:
+            c = self.find_command(name, global_func=bool(controller))
+        return c
+
+    def get_state_lock(self):
+        return self.state_lock
 
     def run_command_on_server_type(self, server_type, name, user, *args, **kwargs):
         if server_type not in self.server_types:
@@ -750,6 +1114,171 @@ class ControllerManager:
     def get_instance_data_file(self):
         return self.instances_data_file
 
+    def set_instance_data_dir(self, dir_):
+        self.instance_store.set_directory(dir_)
+
+    def get_instance_store(self):
+        return self.instance_store
+
+    def get_cpu_scheduler(self):
+        return self.cpu_scheduler
+
+    def process_started(self, instance, process):
+        self.cpu_scheduler.add(instance, process.pid)
+        self.instance_registry.set_state(instance, "running")
+
+    def process_stopped(self, instance):
+        self.cpu_scheduler.remove(instance)
+
+    # <editor-fold desc="Agents">
+    def get_nodes(self):
+        return self.nodes
+
+    def get_node_from_handle(self, handle):
+        for node in self.nodes.values():
+            if node.get_handle() is handle:
+                return node
+        return None
+
+    def get_load(self):
+        running = 0
+        count = 0
+        for ins in self.instance_registry.get_instances():
+            if not ins.remote:
+                count += 1
+                running += ins.get_running()
+        cpus = len(self.cpu_scheduler.cpus) or cpu_count() or 1
+        return {"instances": count, "running": running, "cpus": cpus,
+                "memory_used": self.memory_ledger.get_used(), "memory_budget": self.memory_ledger.get_budget()}
+
+    def pick_node(self, type_):
+        # None means this node, agents only count if they have the controller loaded
+        best = None
+        best_score = self.get_load_score(self.get_load()) if type_ in self.server_types else None
+        for node in self.nodes.values():
+            if type_ not in node.get_controllers():
+                continue
+            score = self.get_load_score(node.get_load())
+            if best_score is None or score < best_score:
+                best = node
+                best_score = score
+        return best
+
+    def agent_packet(self, handle, packet):
+        node = self.get_node_from_handle(handle)
+        if packet["type"] == "agent_register":
+            if handle.get_permissions() < self.config.get("agentPermission", 5):
+                handle.print("Error: You don't have permission to register as an agent")
+                return
+            name = str(packet.get("name", "")) or handle.get_username()
+            if node:
+                self.remove_node(node)
+            if name in self.nodes:
+                self.remove_node(self.nodes[name])
+            node = RemoteNode(name, handle)
+            self.nodes[name] = node
+            # Agents get their instances' output from update_node, not from everything broadcast to users
+            handle.set_route_callback(None)
+            self.routing_table.remove_handle(handle)
+            self.update_node(node, packet)
+            self.print_all(f"Agent {name} registered with {len(node.get_instances())} instance(s)")
+        elif not node:
+            return
+        elif packet["type"] == "agent_status":
+            self.update_node(node, packet)
+        elif packet["type"] == "agent_output":
+            instance = node.handle_output(packet)
+            if instance:
+                self.instance_registry.mark_active(instance)
+            self.event_queue.post("output")
+
+    def update_node(self, node, packet):
+        node.update(packet)
+        instances = node.get_instances()
+        seen = set()
+        for data in packet.get("instances", []):
+            key = (data.get("type"), data.get("name"))
+            if not self.instance_registry.has_type(key[0]):
+                continue
+            seen.add(key)
+            remote = instances.get(key)
+            if not remote:
+                if self.get_instance_from_type_and_name(*key):
+                    # A local instance or another agent already uses the name
+                    continue
+                remote = RemoteController(node, *key, self.config)
+                instances[key] = remote
+                self.instance_registry.add(remote)
+            remote.update(data)
+            self.instance_registry.set_state(remote, "running" if remote.get_running() else "stopped")
+        for key in [i for i in instances if i not in seen]:
+            self.remove_remote_instance(instances.pop(key))
+
+    def remove_node(self, node):
+        for remote in node.get_instances().values():
+            self.remove_remote_instance(remote)
+        node.get_instances().clear()
+        # Replies to commands still in flight can't arrive anymore
+        node.clear_pending()
+        if self.nodes.get(node.get_name()) is node:
+            del self.nodes[node.get_name()]
+            self.print_all(f"Agent {node.get_name()} disconnected")
+
+    def remove_remote_instance(self, remote):
+        self.instance_registry.remove(remote)
+
+    def add_output_listener(self, callback):
+        self.output_listeners.append(callback)
+
+    def get_output_level(self, focus):
+        # The lowest level an instance's lines are wanted at, None if nothing would receive them at all
+        if self.output_listeners:
+            return 0
+        levels = [i for i in [self.routing_table.get_min_level(focus), self.scrollback_level] if i is not None]
+        return min(levels, default=None)
+    # </editor-fold>
+
+    def get_memory_ledger(self):
+        return self.memory_ledger
+
+    def request_start(self, instance):
+        # Returns (started, message), a start that doesn't fit in the memory budget is queued or refused
+        name = f"{instance.type}/{instance.get_name()}"
+        if instance.remote:
+            # The agent accounts for its own memory
+            instance.start()
+            return True, f"Sent start of {name} to {instance.get_node().get_name()}."
+        memory = instance.get_memory()
+        ledger = self.memory_ledger
+        if ledger.admit(instance, memory):
+            instance.start()
+            return True, f"Starting {name}."
+        budget = ledger.get_budget()
+        if budget is not None and memory > budget:
+            return False, f"Error: {name} needs {memory} MiB but the memory budget is only {budget} MiB."
+        if not self.config.get("queueStarts", True):
+            return False, f"Error: Not enough memory to start {name}, {ledger.get_used()}/{budget} MiB committed."
+        ledger.enqueue(instance, memory, lambda: self.start_queued(instance))
+        return False, f"Not enough memory to start {name} yet, " \
+                      f"queued at position {ledger.get_queue_position(instance)}."
+
+    def start_queued(self, instance):
+        instance.add_to_queue("Memory is available, starting queued instance")
+        instance.start()
+
+    def running_changed(self, instance, running):
+        # Running until its process is attached, see process_started
+        self.instance_registry.set_state(instance, "starting" if running else "stopped")
+        if running:
+            self.memory_ledger.commit(instance, instance.get_memory())
+            return
+        for callback in self.memory_ledger.release(instance):
+            callback()
+
+    def instance_changed(self, instance):
+        if self.instance_registry.get(instance.type, instance.get_name()) is instance:
+            self.instance_store.mark(instance.type, instance.get_name(), instance.get_data())
+
     def get_server_names(self):
         return list(self.server_types.keys())
 
@@ -762,37 +1291,42 @@ class ControllerManager:
         return server in self.get_names_of_server_from_type(controller)
 
     def get_names_of_server_from_type(self, type_):
-        if type_ not in self.instances:
-            return []
-        return [i.get_name() for i in self.instances[type_]]
+        return self.instance_registry.get_names(type_)
 
     def get_instance_from_type_and_name(self, type_, name):
-        if type_ not in self.instances:
-            return
-        list_ = self.instances[type_]
-        for i in list_:
-            if i.get_name() == name:
-                return i
+        return self.instance_registry.get(type_, name)
+
+    def get_instance_registry(self):
+        return self.instance_registry
+
+    def output_ready(self, instance):
+        self.instance_registry.mark_active(instance)
+        self.event_queue.post("output")
 
     def load_server_types(self):
         if not self.server_types_dir:
             return False
-        files = listdir(self.server_types_dir)
-        loaded_files = [self.server_types[i]["file"] for i in self.server_types]
-        for file in files:
-            if file.endswith(".py"):
-                if file not in loaded_files:
-                    try:
-                        module = module_from_file(ospath.join(self.server_types_dir, file), "Controller")
-                        module.set_manager(self)
-                        module.init_class()
-                        self.server_types[module.type] = {"module": module, "file": file}
-                    except AttributeError:
-                        pass
-        self.init_instance_storage()
+        with self.state_lock:
+            files = listdir(self.server_types_dir)
+            loaded_files = [self.server_types[i]["file"] for i in self.server_types]
+            for file in files:
+                if file.endswith(".py"):
+                    if file not in loaded_files:
+                        try:
+                            module = module_from_file(ospath.join(self.server_types_dir, file), "Controller")
+                            module.set_manager(self)
+                            module.init_class()
+                            self.server_types[module.type] = {"module": module, "file": file}
+                        except AttributeError:
+                            pass
+            self.init_instance_storage()
         return True
 
     def reload_type(self, name, c=None):
+        with self.state_lock:
+            return self._reload_type(name)
+
+    def _reload_type(self, name):
         if name in self.server_types:
             ty = self.server_types[name]
             file = ty["file"]
@@ -802,7 +1336,6 @@ class ControllerManager:
 
             try:
                 new_mod = module_from_file(ospath.join(self.server_types_dir, file), "Controller")
-                new_mod.reset_commands()
                 new_mod.set_manager(self)
                 new_mod.set_objects(obj)
                 new_mod.init_class()
@@ -816,132 +1349,345 @@ class ControllerManager:
 
     def init_instance_storage(self):
         for i in self.get_server_names():
-            if i not in self.instances:
-                self.instances[i] = []
+            self.instance_registry.add_type(i)
 
     def _create_instance_r(self, type_, name, data, *args):
         if type_ not in self.get_server_names():
             return
-        if name in self.get_names_of_server_from_type(type_):
+        if self.instance_registry.has(type_, name):
             return
         m = self.server_types[type_]["module"](name, data, self.port_handler(), *args)
         return m
 
     def create_instance(self, type_, name, *args):
-        m = self._create_instance_r(type_, name, None, *args)
-        if m:
-            self.instances[type_].append(m)
-            return True
+        # The existence check and the add happen under one lock, two creates of the same name can't both pass it
+        with self.state_lock:
+            m = self._create_instance_r(type_, name, None, *args)
+            if m and self.instance_registry.add(m):
+                self.instance_changed(m)
+                return True
         return False
 
     def remove_instance(self, type_, name):
+        with self.state_lock:
+            return self._remove_instance(type_, name)
+
+    def _remove_instance(self, type_, name):
         if type_ not in self.get_server_names():
             return False
 
-        for index, instance in enumerate(self.instances[type_]):
-            if instance.get_name() == name:
-                if not instance.get_running():
-                    instance.remove()
-                    del self.instances[type_][index]
-                    return True
+        instance = self.instance_registry.get(type_, name)
+        if not instance:
+            return False
+        if instance.remote:
+            # The agent removes it and its next status drops the proxy
+            instance.remove()
+            return True
+        if not instance.get_running():
+            self.memory_ledger.dequeue(instance)
+            instance.remove()
+            self.instance_registry.remove(instance)
+            self.instance_scrollback.pop((type_, name), None)
+            self.instance_store.mark_removed(type_, name)
+            return True
         return False
 
     def load_instances_from_file(self):
-        file = open(self.instances_data_file, "r")
-        try:
-            data = loads(file.read())
-        except IOError:
-            return False
-        except decoder.JSONDecodeError:
-            return False
-        file.close()
+        store = self.instance_store
+        # Started first so changes are written behind even if nothing could be restored
+        if not store.is_alive():
+            store.start()
+        if not store.has_records() and ospath.isfile(self.instances_data_file):
+            if not store.import_file(self.instances_data_file):
+                self.console.print(f"Failed to import instances from '{self.instances_data_file}'")
+                return False
 
         self.init_instance_storage()
 
-        for i in data:
-            list_ = data[i]
-            for instance in list_:
-                ins = self._create_instance_r(i, instance["name"], instance["data"])
-                if ins:
-                    self.instances[i].append(ins)
+        # Instances only reserve their ports here, forwarding and dns records are done afterwards in the background
+        # so every instance is listed right away with an "address pending" address
+        self.port_handler.set_defer_provisioning(True)
+        try:
+            with ThreadPoolExecutor(max_workers=self.config.get("instanceRestoreWorkers", 8)) as pool:
+                futures = {pool.submit(self._create_instance_r, type_, name, data): type_
+                           for type_, name, data in store.get_records() if self.instance_registry.has_type(type_)}
+                # Each instance is listed as soon as it's built instead of once the slowest one is
+                for future in as_completed(futures):
+                    try:
+                        ins = future.result()
+                    except Exception as e:
+                        self.console.print(f"Failed to restore an instance of {futures[future]}, "
+                                           f"Error: {e.__repr__()}")
+                        continue
+                    if ins:
+                        self.instance_registry.add(ins)
+        finally:
+            self.port_handler.set_defer_provisioning(False)
+        Thread(target=self.port_handler.provision_pending, daemon=True).start()
+
+        adopted = self.adopt_instances()
+        if adopted:
+            self.console.print(f"Re-attached to {adopted} running server(s)")
         return True
 
     def save_instances_to_file(self):
-        data = {}
-
-        for i in self.get_server_names():
-            data[i] = []
+        for instance in self.instance_registry.get_instances():
+            if not instance.remote:
+                self.instance_store.mark(instance.type, instance.get_name(), instance.get_data())
+        try:
+            self.instance_store.flush()
+        except OSError:
+            return False
+        return self.instance_store.get_dirty_count() == 0
+
+    def print_all(self, value, focus=None, level=None):
+        if level is None or (self.scrollback_level is not None and level >= self.scrollback_level):
+            self.add_scrollback(value, focus)
+        self.broadcast(self.routing_table.get_recipients(focus, level), value)
+
+    def add_scrollback(self, value, focus=None):
+        value = str(value)
+        self.scrollback.append(value, focus)
+        if focus:
+            scrollback = self.instance_scrollback.get(focus)
+            if not scrollback:
+                scrollback = Scrollback(self.config.get("scrollbackBytes", 262144))
+                self.instance_scrollback[focus] = scrollback
+            scrollback.append(value)
+
+    def replay_scrollback(self, handle):
+        # Sent as one message so a client catching up costs one packet instead of one per line
+        focus = handle.get_focus()
+        if focus[1]:
+            scrollback = self.instance_scrollback.get(focus)
+            lines = scrollback.get_lines() if scrollback else []
+        else:
+            lines = self.scrollback.get_lines(check=lambda i: RoutingTable.accepts(handle, i))
+        if lines:
+            handle.print("\n".join(lines))
 
-        for i in self.instances:
-            list_ = self.instances[i]
-            for instance in list_:
-                data[i].append({"name": instance.get_name(), "data": instance.get_data()})
+    def print(self, username, value, focus=None):
+        users = [user for user in self.handle_list if user.get_logged_in() and user.get_username() == username]
+        self.broadcast([user for user in users if RoutingTable.accepts(user, focus)], value)
+        return len(users) > 0
+
+    def broadcast(self, handles, value):
+        connections = []
+        for handle in handles:
+            connection = handle.get_connection()
+            if connection:
+                connections.append(connection)
+            else:
+                handle.print(value)
+        if connections:
+            self.socket_server.broadcast(SocketUserHandle.text_packet(value), connections)
 
-        file = open(self.instances_data_file, "w")
-        file.write(dumps(data))
-        file.close()
-        return True
+    def flush_servers(self):
+        # Only instances that queued output since the last flush are visited
+        flushed = 0
+        for instance in self.instance_registry.pop_active():
+            items = instance.get_queue()
+            focus = (instance.type, instance.get_name())
+            for item, level in items:
+                self.print_all(item, focus=focus, level=level)
+            flushed += len(items)
+            if items and not instance.remote:
+                for callback in self.output_listeners:
+                    callback(focus, items)
+        return flushed
+
+    def get_instance_log(self, handle, args):
+        if len(args) < 2:
+            handle.print("Error: Requires 2 arguments.")
+            return None
+        if args[0] not in self.get_server_names():
+            handle.print(f"Error: Cannot find controller with name: {args[0]}.")
+            return None
+        m = self.get_instance_from_type_and_name(args[0], args[1])
+        if not m:
+            handle.print(f"Error: Cannot find instance with name: {args[1]}.")
+            return None
+        if not m.get_log():
+            handle.print("Error: Instance logs are disabled.")
+            return None
+        return m.get_log()
+
+    def flush_logs(self):
+        for ins in self.instance_registry.get_instances():
+            if ins.get_log():
+                ins.get_log().close()
+
+    def close_instances(self, timeout=None, instances=None):
+        # Stops every instance at once, each gets its grace period then SIGTERM then SIGKILL, and the whole thing
+        # is bounded by shutdownTimeout so one hung server can't keep the daemon from exiting
+        if instances is None:
+            instances = self.instance_registry.get_instances()
+        if timeout is None:
+            timeout = self.config.get("shutdownTimeout", 60)
+        deadline = monotonic() + timeout
+        # Memory freed by stopping instances shouldn't start queued ones
+        self.memory_ledger.clear_queue()
+        results = {}
+        threads = []
+        running = []
+        for ins in instances:
+            if ins.remote:
+                continue
+            # Stopped ones still get shut down to release their ports but aren't worth a line in the report
+            if ins.get_running():
+                running.append(ins)
+            t = Thread(target=self.stop_instance, args=(ins, deadline, results), daemon=True)
+            t.start()
+            threads.append(t)
+
+        for t in threads:
+            t.join(max(0, deadline - monotonic()) + 1)
+        for ins in running:
+            how, elapsed = results.get(ins, ("did not stop", timeout))
+            self.console.print(f"  [{ins.type}/{ins.name}] {how} after {elapsed:.1f}s")
+        return results
+
+    def write_handover(self):
+        # Records the servers the next daemon process should re-attach to, anything that can't be handed over
+        # (started without fifos, or by a controller that doesn't use launch_server_process) is stopped instead
+        records = []
+        others = []
+        for ins in self.instance_registry.get_instances():
+            if ins.remote:
+                continue
+            record = ins.get_handover_record()
+            if record:
+                records.append(record)
+            elif ins.get_running():
+                others.append(ins)
+        for record in self.unadopted_records:
+            if FifoProcess.read_start_time(record.get("pid")) == record.get("start_time"):
+                records.append(record)
+        self.memory_ledger.clear_queue()
+        HandoverFile(self.config.get("handoverFile", "data/handover.json")).write(records)
+        if others:
+            self.close_instances(instances=others)
+        return records
+
+    def adopt_instances(self):
+        handover = HandoverFile(self.config.get("handoverFile", "data/handover.json"))
+        if not handover.exists():
+            return 0
+        adopted = 0
+        unmatched = []
+        for record in handover.read():
+            name = f"[{record.get('type')}/{record.get('name')}]"
+            alive = record.get("start_time") is not None and \
+                FifoProcess.read_start_time(record.get("pid")) == record.get("start_time")
+            if not alive:
+                self.console.print(f"{name} was not running anymore")
+                continue
+            # Checked before adopting so the fifos are only opened for a process that will be managed
+            ins = self.get_instance_from_type_and_name(record.get("type"), record.get("name"))
+            if not ins or ins.remote or ins.get_running():
+                self.console.print(f"{name} pid {record['pid']} has no instance to re-attach to, it was left "
+                                   f"running and kept in the handover file")
+                unmatched.append(record)
+                continue
+            try:
+                process = FifoProcess.adopt(record["pid"], record["fifo_dir"], record.get("start_time"))
+            except (KeyError, OSError):
+                process = None
+            if not process:
+                self.console.print(f"{name} was not running anymore")
+                continue
+            ins.adopt_process(process)
+            adopted += 1
+        # Kept until an instance can take them, the next handover carries them over as well
+        self.unadopted_records = unmatched
+        if unmatched:
+            handover.write(unmatched)
+        else:
+            handover.remove()
+        return adopted
 
-    def print_all(self, value, focus=None):
-        usernames = []
-        for user in self.handle_list:
-            name = user.get_username()
-            if name not in usernames:
-                usernames.append(name)
-                self.print(name, value, focus=focus)
+    def stop_instance(self, ins, deadline, results):
+        escalate_wait = self.config.get("stopEscalationWait", 5)
+        start = monotonic()
 
-    def print(self, username, value, focus=None):
-        found = False
-        for user in self.handle_list:
-            if user.get_logged_in() and user.get_username() == username:
-                if not focus:
-                    user.print(value)
-                elif user.is_focused():
-                    if user.check_focus(focus):
-                        user.print(value)
-                elif user.is_filtered():
-                    if user.check_filter(focus):
-                        user.print(value)
-                else:
-                    user.print(value)
-                found = True
-        return found
+        def wait_until(end):
+            while ins.get_running() and monotonic() < end:
+                sleep(0.1)
+            return not ins.get_running()
 
-    def flush_servers(self):
-        for types in self.instances:
-            for instances in self.instances[types]:
-                items = instances.get_queue()
-                for item in items:
-                    self.print_all(item, focus=(types, instances.get_name()))
-
-    def close_instances(self):
-        for cont in self.instances:
-            for ins in self.instances[cont]:
-                ins.stop()
-                ins.shutdown()
-
-        running = True
-        while running:
-            sleep(0.1)
-            running = False
-            for cont in self.instances:
-                for ins in self.instances[cont]:
-                    running = running or ins.get_running()
+        how = "did not stop"
+        try:
+            ins.stop()
+            ins.shutdown()
+            # Leave room for both escalation steps before the overall deadline
+            if wait_until(min(start + ins.get_stop_grace(), deadline - 2 * escalate_wait)):
+                how = "stopped"
+            elif ins.terminate() and wait_until(min(monotonic() + escalate_wait, deadline - escalate_wait)):
+                how = "terminated"
+            elif ins.kill() and wait_until(deadline):
+                how = "killed"
+        except Exception as e:
+            how = f"failed to stop ({e.__repr__()})"
+        results[ins] = (how, monotonic() - start)
 
     def get_status(self):
         status = []
         status.append(version)
         status.append(f"Loaded {len(self.user_data.get_users())} user(s) from '{self.user_data.get_file_path()}'")
         status.append(f"Loaded {len(self.get_server_names())} server type(s) from '{self.instances_data_file}'")
+        counts = self.instance_registry.get_counts()
+        status.append(f"Instances: {self.instance_registry.get_count()} ({counts['running']} running, "
+                      f"{counts['starting']} starting, {counts['stopped']} stopped), "
+                      f"{self.instance_registry.get_active_count()} with unflushed output")
+        status.append(f"Instance store: {self.instance_store.get_dirty_count()} unsaved, "
+                      f"{self.instance_store.get_writes()} record write(s)")
         if self.gui.get_running():
             status.append(f"Hosted web server at {self.port_handler.get_connection_to_port(self.gui.get_port())}")
         else:
-            status.append(f"Web server: Disconnected")
+            status.append("Web server: Disconnected")
         if self.socket_server.get_running():
             status.append(
                 f"Hosted socket server at {self.port_handler.get_connection_to_port(self.socket_server.get_port())}")
+            encodes, saved = self.socket_server.get_broadcast_stats()
+            status.append(f"  Broadcast encodes: {encodes} ({saved} saved by sharing)")
+            for id_, address, packets, bytes_, congested, dropped in self.socket_server.get_client_queues():
+                line = f"  Client {id_} ({address[0]}:{address[1]}): {packets} packet(s), {bytes_} byte(s) queued"
+                if congested:
+                    line += f", congested ({dropped} dropped)"
+                status.append(line)
         else:
-            status.append(f"Socket server: Disconnected")
-        status.append(f"UPNP: " + ("Working" if self.port_handler.upnp.get_connected() else "Disconnected"))
-        status.append(f"CloudFlare: " + ("Working" if self.port_handler.cloudflare.get_connected() else "Disconnected"))
+            status.append("Socket server: Disconnected")
+        posted, wakeups = self.event_queue.get_stats()
+        status.append(f"Main loop: {wakeups} wakeup(s) for {posted} event(s)")
+        for phase, count, p50, p99, max_ in self.loop_stats.get_summary():
+            if phase == "tick":
+                status.append(f"  Tick: p50 {p50}us, p99 {p99}us, max {max_}us over {count} tick(s)")
+        if self.socket_server.get_running():
+            for phase, count, p50, p99, max_ in self.socket_server.get_loop_stats().get_summary():
+                if phase == "tick":
+                    status.append(f"  Socket tick: p50 {p50}us, p99 {p99}us, max {max_}us over {count} tick(s)")
+        in_flight = self.command_executor.get_in_flight()
+        status.append(f"Commands: {len(in_flight)} running, {self.command_executor.get_queued_count()} queued, "
+                      f"{self.command_executor.get_completed()} completed")
+        for handle, name, elapsed in in_flight:
+            status.append(f"  {handle.get_username()}: {name} ({elapsed:.1f}s)")
+        sampler = BaseController.get_resource_sampler()
+        if sampler.get_available():
+            totals = sampler.get_totals()
+            status.append(f"Resources: {totals['instances']} instance(s), {totals['pids']} process(es), "
+                          f"CPU {totals['cpu']:.1f}%, Memory {ResourceSampler.format_bytes(totals['rss'])}")
+            status.append(f"  Sampler: {sampler.get_passes()} pass(es), "
+                          f"last took {sampler.get_pass_time() * 1000:.1f}ms")
+        if self.cpu_scheduler.get_available():
+            status += self.cpu_scheduler.get_lines()
+        if self.nodes:
+            remote = sum(len(i.get_instances()) for i in self.nodes.values())
+            status.append(f"Agents: {len(self.nodes)} node(s) with {remote} instance(s)")
+        budget = self.memory_ledger.get_budget()
+        status.append(f"Memory: {self.memory_ledger.get_used()}/{budget if budget is not None else 'unlimited'} MiB "
+                      f"committed, {self.memory_ledger.get_queued_count()} start(s) queued")
+        status.append("UPNP: " + ("Working" if self.port_handler.upnp.get_connected() else "Disconnected"))
+        status.append("CloudFlare: " + ("Working" if self.port_handler.cloudflare.get_connected() else "Disconnected"))
+        if self.port_handler.get_pending_count():
+            status.append(f"  {self.port_handler.get_pending_count()} port(s) waiting to be forwarded")
         return status
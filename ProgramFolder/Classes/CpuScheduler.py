@@ -0,0 +1,130 @@
+from threading import Lock
+from os import path as ospath
+import os
+
+
+class CpuScheduler:
+    # Places running instances on cpu sets and recomputes every placement when one starts or stops.
+    #   none:    leaves placement to the os, the default
+    #   spread:  divides the cores evenly between instances
+    #   pack:    gives each instance cores_per_instance cores starting from the lowest free one
+    #   reserve: spread, but core 0 is left to the daemon
+    policies = ["none", "spread", "pack", "reserve"]
+    proc_dir = "/proc"
+
+    def __init__(self, policy="none", cores_per_instance=0, nice=0):
+        self.policy = policy if policy in self.policies else "none"
+        self.cores_per_instance = cores_per_instance
+        self.nice = nice
+        self.lock = Lock()
+
+        self.available = hasattr(os, "sched_setaffinity")
+        self.cpus = sorted(os.sched_getaffinity(0)) if self.available else []
+        self.pids = {}          # format {key: pid}, in start order
+        self.placements = {}    # format {key: [cpu, ...]}
+
+    def set_policy(self, policy):
+        if policy not in self.policies:
+            return False
+        self.policy = policy
+        self.rebalance()
+        return True
+
+    def get_policy(self):
+        return self.policy
+
+    def get_available(self):
+        return self.available
+
+    def add(self, key, pid):
+        with self.lock:
+            self.pids[key] = pid
+        self.rebalance()
+
+    def remove(self, key):
+        with self.lock:
+            if key not in self.pids:
+                return
+            del self.pids[key]
+            self.placements.pop(key, None)
+        self.rebalance()
+
+    def get_pool(self):
+        if self.policy == "reserve" and len(self.cpus) > 1:
+            return self.cpus[1:]
+        return list(self.cpus)
+
+    def compute(self, keys):
+        pool = self.get_pool()
+        if not pool or not keys:
+            return {}
+        out = {}
+        if self.policy == "pack":
+            count = min(self.cores_per_instance or 1, len(pool))
+            for i, key in enumerate(keys):
+                out[key] = sorted({pool[(i * count + j) % len(pool)] for j in range(count)})
+            return out
+
+        if len(keys) >= len(pool):
+            for i, key in enumerate(keys):
+                out[key] = [pool[i % len(pool)]]
+            return out
+        # Slices differ by at most one core so the leftover cores aren't all left idle at the end
+        for i, key in enumerate(keys):
+            cpus = pool[i * len(pool) // len(keys):(i + 1) * len(pool) // len(keys)]
+            out[key] = cpus[:self.cores_per_instance] if self.cores_per_instance else cpus
+        return out
+
+    def rebalance(self):
+        if not self.available or self.policy == "none":
+            return
+        with self.lock:
+            pids = dict(self.pids)
+            placements = self.compute(list(pids))
+            changed = [key for key in placements if placements[key] != self.placements.get(key)]
+            self.placements = placements
+        for key in changed:
+            self.apply(pids[key], placements[key])
+
+    def apply(self, pid, cpus):
+        # Affinity and niceness are per thread on linux, so every thread that already exists is moved as well as
+        # the process itself, threads created later inherit from whichever thread creates them
+        tasks = [pid]
+        task_dir = ospath.join(self.proc_dir, str(pid), "task")
+        if ospath.isdir(task_dir):
+            try:
+                tasks = [int(i) for i in os.listdir(task_dir)]
+            except OSError:
+                pass
+        for tid in tasks:
+            try:
+                os.sched_setaffinity(tid, cpus)
+                if self.nice:
+                    os.setpriority(os.PRIO_PROCESS, tid, self.nice)
+            except OSError:
+                pass
+
+    def get_placement(self, key):
+        return self.placements.get(key)
+
+    @staticmethod
+    def format_cpus(cpus):
+        # [0, 1, 2, 5] -> "0-2,5"
+        out = []
+        start = prev = None
+        for cpu in cpus:
+            if prev is not None and cpu == prev + 1:
+                prev = cpu
+                continue
+            if start is not None:
+                out.append(f"{start}-{prev}" if prev != start else f"{start}")
+            start = prev = cpu
+        if start is not None:
+            out.append(f"{start}-{prev}" if prev != start else f"{start}")
+        return ",".join(out)
+
+    def get_lines(self):
+        out = [f"CPU placement: {self.policy} over cores {self.format_cpus(self.cpus)}"]
+        for key, cpus in self.placements.items():
+            out.append(f"  [{key.type}/{key.name}] cores {self.format_cpus(cpus)}")
+        return out
@@ -0,0 +1,31 @@
+from threading import Condition
+
+
+class EventQueue:
+    # Producers only say which source has work, the main loop then drains that source itself,
+    # so a burst of output lines costs one wakeup instead of one queue entry per line
+    def __init__(self):
+        self.condition = Condition()
+        self.sources = set()
+        self.posted = 0
+        self.wakeups = 0
+
+    def post(self, source=""):
+        with self.condition:
+            self.posted += 1
+            if not self.sources:
+                self.condition.notify()
+            self.sources.add(source)
+
+    def wait(self, timeout=None):
+        with self.condition:
+            if not self.sources:
+                self.condition.wait(timeout)
+            sources = self.sources
+            self.sources = set()
+            if sources:
+                self.wakeups += 1
+        return sources
+
+    def get_stats(self):
+        return self.posted, self.wakeups
@@ -93,7 +93,7 @@ class GUI:
     def create_app(self):
         if not self.manager:
             return False
-        self.handle_group = HandleGroup(self.manager.get_handle_list(), self.manager.get_user_data())
+        self.handle_group = HandleGroup(self.manager, self.manager.get_user_data())
         self.handle_group.set_timeout(30)
 
         app = Flask(__name__,
@@ -188,8 +188,7 @@ class GUI:
                     if p < 3:
                         flash("Higher permission required")
                     elif not server_.get_running():
-                        server_.start()
-                        flash(f"Started {server}")
+                        flash(self.manager.request_start(server_)[1])
                 elif "stop" in request.form.keys():
                     if p < 3:
                         flash("Higher permission required")
@@ -216,11 +215,7 @@ class GUI:
         def servers():
             if not self.check_login():
                 return redirect(url_for("login"))
-            servers = []
-            for i in self.manager.get_server_names():
-                instances = self.manager.get_names_of_server_from_type(i)
-                for instance in instances:
-                    servers.append((i, instance))
+            servers = [(i.type, i.get_name()) for i in self.manager.get_instance_registry().get_instances()]
             return render_template("servers.html", servers=servers)
 
         @app.route("/console", methods=['POST', 'GET'])
@@ -230,9 +225,18 @@ class GUI:
             handle = self.get_handle()["handle"]
             if request.method == "POST":
                 handle.put_event({"type": "text", "text": request.form.get("input")})
+                self.manager.get_event_queue().post("gui")
                 return '', 204
             return render_template("console.html", prefix=handle.get_prefix())
 
+        @app.route("/console/complete", methods=['GET'])
+        def console_complete():
+            if not self.check_login():
+                return "", 204
+            handle = self.get_handle()["handle"]
+            text = request.args.get("text", "")
+            return flask.jsonify({"text": text, "options": self.manager.complete_command(handle, text)})
+
         @app.route("/settings")
         def settings():
             if not self.check_login():
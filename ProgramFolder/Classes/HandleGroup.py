@@ -3,8 +3,8 @@ import time
 
 
 class HandleGroup:
-    def __init__(self, server_handles, user_data, single_user=False):
-        self.server_handles = server_handles
+    def __init__(self, manager, user_data, single_user=False):
+        self.manager = manager
         self.user_data = user_data
         self.handles = {}  # {username: [{"id": id, "time": time, "handle": handle "data":{}}, {} . . .]}
         self.single_user = single_user
@@ -38,7 +38,8 @@ class HandleGroup:
         if username not in self.handles:
             self.handles[username] = []
         self.handles[username].append(h)
-        self.server_handles.append(handle)
+        self.manager.add_handle(handle)
+        self.manager.replay_scrollback(handle)
         return h
 
     def find_handle(self, username, id_pair=None):
@@ -69,8 +70,7 @@ class HandleGroup:
             h["handle"].exit()
             if h in self.handles[username]:
                 self.handles[username].remove(h)
-            if h["handle"] in self.server_handles:
-                self.server_handles.remove(h["handle"])
+            self.manager.remove_handle(h["handle"])
 
     def update_time(self, username, id_pair=None):
         if not id_pair:
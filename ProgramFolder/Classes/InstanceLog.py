@@ -0,0 +1,196 @@
+from threading import Thread, Lock, Event
+from os import path as ospath
+from os import makedirs
+from struct import Struct
+from bisect import bisect_left
+from time import time, monotonic
+import zlib
+
+
+class LogWriter(Thread):
+    flush_interval = 30
+
+    def __init__(self):
+        super(LogWriter, self).__init__(daemon=True)
+        self.logs = []
+        self.lock = Lock()
+        self.event = Event()
+
+    def add_log(self, log):
+        with self.lock:
+            self.logs.append(log)
+
+    def remove_log(self, log):
+        with self.lock:
+            if log in self.logs:
+                self.logs.remove(log)
+
+    def wakeup(self):
+        self.event.set()
+
+    def run(self):
+        while True:
+            self.event.wait(self.flush_interval)
+            self.event.clear()
+            with self.lock:
+                logs = list(self.logs)
+            for log in logs:
+                try:
+                    log.write_pending()
+                except OSError:
+                    pass
+
+
+class InstanceLog:
+    # The data file is a run of zlib compressed blocks of "timestamp\tline\n" records, the index file holds one
+    # fixed size record per block so queries only decompress the blocks that can contain what they are after
+    index_record = Struct("!QIQIdd")    # offset, compressed length, first line number, line count, first/last time
+    block_lines = 2048
+    block_age = 30
+    compression_level = 6
+    writer = None
+    writer_lock = Lock()
+
+    def __init__(self, directory, name="output"):
+        self.directory = directory
+        self.data_file = ospath.join(directory, name + ".log.z")
+        self.index_file = ospath.join(directory, name + ".idx")
+
+        self.lock = Lock()          # guards pending
+        self.file_lock = Lock()     # guards the files and index, taken before lock when both are needed so lines
+                                    # move from pending to a block in one step as far as readers can tell
+        self.pending = []           # format [(time, line), ...], lines not yet written to a block
+        self.pending_since = 0
+        self.index = []             # format [(offset, length, first_line, count, first_time, last_time), ...]
+        self.end_times = []         # last_time of every block, kept for bisection
+        self.line_count = 0
+        self.closed = False
+
+        self.load_index()
+        self.get_writer().add_log(self)
+
+    @classmethod
+    def get_writer(cls):
+        with InstanceLog.writer_lock:
+            if not InstanceLog.writer:
+                InstanceLog.writer = LogWriter()
+                InstanceLog.writer.start()
+            return InstanceLog.writer
+
+    def load_index(self):
+        if not ospath.isfile(self.index_file):
+            return
+        with open(self.index_file, "rb") as file:
+            data = file.read()
+        size = self.index_record.size
+        self.index = [self.index_record.unpack_from(data, i) for i in range(0, len(data) - size + 1, size)]
+        data_size = ospath.getsize(self.data_file) if ospath.isfile(self.data_file) else 0
+        # Drop blocks a crash left half written
+        while self.index and self.index[-1][0] + self.index[-1][1] > data_size:
+            self.index.pop()
+        if self.index:
+            self.line_count = self.index[-1][2] + self.index[-1][3]
+        self.end_times = [i[5] for i in self.index]
+
+    def append(self, line):
+        with self.lock:
+            if not self.pending:
+                self.pending_since = monotonic()
+            self.pending.append((time(), line))
+            full = len(self.pending) >= self.block_lines
+        if full:
+            self.get_writer().wakeup()
+
+    def write_pending(self, force=False):
+        with self.file_lock:
+            with self.lock:
+                if not self.pending or self.closed:
+                    return
+                if not force and len(self.pending) < self.block_lines and \
+                        monotonic() - self.pending_since < self.block_age:
+                    return
+                lines = self.pending
+                self.pending = []
+            self.write_block(lines)
+
+    def write_block(self, lines):
+        if not ospath.isdir(self.directory):
+            makedirs(self.directory)
+        raw = "".join(f"{t:.3f}\t{line}\n".replace("\n", " ", line.count("\n")) for t, line in lines)
+        raw = raw.encode(errors="replace")
+        block = zlib.compress(raw, self.compression_level)
+        offset = self.index[-1][0] + self.index[-1][1] if self.index else 0
+        with open(self.data_file, "ab") as file:
+            file.truncate(offset)
+            file.write(block)
+        record = (offset, len(block), self.line_count, len(lines), lines[0][0], lines[-1][0])
+        with open(self.index_file, "ab") as file:
+            file.truncate(len(self.index) * self.index_record.size)
+            file.write(self.index_record.pack(*record))
+        self.index.append(record)
+        self.end_times.append(record[5])
+        self.line_count += len(lines)
+
+    def read_block(self, record):
+        with open(self.data_file, "rb") as file:
+            file.seek(record[0])
+            raw = zlib.decompress(file.read(record[1])).decode(errors="replace")
+        out = []
+        for entry in raw.split("\n"):
+            if entry:
+                t, line = entry.split("\t", 1)
+                out.append((float(t), line))
+        return out
+
+    def get_pending(self):
+        with self.lock:
+            return list(self.pending)
+
+    def tail(self, count):
+        with self.file_lock:
+            out = self.get_pending()[-count:] if count > 0 else []
+            for record in reversed(self.index):
+                if len(out) >= count:
+                    break
+                out = self.read_block(record)[-(count - len(out)):] + out
+        return out
+
+    def since(self, start_time, limit=1000):
+        out = []
+        with self.file_lock:
+            pending = self.get_pending()
+            # Blocks are written in time order so the first block that ends after start_time is found by bisection
+            index = bisect_left(self.end_times, start_time)
+            for record in self.index[index:]:
+                out += [i for i in self.read_block(record) if i[0] >= start_time]
+                if len(out) >= limit:
+                    return out[:limit]
+        out += [i for i in pending if i[0] >= start_time]
+        return out[:limit]
+
+    def grep(self, pattern, start_time=0, limit=100):
+        # Searches newest first and stops once enough matches are found
+        with self.file_lock:
+            out = [i for i in self.get_pending() if i[0] >= start_time and pattern.search(i[1])]
+            for record in reversed(self.index):
+                if len(out) >= limit or record[5] < start_time:
+                    break
+                out = [i for i in self.read_block(record) if i[0] >= start_time and pattern.search(i[1])] + out
+        return out[-limit:]
+
+    def get_line_count(self):
+        return self.line_count + len(self.pending)
+
+    def get_block_count(self):
+        return len(self.index)
+
+    def get_size(self):
+        if not self.index:
+            return 0
+        return self.index[-1][0] + self.index[-1][1]
+
+    def close(self, flush=True):
+        if flush:
+            self.write_pending(force=True)
+        self.closed = True
+        self.get_writer().remove_log(self)
@@ -0,0 +1,102 @@
+from threading import Lock
+
+
+class InstanceRegistry:
+    # Instances keyed by (type, name) with an insertion ordered view per type. State counts are kept up to date as
+    # instances change state so status lines never walk the instances, and instances that produced output are
+    # kept in a set so a flush only visits those.
+    states = ["stopped", "starting", "running"]
+
+    def __init__(self):
+        self.lock = Lock()
+        self.by_key = {}        # format {(type, name): instance}
+        self.by_type = {}       # format {type: {name: instance}}, dicts keep insertion order
+        self.state = {}         # format {(type, name): state}
+        self.counts = {i: 0 for i in self.states}
+        self.active = set()     # format {instance, ...}
+
+    @staticmethod
+    def get_key(instance):
+        return instance.type, instance.get_name()
+
+    def add_type(self, type_):
+        with self.lock:
+            self.by_type.setdefault(type_, {})
+
+    def has_type(self, type_):
+        return type_ in self.by_type
+
+    def get_types(self):
+        return list(self.by_type)
+
+    def add(self, instance):
+        key = self.get_key(instance)
+        with self.lock:
+            if key in self.by_key or key[0] not in self.by_type:
+                return False
+            self.by_key[key] = instance
+            self.by_type[key[0]][key[1]] = instance
+            state = "running" if instance.get_running() else "stopped"
+            self.state[key] = state
+            self.counts[state] += 1
+        return True
+
+    def remove(self, instance):
+        key = self.get_key(instance)
+        with self.lock:
+            if self.by_key.get(key) is not instance:
+                return False
+            del self.by_key[key]
+            del self.by_type[key[0]][key[1]]
+            self.counts[self.state.pop(key)] -= 1
+            self.active.discard(instance)
+        return True
+
+    def get(self, type_, name):
+        return self.by_key.get((type_, name))
+
+    def has(self, type_, name):
+        return (type_, name) in self.by_key
+
+    def get_names(self, type_):
+        return list(self.by_type.get(type_, ()))
+
+    def get_instances(self, type_=None):
+        if type_ is None:
+            # Grouped by type in the order the types were added
+            return [i for view in list(self.by_type.values()) for i in list(view.values())]
+        return list(self.by_type.get(type_, {}).values())
+
+    def get_count(self, type_=None):
+        if type_ is None:
+            return len(self.by_key)
+        return len(self.by_type.get(type_, ()))
+
+    def set_state(self, instance, state):
+        key = self.get_key(instance)
+        with self.lock:
+            old = self.state.get(key)
+            if old is None or old == state or self.by_key.get(key) is not instance:
+                return
+            self.state[key] = state
+            self.counts[old] -= 1
+            self.counts[state] += 1
+
+    def get_state(self, instance):
+        return self.state.get(self.get_key(instance))
+
+    def get_counts(self):
+        return dict(self.counts)
+
+    def mark_active(self, instance):
+        with self.lock:
+            self.active.add(instance)
+
+    def pop_active(self):
+        with self.lock:
+            active = self.active
+            self.active = set()
+        return active
+
+    def get_active_count(self):
+        return len(self.active)
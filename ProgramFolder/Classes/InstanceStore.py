@@ -0,0 +1,149 @@
+from threading import Thread, Lock, Event
+from os import path as ospath
+from os import makedirs, listdir, remove, replace, fsync
+from urllib.parse import quote
+from json import loads, dumps, decoder
+from shutil import rmtree
+
+
+class InstanceStore(Thread):
+    # Write-behind store keeping one json record per instance, mutations only mark a record dirty and the
+    # thread writes them out at most once per flush_interval
+    def __init__(self, directory="", flush_interval=2):
+        super(InstanceStore, self).__init__(daemon=True)
+        self.directory = directory
+        self.flush_interval = flush_interval
+
+        self.dirty = {}     # format {(type, name): data, or None if the record should be deleted}
+        self.lock = Lock()
+        self.write_lock = Lock()
+        self.event = Event()
+        self.stopping = Event()
+
+        self.writes = 0
+
+    def set_directory(self, directory):
+        self.directory = directory
+
+    def get_directory(self):
+        return self.directory
+
+    def set_flush_interval(self, interval):
+        self.flush_interval = interval
+
+    def get_record_path(self, type_, name, directory=None):
+        return ospath.join(directory or self.directory, quote(type_, safe=""), quote(name, safe="") + ".json")
+
+    def mark(self, type_, name, data):
+        with self.lock:
+            self.dirty[(type_, name)] = data
+        self.event.set()
+
+    def mark_removed(self, type_, name):
+        self.mark(type_, name, None)
+
+    def get_dirty_count(self):
+        return len(self.dirty)
+
+    def get_writes(self):
+        return self.writes
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.event.wait()
+            self.event.clear()
+            self.flush()
+            self.stopping.wait(self.flush_interval)
+
+    def stop(self):
+        self.stopping.set()
+        self.event.set()
+        self.flush()
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                dirty = self.dirty
+                self.dirty = {}
+            for (type_, name), data in dirty.items():
+                try:
+                    if data is None:
+                        self.remove_record(type_, name)
+                    else:
+                        self.write_record(type_, name, data)
+                except (OSError, TypeError, ValueError):
+                    # Keep the record dirty so the next flush retries it, unless something newer replaced it
+                    with self.lock:
+                        self.dirty.setdefault((type_, name), data)
+            self.writes += len(dirty)
+
+    def write_record(self, type_, name, data, directory=None):
+        path = self.get_record_path(type_, name, directory)
+        directory = ospath.dirname(path)
+        if not ospath.isdir(directory):
+            makedirs(directory)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as file:
+            file.write(dumps({"type": type_, "name": name, "data": data}))
+            file.flush()
+            fsync(file.fileno())
+        replace(temp_path, path)
+
+    def remove_record(self, type_, name):
+        path = self.get_record_path(type_, name)
+        if ospath.isfile(path):
+            remove(path)
+
+    def has_records(self):
+        if not ospath.isdir(self.directory):
+            return False
+        return any(ospath.isdir(ospath.join(self.directory, i)) for i in listdir(self.directory))
+
+    def get_records(self):
+        # Generator so records are read one at a time while instances are being restored
+        if not ospath.isdir(self.directory):
+            return
+        for type_dir in sorted(listdir(self.directory)):
+            type_path = ospath.join(self.directory, type_dir)
+            if not ospath.isdir(type_path):
+                continue
+            for file_name in sorted(listdir(type_path)):
+                if not file_name.endswith(".json"):
+                    continue
+                try:
+                    with open(ospath.join(type_path, file_name), "r") as file:
+                        record = loads(file.read())
+                except (IOError, decoder.JSONDecodeError):
+                    continue
+                yield record["type"], record["name"], record["data"]
+
+    def import_file(self, file_path):
+        # Converts the old single file format of {type: [{"name": name, "data": data}, ...]}. Records are written
+        # next to the directory first and only moved in once all of them are, so a failed import leaves no records
+        # behind and is tried again on the next start.
+        try:
+            with open(file_path, "r") as file:
+                data = loads(file.read())
+        except (IOError, decoder.JSONDecodeError):
+            return False
+        temp_directory = ospath.normpath(self.directory) + ".import"
+        moved = []
+        try:
+            if ospath.isdir(temp_directory):
+                rmtree(temp_directory)
+            makedirs(temp_directory)
+            for type_ in data:
+                for instance in data[type_]:
+                    self.write_record(type_, instance["name"], instance["data"], directory=temp_directory)
+            if not ospath.isdir(self.directory):
+                makedirs(self.directory)
+            for type_dir in listdir(temp_directory):
+                replace(ospath.join(temp_directory, type_dir), ospath.join(self.directory, type_dir))
+                moved.append(type_dir)
+        except (OSError, TypeError, ValueError, KeyError, AttributeError):
+            for type_dir in moved:
+                rmtree(ospath.join(self.directory, type_dir), ignore_errors=True)
+            return False
+        finally:
+            rmtree(temp_directory, ignore_errors=True)
+        return True
@@ -0,0 +1,99 @@
+from time import perf_counter
+
+
+class Histogram:
+    # Log2 buckets keep recording O(1) with a fixed memory footprint, percentiles are accurate to a factor of 2
+    bucket_count = 40
+
+    def __init__(self):
+        self.buckets = [0] * self.bucket_count
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        value = int(value)
+        self.buckets[min(value.bit_length(), self.bucket_count - 1)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def get_percentile(self, percent):
+        if not self.count:
+            return 0
+        target = self.count * percent / 100
+        seen = 0
+        for index, amount in enumerate(self.buckets):
+            if amount and seen + amount >= target:
+                if not index:
+                    return 0
+                # Interpolate within the bucket's [2^(i-1), 2^i) range
+                lower = 1 << (index - 1)
+                value = lower + int(lower * (target - seen) / amount)
+                return min(value, self.max)
+            seen += amount
+        return self.max
+
+    def get_average(self):
+        if not self.count:
+            return 0
+        return self.total / self.count
+
+    def reset(self):
+        self.buckets = [0] * self.bucket_count
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+class LoopStats:
+    def __init__(self):
+        self.phases = {}    # format {phase: Histogram of microseconds}, in the order phases were first seen
+        self.events = Histogram()
+        self.ticks = 0
+        self.tick_start = 0
+        self.last_mark = 0
+
+    def start_tick(self):
+        self.tick_start = self.last_mark = perf_counter()
+
+    def mark(self, phase):
+        now = perf_counter()
+        self.record(phase, now - self.last_mark)
+        self.last_mark = now
+
+    def end_tick(self, events=0):
+        self.record("tick", perf_counter() - self.tick_start)
+        self.events.record(events)
+        self.ticks += 1
+
+    def record(self, phase, seconds):
+        histogram = self.phases.get(phase)
+        if not histogram:
+            histogram = self.phases[phase] = Histogram()
+        histogram.record(seconds * 1000000)
+
+    def get_ticks(self):
+        return self.ticks
+
+    def get_summary(self):
+        return [(phase, h.count, h.get_percentile(50), h.get_percentile(99), h.max)
+                for phase, h in list(self.phases.items())]
+
+    def get_event_summary(self):
+        return self.events.get_percentile(50), self.events.get_percentile(99), self.events.max
+
+    def get_lines(self):
+        out = [f"{'phase':<16}{'count':>10}{'p50 us':>10}{'p99 us':>10}{'max us':>10}"]
+        for phase, count, p50, p99, max_ in self.get_summary():
+            out.append(f"{phase:<16}{count:>10}{p50:>10}{p99:>10}{max_:>10}")
+        p50, p99, max_ = self.get_event_summary()
+        out.append(f"{'events/tick':<16}{self.ticks:>10}{p50:>10}{p99:>10}{max_:>10}")
+        return out
+
+    def reset(self):
+        for histogram in self.phases.values():
+            histogram.reset()
+        self.events.reset()
+        self.ticks = 0
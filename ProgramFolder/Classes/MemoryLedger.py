@@ -0,0 +1,95 @@
+from threading import Lock
+from collections import deque
+
+
+class MemoryLedger:
+    # Sums the memory every running instance has committed (in MiB) against a host budget. Starts that don't fit
+    # wait in order and are handed back by release once enough memory has been freed.
+    meminfo_file = "/proc/meminfo"
+
+    def __init__(self, budget=0, reserve=1024):
+        self.lock = Lock()
+        self.committed = {}     # format {key: MiB}
+        self.queue = deque()    # format deque([(key, MiB, callback), ...])
+        self.budget = budget or self.get_host_budget(reserve)
+
+    @classmethod
+    def get_host_budget(cls, reserve=0):
+        # MemTotal less a reserve for the system and the daemon, None means unlimited where there is no meminfo
+        try:
+            with open(cls.meminfo_file, "r") as file:
+                for line in file:
+                    if line.startswith("MemTotal:"):
+                        return max(0, int(line.split()[1]) // 1024 - reserve)
+        except (OSError, ValueError, IndexError):
+            pass
+        return None
+
+    def get_budget(self):
+        return self.budget
+
+    def set_budget(self, budget):
+        self.budget = budget
+
+    def get_used(self):
+        return sum(self.committed.values())
+
+    def fits(self, memory):
+        return self.budget is None or self.get_used() + memory <= self.budget
+
+    def admit(self, key, memory):
+        # Earlier queued starts keep their place, a new start can't jump the queue
+        with self.lock:
+            if key in self.committed:
+                return True
+            if self.queue or not self.fits(memory):
+                return False
+            self.committed[key] = memory
+            return True
+
+    def commit(self, key, memory):
+        # Records memory used by a start that didn't go through admit
+        with self.lock:
+            self.committed.setdefault(key, memory)
+
+    def enqueue(self, key, memory, callback):
+        with self.lock:
+            if any(i[0] is key for i in self.queue):
+                return False
+            self.queue.append((key, memory, callback))
+            return True
+
+    def dequeue(self, key):
+        with self.lock:
+            for entry in self.queue:
+                if entry[0] is key:
+                    self.queue.remove(entry)
+                    return True
+        return False
+
+    def clear_queue(self):
+        with self.lock:
+            self.queue.clear()
+
+    def get_queue_position(self, key):
+        for index, entry in enumerate(self.queue):
+            if entry[0] is key:
+                return index + 1
+        return 0
+
+    def release(self, key):
+        # Returns the callbacks of queued starts that fit now, their memory is committed before they run
+        ready = []
+        with self.lock:
+            self.committed.pop(key, None)
+            while self.queue and self.fits(self.queue[0][1]):
+                key_, memory, callback = self.queue.popleft()
+                self.committed[key_] = memory
+                ready.append(callback)
+        return ready
+
+    def get_committed(self, key):
+        return self.committed.get(key, 0)
+
+    def get_queued_count(self):
+        return len(self.queue)
@@ -0,0 +1,126 @@
+from os import path as ospath
+from os import makedirs, replace
+from json import loads, dumps, decoder
+import re
+
+
+class OutputFilter:
+    # Classifies an instance's output lines by log level and drops the ones matching any drop pattern. Runs on the
+    # process io thread for every line read, so all drop patterns are joined into one regex and searched once.
+    levels = ["TRACE", "DEBUG", "INFO", "WARN", "ERROR"]
+    aliases = {"WARNING": "WARN", "SEVERE": "ERROR", "FATAL": "ERROR", "FINE": "DEBUG", "FINER": "TRACE",
+               "FINEST": "TRACE"}
+    # Matches "[12:00:00] [Server thread/INFO]:" and "[12:00:00 INFO]:", the first word in the group is the level
+    default_level_pattern = r"^\[[^\]]*\] \[[^\]]*/(\w+)\]|^\[[^\]]* (\w+)\]"
+    default_level = "INFO"
+
+    def __init__(self, file_path=None, patterns=None, level_pattern=None):
+        self.file_path = file_path
+        self.base_patterns = self.get_valid(patterns or [])    # from the controller and config, not saved
+        self.patterns = []                          # added to this instance, saved to file_path
+        self.level_regex = re.compile(level_pattern or self.default_level_pattern)
+        self.drop_regex = None
+        self.dropped = 0
+        self.skipped = 0    # classified lines that no one was subscribed to
+        self.counts = [0] * len(self.levels)
+        self.last_level = self.levels.index(self.default_level)
+        self.load()
+
+    @classmethod
+    def get_level(cls, name):
+        # Returns the level's number or None if it isn't one
+        name = cls.aliases.get(name.upper(), name.upper())
+        if name in cls.levels:
+            return cls.levels.index(name)
+        return None
+
+    @staticmethod
+    def get_valid(patterns):
+        # A bad pattern shouldn't take the instance's output with it
+        valid = []
+        for pattern in patterns:
+            try:
+                re.compile(pattern)
+                valid.append(pattern)
+            except re.error:
+                pass
+        return valid
+
+    @classmethod
+    def get_level_name(cls, level):
+        return cls.levels[level]
+
+    def classify(self, line):
+        # Returns the line's level or None if it should be dropped. Lines without a level, like the rest of a stack
+        # trace, keep the level of the last line that had one.
+        if self.drop_regex and self.drop_regex.search(line):
+            self.dropped += 1
+            return None
+        level = self.last_level
+        match = self.level_regex.match(line)
+        if match:
+            name = next((i for i in match.groups() if i), "")
+            level = self.get_level(name)
+            if level is None:
+                level = self.levels.index(self.default_level)
+            self.last_level = level
+        self.counts[level] += 1
+        return level
+
+    def add_skipped(self):
+        self.skipped += 1
+
+    def compile(self):
+        patterns = self.base_patterns + self.patterns
+        self.drop_regex = re.compile("|".join(f"(?:{i})" for i in patterns)) if patterns else None
+
+    def add_pattern(self, pattern):
+        # Raises re.error for an invalid pattern
+        re.compile(pattern)
+        self.patterns.append(pattern)
+        self.compile()
+        self.save()
+
+    def remove_pattern(self, index):
+        if not 0 <= index < len(self.patterns):
+            return False
+        del self.patterns[index]
+        self.compile()
+        self.save()
+        return True
+
+    def clear_patterns(self):
+        self.patterns = []
+        self.compile()
+        self.save()
+
+    def get_patterns(self):
+        return self.patterns
+
+    def get_base_patterns(self):
+        return self.base_patterns
+
+    def load(self):
+        if self.file_path and ospath.isfile(self.file_path):
+            try:
+                with open(self.file_path, "r") as file:
+                    patterns = loads(file.read()).get("patterns", [])
+            except (IOError, decoder.JSONDecodeError, AttributeError):
+                patterns = []
+            self.patterns = self.get_valid(patterns)
+        self.compile()
+
+    def save(self):
+        if not self.file_path:
+            return
+        directory = ospath.dirname(self.file_path)
+        if not ospath.isdir(directory):
+            makedirs(directory)
+        with open(self.file_path + ".tmp", "w") as file:
+            file.write(dumps({"patterns": self.patterns}))
+        replace(self.file_path + ".tmp", self.file_path)
+
+    def get_line(self):
+        counts = ", ".join(f"{self.levels[i]} {v}" for i, v in enumerate(self.counts) if v)
+        return f"Output filter: {self.dropped} dropped by {len(self.base_patterns) + len(self.patterns)} " \
+               f"pattern(s), {self.skipped} below every subscribed level" + (f", {counts}" if counts else "")
@@ -0,0 +1,106 @@
+from threading import Lock
+from collections import deque
+
+
+class DroppedMarker:
+    level = None    # sent to everyone regardless of level
+
+    def __init__(self, count):
+        self.count = count
+
+
+class OutputQueue:
+    # A bounded queue of an instance's output lines and their levels. Lines are stored as read and only get the
+    # instance prefix once they are drained. When the queue is full the policy decides what gives:
+    #   block       - the pause callback stops reading this stream until the queue is drained, lines already read
+    #                 are kept so the queue can go over max_lines by at most one read's worth
+    #   drop_oldest - the oldest queued line is dropped to make room
+    #   coalesce    - new lines are dropped and replaced by one "N line(s) dropped" marker
+    policies = ["block", "drop_oldest", "coalesce"]
+
+    def __init__(self, prefix="", max_lines=5000, policy="coalesce", pause=None, resume=None):
+        # Without a way to pause the reader blocking falls back to coalescing
+        if policy not in self.policies or (policy == "block" and not (pause and resume)):
+            policy = "coalesce"
+        self.prefix = prefix
+        self.max_lines = max(1, max_lines)
+        self.policy = policy
+        self.pause = pause
+        self.resume = resume
+        self.paused = False
+        self.lock = Lock()
+        self.lines = deque()
+        self.coalesced = 0      # lines dropped since the last marker
+        self.dropped = 0
+        self.queued = 0
+
+    def put(self, line, level=None):
+        # Returns False if the line was dropped
+        with self.lock:
+            if len(self.lines) >= self.max_lines:
+                if self.policy == "block":
+                    # Called under the lock so a drain can't resume before this pauses
+                    if not self.paused:
+                        self.paused = True
+                        self.pause()
+                    self.lines.append((line, level))
+                    self.queued += 1
+                    return True
+                elif self.policy == "drop_oldest":
+                    self.lines.popleft()
+                    self.dropped += 1
+            if len(self.lines) >= self.max_lines:
+                self.dropped += 1
+                self.coalesced += self.policy == "coalesce"
+                return False
+            if self.coalesced:
+                # Room again, the marker keeps its place between the lines before and after the gap
+                self.lines.append(DroppedMarker(self.coalesced))
+                self.coalesced = 0
+            self.lines.append((line, level))
+            self.queued += 1
+            return True
+
+    def get_all(self):
+        with self.lock:
+            lines = self.lines
+            self.lines = deque()
+            coalesced = self.coalesced
+            self.coalesced = 0
+            if self.paused:
+                self.paused = False
+                self.resume()
+        if coalesced:
+            lines.append(DroppedMarker(coalesced))
+        return [self.format(i) for i in lines]
+
+    def format(self, line):
+        # Returns (formatted line, level)
+        if isinstance(line, DroppedMarker):
+            return f"{self.prefix}... {line.count} line(s) dropped", line.level
+        return f"{self.prefix}{line[0]}", line[1]
+
+    def set_prefix(self, prefix):
+        self.prefix = prefix
+
+    def get_size(self):
+        return len(self.lines)
+
+    def get_max_lines(self):
+        return self.max_lines
+
+    def get_policy(self):
+        return self.policy
+
+    def get_paused(self):
+        return self.paused
+
+    def get_dropped(self):
+        return self.dropped
+
+    def get_queued(self):
+        return self.queued
+
+    def get_line(self):
+        return f"Output queue: {len(self.lines)}/{self.max_lines} line(s), {self.queued} queued, " \
+               f"{self.dropped} dropped ({self.policy}" + (", reading paused)" if self.paused else ")")
@@ -0,0 +1,83 @@
+from pickle import dumps, loads
+from json import dumps as j_dumps
+from json import loads as j_loads
+from struct import Struct
+
+
+class PacketBuffer:
+    # Frames are a 4 byte big endian payload length followed by the pickle/json payload
+    header = Struct("!I")
+    min_recv_size = 1024
+    max_recv_size = 262144
+    max_packet_size = 16777216
+
+    def __init__(self, version, size=65536):
+        self.version = version
+        self.buffer = bytearray(size)
+        self.start = 0
+        self.end = 0
+        self.recv_size = self.min_recv_size
+
+    @classmethod
+    def encode(cls, packet, version):
+        if version != -1:
+            payload = dumps(packet, protocol=version)
+        else:
+            payload = j_dumps(packet).encode()
+        return cls.header.pack(len(payload)) + payload
+
+    def decode(self, payload):
+        if self.version != -1:
+            return loads(payload)
+        return j_loads(str(payload, "utf-8"))
+
+    def reserve(self, size):
+        if len(self.buffer) - self.end >= size:
+            return
+        length = self.end - self.start
+        if self.start > 0 and len(self.buffer) - length >= size:
+            self.buffer[:length] = self.buffer[self.start:self.end]
+        else:
+            new_size = len(self.buffer)
+            while new_size - length < size:
+                new_size *= 2
+            new_buffer = bytearray(new_size)
+            new_buffer[:length] = self.buffer[self.start:self.end]
+            self.buffer = new_buffer
+        self.start = 0
+        self.end = length
+
+    def recv_into(self, sock):
+        self.reserve(self.recv_size)
+        with memoryview(self.buffer) as view:
+            with view[self.end:self.end + self.recv_size] as target:
+                received = sock.recv_into(target)
+        self.end += received
+
+        if received == self.recv_size:
+            self.recv_size = min(self.recv_size * 2, self.max_recv_size)
+        elif received < self.recv_size // 4:
+            self.recv_size = max(self.recv_size // 2, self.min_recv_size)
+        return received
+
+    def get_packets(self):
+        out = []
+        while self.end - self.start >= self.header.size:
+            length = self.header.unpack_from(self.buffer, self.start)[0]
+            if length > self.max_packet_size:
+                raise ValueError(f"Packet of {length} bytes exceeds the maximum packet size")
+            frame_end = self.start + self.header.size + length
+            if frame_end > self.end:
+                self.reserve(frame_end - self.end)
+                break
+            with memoryview(self.buffer) as view:
+                with view[self.start + self.header.size:frame_end] as payload:
+                    out.append(self.decode(payload))
+            self.start = frame_end
+        if self.start == self.end:
+            self.start = 0
+            self.end = 0
+        return out
+
+    def get_size(self):
+        return self.end - self.start
@@ -8,6 +8,7 @@ import http.client
 import time
 import CloudFlare
 import string
+from threading import RLock
 
 
 class CloudflareWrapper:
@@ -355,35 +356,79 @@ class PortHandler:
 
     public_ip = ""
 
+    port_lock = RLock()
+    defer_provisioning = False
+    pending_ports = []
+
     def __init__(self):
         self.taken_ports = []
+        self.update_callback = None
+
+    def set_update_callback(self, callback):
+        self.update_callback = callback
 
     def request_port(self, port, max_number=-1, description="",
                      TCP=False, UDP=False, subdomain_name="", srv_service="", proxy=False):
         if max_number == -1 or max_number > 65535:
             max_number = 65535
 
-        self.update_upnp_ports()
-
-        while True:
-            if port > max_number:
-                return -1
-            if self.check_port_availability(port):
-                self._add_port(port, description=description,
-                               TCP=TCP, UDP=UDP, subdomain_name=subdomain_name, srv_service=srv_service,
-                               proxy=proxy)
-                return port
-            port += 1
+        defer = self.defer_provisioning
+        if not defer:
+            self.update_upnp_ports()
+
+        with self.port_lock:
+            while True:
+                if port > max_number:
+                    return -1
+                if self.check_port_availability(port):
+                    p = self._add_port(port, description=description,
+                                       TCP=TCP, UDP=UDP, subdomain_name=subdomain_name, srv_service=srv_service,
+                                       proxy=proxy)
+                    break
+                port += 1
+        if defer:
+            with self.port_lock:
+                self.pending_ports.append(p)
+        else:
+            self.provision_port(p)
+        return port
 
     def check_port_availability(self, port):
-        if port in [i.get("port") for i in self.all_ports]:
+        if any(i.get("port") == port for i in self.all_ports):
             return False
         if port in self.upnp_ports:
             return False
         return True
 
     def _add_port(self, port, description="", TCP=False, UDP=False, subdomain_name="", srv_service="", proxy=False):
-        subdomain_name = CloudflareWrapper.format_subdomain(subdomain_name)
+        # Only reserves the port, provision_port does the forwarding and dns work
+        p = {"port": port,
+             "forwarded": False,
+             "address": f"{self.public_ip}:{port}",
+             "routed": False,
+             "domain": "",
+             "srv": False,
+             "service": srv_service,
+             "proxy": proxy,
+             "pending": True,
+             "description": description,
+             "TCP": TCP,
+             "UDP": UDP,
+             "subdomain_name": subdomain_name,
+             "parent": self}
+
+        self.all_ports.append(p)
+        self.taken_ports.append(p)
+        return p
+
+    def provision_port(self, p):
+        port = p["port"]
+        description = p["description"]
+        TCP = p["TCP"]
+        UDP = p["UDP"]
+        srv_service = p["service"]
+        proxy = p["proxy"]
+        subdomain_name = CloudflareWrapper.format_subdomain(p["subdomain_name"])
         forwarded = False
         if self.use_upnp and self.upnp.get_connected() and (TCP or UDP):
             if TCP:
@@ -426,56 +471,108 @@ class PortHandler:
             else:
                 routed = self.cloudflare.ensure_dns_record({"type": "CNAME", "name": name, "content": base_domain})
 
-        p = {"port": port,
-             "forwarded": forwarded,
-             "address": f"{self.public_ip}:{port}",
-             "routed": routed,
-             "domain": name,
-             "srv": srv,
-             "service": srv_service,
-             "proxy": proxy,
-             "parent": self}
+        p.update({"forwarded": forwarded,
+                  "address": f"{self.public_ip}:{port}",
+                  "routed": routed,
+                  "domain": name,
+                  "srv": srv,
+                  "pending": False})
 
-        self.all_ports.append(p)
-        self.taken_ports.append(p)
+    @classmethod
+    def provision_pending(cls):
+        # Background reconciliation for ports reserved while provisioning was deferred
+        cls.update_upnp_ports(force=True)
+        while True:
+            with cls.port_lock:
+                if not cls.pending_ports:
+                    return
+                p = cls.pending_ports.pop(0)
+            if p not in cls.all_ports:
+                continue
+            parent = p["parent"]
+            previous = p["port"]
+            if previous in cls.upnp_ports:
+                # Something else has taken the mapping since the port was reserved, so it moves on to the next free
+                # port the same way request_port would have
+                with cls.port_lock:
+                    port = previous + 1
+                    while port <= 65535 and not parent.check_port_availability(port):
+                        port += 1
+                    if port <= 65535:
+                        p["port"] = port
+            if p["port"] in cls.upnp_ports:
+                # Nothing free was left, it stays local only
+                p["pending"] = False
+            else:
+                parent.provision_port(p)
+            if parent.update_callback:
+                parent.update_callback(p["port"], previous)
+
+    @classmethod
+    def reprovision_ports(cls):
+        # For when upnp turns up after ports were already handed out, they were either never forwarded or had their
+        # mappings removed by wipe_ports, so every port goes back through provisioning
+        with cls.port_lock:
+            for p in cls.all_ports:
+                if p not in cls.pending_ports:
+                    p["pending"] = True
+                    cls.pending_ports.append(p)
+        cls.provision_pending()
+
+    @classmethod
+    def set_defer_provisioning(cls, defer):
+        cls.defer_provisioning = defer
+
+    @classmethod
+    def get_pending_count(cls):
+        return len(cls.pending_ports)
 
     def remove(self, delete=False):
-        for i in self.taken_ports:
+        with self.port_lock:
+            taken_ports = self.taken_ports[:]
+        for i in taken_ports:
             self.remove_port(i.get("port"), full_port=i, delete=delete)
 
     def remove_port(self, port, full_port=None, delete=False):
         self.update_upnp_ports()
 
         if not full_port:
-            for p in self.all_ports:
-                if p.get("port") == port:
-                    full_port = p
+            with self.port_lock:
+                for p in self.all_ports:
+                    if p.get("port") == port:
+                        full_port = p
 
         if full_port:
             self.remove_port_connections(port, full_port, delete)
 
     @classmethod
     def remove_port_connections(cls, port, full_port=None, delete=False):
-        if not full_port:
-            for p in cls.all_ports:
-                if p.get("port") == port:
-                    full_port = p
-
-        if full_port:
+        # Instances can be shut down from several threads at once, only the first to get here removes the port
+        with cls.port_lock:
+            if not full_port:
+                for p in cls.all_ports:
+                    if p.get("port") == port:
+                        full_port = p
+            if not full_port or full_port not in cls.all_ports:
+                return
             full_port["parent"].taken_ports.remove(full_port)
             cls.all_ports.remove(full_port)
+            if full_port in cls.pending_ports:
+                cls.pending_ports.remove(full_port)
 
-            for rule in cls.upnp.rules:
-                if int(rule["NewInternalPort"]) == int(rule["NewExternalPort"]) == port and \
-                        rule["NewPortMappingDescription"].startswith("ServerServer"):
-                    cls.upnp.delete_port(rule["NewExternalPort"], rule["NewProtocol"])
-            if delete and full_port.get("routed"):
-                cls.cloudflare.delete_record(full_port.get("domain"), service=full_port.get("service"))
+        for rule in cls.upnp.rules:
+            if int(rule["NewInternalPort"]) == int(rule["NewExternalPort"]) == full_port["port"] and \
+                    rule["NewPortMappingDescription"].startswith("ServerServer"):
+                cls.upnp.delete_port(rule["NewExternalPort"], rule["NewProtocol"])
+        if delete and full_port.get("routed"):
+            cls.cloudflare.delete_record(full_port.get("domain"), service=full_port.get("service"))
 
     @classmethod
     def get_connection_to_port(cls, port):
         for p in cls.all_ports:
             if p.get("port") == port:
+                if p.get("pending"):
+                    return f"{cls.ip}:{port} (address pending)"
                 if not p.get("forwarded"):
                     return f"{cls.ip}:{port}"
                 elif not p.get("routed"):
@@ -592,6 +689,7 @@ class PortHandler:
             cls.certManager.setup("", path, ips, True)
         else:
             cls.certManager.setup("", path, [cls.ip], True)
+        cls.certManager.replace_self_signed()
 
     @classmethod
     def get_cert_files(cls):
@@ -0,0 +1,176 @@
+from subprocess import Popen, STDOUT
+from os import path as ospath
+from json import loads, dumps, decoder
+from time import sleep
+import signal
+import os
+
+try:
+    from fcntl import fcntl, F_SETPIPE_SZ
+except ImportError:
+    fcntl = None
+    F_SETPIPE_SZ = None
+
+
+class FifoProcess:
+    # A server process whose stdin and stdout are named fifos in its instance folder instead of anonymous pipes.
+    # The child opens both fifos O_RDWR so it never sees EOF on stdin or EPIPE on stdout while no daemon is
+    # attached, a later daemon can open the same fifos and carry on where the last one stopped.
+    stdin_name = "stdin"
+    stdout_name = "stdout"
+    pipe_size = 1048576
+
+    def __init__(self, pid, fifo_dir, popen=None):
+        self.pid = pid
+        self.fifo_dir = fifo_dir
+        self.popen = popen
+        self.returncode = None
+        self.start_time = self.read_start_time(pid)
+        self.stdin = None
+        self.stdout = None
+        self.stderr = None
+
+    @staticmethod
+    def get_supported():
+        return hasattr(os, "mkfifo")
+
+    @classmethod
+    def launch(cls, args, fifo_dir, cwd=None, env=None):
+        if not ospath.isdir(fifo_dir):
+            os.makedirs(fifo_dir)
+        stdin_path = ospath.join(fifo_dir, cls.stdin_name)
+        stdout_path = ospath.join(fifo_dir, cls.stdout_name)
+        for fifo in [stdin_path, stdout_path]:
+            # Leftovers from a server that died while no daemon was attached may still hold old output
+            if ospath.exists(fifo):
+                os.remove(fifo)
+            os.mkfifo(fifo, 0o600)
+
+        child_in = os.open(stdin_path, os.O_RDWR)
+        child_out = os.open(stdout_path, os.O_RDWR)
+        if fcntl and F_SETPIPE_SZ:
+            try:
+                # A bigger buffer means the server can keep writing for longer while the daemon is restarting
+                fcntl(child_out, F_SETPIPE_SZ, cls.pipe_size)
+            except OSError:
+                pass
+        try:
+            # A new session keeps the server out of the daemon's process group so a ctrl+c or a closed terminal
+            # doesn't reach it
+            popen = Popen(args, cwd=cwd, env=env, stdin=child_in, stdout=child_out, stderr=STDOUT,
+                          start_new_session=True)
+        finally:
+            os.close(child_in)
+            os.close(child_out)
+        process = cls(popen.pid, fifo_dir, popen)
+        process.open_streams()
+        return process
+
+    @classmethod
+    def adopt(cls, pid, fifo_dir, start_time):
+        # Returns None if the process is gone or the pid now belongs to something else
+        if cls.read_start_time(pid) != start_time or start_time is None:
+            return None
+        for name in [cls.stdin_name, cls.stdout_name]:
+            if not ospath.exists(ospath.join(fifo_dir, name)):
+                return None
+        process = cls(pid, fifo_dir)
+        process.open_streams()
+        return process
+
+    def open_streams(self):
+        # The child holds a reader on stdin so this open can't block, stdout is opened read only so the daemon
+        # still gets EOF once the server exits
+        stdin = os.open(ospath.join(self.fifo_dir, self.stdin_name), os.O_WRONLY | os.O_NONBLOCK)
+        os.set_blocking(stdin, True)
+        self.stdin = os.fdopen(stdin, "wb")
+        stdout = os.open(ospath.join(self.fifo_dir, self.stdout_name), os.O_RDONLY | os.O_NONBLOCK)
+        self.stdout = os.fdopen(stdout, "rb")
+
+    @staticmethod
+    def read_start_time(pid):
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        fields = data[data.rfind(b")") + 2:].split()
+        if len(fields) < 20 or fields[0] == b"Z":
+            return None
+        return int(fields[19])
+
+    def poll(self):
+        if self.returncode is not None:
+            return self.returncode
+        if self.popen:
+            self.returncode = self.popen.poll()
+            return self.returncode
+        try:
+            # Still reapable after the daemon re-execs itself since the pid doesn't change
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                self.returncode = os.waitstatus_to_exitcode(status)
+            return self.returncode
+        except ChildProcessError:
+            pass
+        if self.read_start_time(self.pid) != self.start_time:
+            # Another daemon started it so there is no exit code to collect
+            self.returncode = -1
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if self.popen:
+            self.returncode = self.popen.wait(timeout)
+            return self.returncode
+        while self.poll() is None:
+            sleep(0.1)
+        return self.returncode
+
+    def send_signal(self, sig):
+        # The server leads its own session, signalling the group also reaches anything it started itself
+        if self.poll() is None:
+            try:
+                group = os.getpgid(self.pid)
+            except ProcessLookupError:
+                return
+            if group == self.pid:
+                os.killpg(group, sig)
+            else:
+                os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def get_record(self):
+        return {"pid": self.pid, "start_time": self.start_time, "fifo_dir": self.fifo_dir}
+
+
+class HandoverFile:
+    # format {"instances": [{"type": type, "name": name, "pid": pid, "start_time": ticks, "fifo_dir": path}, ...]}
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def write(self, records):
+        temp_path = self.file_path + ".tmp"
+        with open(temp_path, "w") as file:
+            file.write(dumps({"instances": records}))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.file_path)
+
+    def read(self):
+        try:
+            with open(self.file_path, "r") as file:
+                return loads(file.read()).get("instances", [])
+        except (IOError, decoder.JSONDecodeError, AttributeError):
+            return []
+
+    def exists(self):
+        return ospath.isfile(self.file_path)
+
+    def remove(self):
+        if ospath.isfile(self.file_path):
+            os.remove(self.file_path)
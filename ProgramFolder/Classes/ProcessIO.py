@@ -0,0 +1,208 @@
+from selectors import DefaultSelector, EVENT_READ
+from socket import socketpair
+from socket import error as sock_error
+from threading import Thread, Lock, Event
+from platform import system
+from os import read, set_blocking
+
+
+class ProcessIO(Thread):
+    chunk_size = 65536
+
+    def __init__(self, logger=None):
+        super(ProcessIO, self).__init__(daemon=True)
+        self.logger = logger
+        self.selector = None
+        self.wakeup_sockets = None
+        self.lock = Lock()
+
+        self.pending = []       # streams waiting to be registered by the io thread
+        self.streams = {}       # format {fileno: {"stream": stream, "process": process, "partial": bytes}}
+        self.processes = {}     # format {process: {"open": count, "line_callback": f, "close_callback": f,
+                                #          "readable": Event}}
+        self.exiting = []       # processes whose streams closed but have not exited yet
+        self.paused = set()     # processes whose streams aren't read until they are resumed
+        self.resumed = []       # processes whose streams the io thread should read again
+
+        # Pipes can't be used with select on windows so each stream gets a reader thread there instead
+        self.threaded = system() == "Windows"
+
+    def ensure_started(self):
+        with self.lock:
+            if self.is_alive() or self.threaded:
+                return
+            self.selector = DefaultSelector()
+            self.wakeup_sockets = socketpair()
+            for sock in self.wakeup_sockets:
+                sock.setblocking(False)
+            self.selector.register(self.wakeup_sockets[0], EVENT_READ)
+            self.start()
+
+    def register(self, process, streams, line_callback, close_callback=None):
+        streams = [i for i in streams if i]
+        readable = Event()
+        readable.set()
+        self.processes[process] = {"open": len(streams), "line_callback": line_callback,
+                                   "close_callback": close_callback, "readable": readable}
+        if self.threaded:
+            for stream in streams:
+                Thread(target=self.read_stream, args=(stream, process), daemon=True).start()
+            if len(streams) == 0:
+                self.stream_closed(process)
+            return
+
+        self.ensure_started()
+        if len(streams) == 0:
+            self.stream_closed(process)
+        with self.lock:
+            for stream in streams:
+                set_blocking(stream.fileno(), False)
+                self.pending.append((stream, process))
+        self.wakeup()
+
+    def pause(self, process):
+        # Stops reading the process's streams, what it writes meanwhile waits in the pipe
+        with self.lock:
+            info = self.processes.get(process)
+            if not info:
+                return
+            self.paused.add(process)
+            info["readable"].clear()
+
+    def resume(self, process):
+        with self.lock:
+            info = self.processes.get(process)
+            if not info or process not in self.paused:
+                return
+            self.paused.discard(process)
+            info["readable"].set()
+            self.resumed.append(process)
+        if not self.threaded:
+            self.wakeup()
+
+    def wakeup(self):
+        try:
+            self.wakeup_sockets[1].send(b"\x00")
+        except sock_error:
+            pass
+
+    def run(self):
+        while True:
+            timeout = 0.5 if self.exiting else None
+            for key, mask in self.selector.select(timeout):
+                if key.fileobj == self.wakeup_sockets[0]:
+                    try:
+                        while self.wakeup_sockets[0].recv(1024):
+                            pass
+                    except sock_error:
+                        pass
+                    self.register_pending()
+                else:
+                    self.read_ready(key.fd)
+            self.check_exiting()
+
+    def register_pending(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+            resumed = self.resumed
+            self.resumed = []
+        for stream, process in pending:
+            fileno = stream.fileno()
+            self.streams[fileno] = {"stream": stream, "process": process, "partial": b"", "paused": False}
+            self.selector.register(fileno, EVENT_READ)
+        for fileno, entry in self.streams.items():
+            if entry["paused"] and entry["process"] in resumed:
+                entry["paused"] = False
+                self.selector.register(fileno, EVENT_READ)
+
+    def read_ready(self, fileno):
+        entry = self.streams[fileno]
+        if entry["process"] in self.paused:
+            # Unregistered rather than left unread so select doesn't keep reporting it
+            self.selector.unregister(fileno)
+            entry["paused"] = True
+            return
+        try:
+            data = read(fileno, self.chunk_size)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+
+        if data:
+            entry["partial"] = self.dispatch(entry["process"], entry["partial"] + data)
+            return
+
+        self.selector.unregister(fileno)
+        del self.streams[fileno]
+        self.dispatch(entry["process"], entry["partial"], final=True)
+        entry["stream"].close()
+        self.stream_closed(entry["process"])
+
+    def read_stream(self, stream, process):
+        partial = b""
+        readable = self.processes[process]["readable"]
+        while True:
+            # Each stream has its own thread here so it can simply wait while paused
+            readable.wait()
+            try:
+                data = stream.read1(self.chunk_size)
+            except (OSError, ValueError):
+                data = b""
+            if not data:
+                break
+            partial = self.dispatch(process, partial + data)
+        self.dispatch(process, partial, final=True)
+        stream.close()
+        self.stream_closed(process)
+
+    def dispatch(self, process, data, final=False):
+        lines = data.split(b"\n")
+        partial = b"" if final else lines.pop()
+        callback = self.processes[process]["line_callback"]
+        for line in lines:
+            line = line.decode(errors="replace").rstrip("\r")
+            if line:
+                # One bad line or callback mustn't stop every other instance's output from being read
+                try:
+                    callback(line)
+                except Exception as e:
+                    self.log(f"Error handling output line, Error: {e.__repr__()}")
+        return partial
+
+    def stream_closed(self, process):
+        with self.lock:
+            info = self.processes[process]
+            info["open"] -= 1
+            if info["open"] > 0:
+                return
+        if process.poll() is None and not self.threaded:
+            self.exiting.append(process)
+            return
+        if self.threaded:
+            process.wait()
+        self.process_exited(process)
+
+    def check_exiting(self):
+        for process in list(self.exiting):
+            if process.poll() is not None:
+                self.exiting.remove(process)
+                self.process_exited(process)
+
+    def process_exited(self, process):
+        with self.lock:
+            info = self.processes.pop(process)
+            self.paused.discard(process)
+        if info["close_callback"]:
+            try:
+                info["close_callback"](process)
+            except Exception as e:
+                self.log(f"Error handling process exit, Error: {e.__repr__()}")
+
+    def get_stream_count(self):
+        return len(self.streams)
+
+    def log(self, string):
+        if self.logger:
+            self.logger(string)
@@ -0,0 +1,164 @@
+from .OutputQueue import OutputQueue
+from threading import Lock
+from time import time
+
+
+class RemoteNode:
+    # The coordinator's view of a connected agent, commands go out as agent_command packets and whatever the agent
+    # prints while running them comes back as agent_output packets tagged with the command's id
+    def __init__(self, name, handle):
+        self.name = name
+        self.handle = handle
+        self.controllers = []
+        self.load = {}
+        self.instances = {}     # format {(type, name): RemoteController}
+        self.pending = {}       # format {command id: handle or None}
+        self.next_id = 0
+        self.lock = Lock()
+        self.last_update = time()
+
+    def get_name(self):
+        return self.name
+
+    def get_handle(self):
+        return self.handle
+
+    def get_load(self):
+        return self.load
+
+    def get_controllers(self):
+        return self.controllers
+
+    def get_instances(self):
+        return self.instances
+
+    def update(self, packet):
+        self.controllers = packet.get("controllers", self.controllers)
+        self.load = packet.get("load", self.load)
+        self.last_update = time()
+
+    def send_command(self, handle, path, command, args):
+        with self.lock:
+            id_ = self.next_id
+            self.next_id += 1
+            self.pending[id_] = handle
+        # Commands the coordinator issues itself (starting a proxied instance and so on) were already permission
+        # checked against the user that asked for them
+        permission = handle.get_permissions() if handle else self.handle.get_max_permission()
+        packet = {"type": "agent_command", "id": id_, "path": list(path), "command": command, "args": list(args),
+                  "user": handle.get_username() if handle else "", "permission": permission}
+        connection = self.handle.get_connection()
+        if connection:
+            connection.send_packet(packet)
+        return id_
+
+    def handle_output(self, packet):
+        if "instance" in packet:
+            instance = self.instances.get(tuple(packet["instance"]))
+            if instance:
+                instance.add_lines(packet.get("lines", []), packet.get("levels"))
+            return instance
+        id_ = packet.get("id")
+        with self.lock:
+            handle = self.pending.get(id_)
+            if packet.get("done"):
+                self.pending.pop(id_, None)
+        if handle and "text" in packet:
+            handle.print(packet["text"])
+        return None
+
+    def get_pending_count(self):
+        return len(self.pending)
+
+    def clear_pending(self):
+        with self.lock:
+            self.pending.clear()
+
+
+class RemoteController:
+    # Stands in for an instance running on an agent so the manager can list, route and command it like a local one
+    remote = True
+
+    def __init__(self, node, type_, name, config=None):
+        self.node = node
+        self.type = type_
+        self.name = name
+        self.running = False
+        self.address = ""
+        self.info = ""
+        self.resource_lines = []
+        config = config or {}
+        # Lines arrive already prefixed by the agent. The main loop both fills and drains this queue so it can't
+        # block waiting for room.
+        policy = config.get("outputQueuePolicy", "coalesce")
+        self.queue = OutputQueue("", config.get("outputQueueLines", 5000), "coalesce" if policy == "block" else policy)
+
+    def update(self, data):
+        self.running = data.get("running", False)
+        self.address = data.get("address", "")
+        self.info = data.get("info", "")
+        self.resource_lines = data.get("resources", [])
+
+    def get_node(self):
+        return self.node
+
+    def get_name(self):
+        return self.name
+
+    def get_running(self):
+        return self.running
+
+    def get_address(self):
+        return self.address
+
+    def get_info(self):
+        info = f"Node: {self.node.get_name()}"
+        if self.info:
+            info += f"\n{self.info}"
+        return info
+
+    def get_resource_lines(self):
+        return self.resource_lines
+
+    def get_output_lines(self):
+        return [self.queue.get_line()]
+
+    def get_data(self):
+        return None
+
+    def get_log(self):
+        return None
+
+    def get_memory(self):
+        # Memory is accounted for by the agent's own ledger
+        return 0
+
+    def add_lines(self, lines, levels=None):
+        for line, level in zip(lines, levels or [None] * len(lines)):
+            self.queue.put(line, level)
+
+    def get_queue(self):
+        return self.queue.get_all()
+
+    def send(self, command, handle=None):
+        return self.node.send_command(handle, [], command, [self.type, self.name])
+
+    # A handle gets the agent's own reply, without one the reply is dropped
+    def start(self, handle=None):
+        self.send("start", handle)
+
+    def stop(self, handle=None):
+        self.send("stop", handle)
+
+    def shutdown(self):
+        pass
+
+    def setup(self, handle=None):
+        self.send("setup", handle)
+
+    def remove(self, handle=None):
+        self.send("removeinstance", handle)
+
+    def run_command(self, name, handle, *args, **kwargs):
+        self.node.send_command(handle, [self.type, self.name], name, args)
+        return True
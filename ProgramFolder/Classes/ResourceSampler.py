@@ -0,0 +1,193 @@
+from threading import Thread, Lock, Event
+from os import path as ospath
+from os import listdir, sysconf
+from time import monotonic
+
+
+class ResourceSampler(Thread):
+    # A single pass over /proc per interval covers every tracked instance and every process they started. Each
+    # process's stat file is read once per pass to build the child trees, so the cost grows with the number of
+    # processes on the host rather than with the number of instances.
+    proc_dir = "/proc"
+
+    def __init__(self, interval=5):
+        super(ResourceSampler, self).__init__(daemon=True)
+        self.interval = interval
+        self.lock = Lock()
+        self.event = Event()
+
+        self.roots = {}         # format {key: pid}
+        self.samples = {}       # format {key: {"pids": n, "cpu": percent, "rss": bytes, ...}}
+        self.previous = {}      # format {(pid, start time): (cpu ticks, read bytes, write bytes)}
+        self.last_pass = 0
+        self.pass_time = 0
+        self.passes = 0
+
+        self.available = ospath.isdir(ospath.join(self.proc_dir, "self"))
+        self.clock_ticks = sysconf("SC_CLK_TCK") if self.available else 100
+        self.page_size = sysconf("SC_PAGE_SIZE") if self.available else 4096
+
+    def ensure_started(self):
+        with self.lock:
+            if self.is_alive() or not self.available or self.interval <= 0:
+                return
+            self.start()
+
+    def track(self, key, pid):
+        with self.lock:
+            self.roots[key] = pid
+        self.ensure_started()
+
+    def untrack(self, key):
+        with self.lock:
+            self.roots.pop(key, None)
+            self.samples.pop(key, None)
+
+    def set_interval(self, interval):
+        self.interval = interval
+        self.event.set()
+
+    def run(self):
+        while True:
+            self.event.wait(self.interval)
+            self.event.clear()
+            try:
+                self.sample_all()
+            except OSError:
+                pass
+
+    def sample_all(self):
+        start = monotonic()
+        with self.lock:
+            roots = dict(self.roots)
+        if not roots:
+            self.samples = {}
+            self.previous = {}
+            self.last_pass = start
+            return
+
+        stats = {}
+        children = {}   # format {ppid: [pid, ...]}
+        for name in listdir(self.proc_dir):
+            if not name.isdigit():
+                continue
+            stat = self.read_stat(int(name))
+            if stat:
+                stats[stat["pid"]] = stat
+                children.setdefault(stat["ppid"], []).append(stat["pid"])
+
+        elapsed = start - self.last_pass if self.last_pass else 0
+        previous = {}
+        samples = {}
+        for key, root in roots.items():
+            if root not in stats:
+                continue
+            # The first pass for an instance only sets the baseline for its rates
+            first = key not in self.samples
+            sample = {"pids": 0, "cpu": 0.0, "rss": 0, "threads": 0, "fds": 0,
+                      "read_bytes": 0, "write_bytes": 0, "read_rate": 0.0, "write_rate": 0.0}
+            cpu_ticks = read_delta = write_delta = 0
+            pids = [root]
+            while pids:
+                pid = pids.pop()
+                stat = stats[pid]
+                pids += children.get(pid, [])
+                read_bytes, write_bytes = self.read_io(pid)
+                current = (stat["cpu"], read_bytes, write_bytes)
+                ident = (pid, stat["start"])
+                prev = current if first else self.previous.get(ident, (0, 0, 0))
+                previous[ident] = current
+
+                sample["pids"] += 1
+                sample["rss"] += stat["rss"]
+                sample["threads"] += stat["threads"]
+                sample["fds"] += self.count_fds(pid)
+                sample["read_bytes"] += read_bytes
+                sample["write_bytes"] += write_bytes
+                cpu_ticks += max(0, current[0] - prev[0])
+                read_delta += max(0, current[1] - prev[1])
+                write_delta += max(0, current[2] - prev[2])
+            if elapsed > 0:
+                sample["cpu"] = cpu_ticks / self.clock_ticks / elapsed * 100
+                sample["read_rate"] = read_delta / elapsed
+                sample["write_rate"] = write_delta / elapsed
+            samples[key] = sample
+
+        with self.lock:
+            # Drop anything untracked while the pass was running
+            self.samples = {k: v for k, v in samples.items() if k in self.roots}
+        self.previous = previous
+        self.last_pass = start
+        self.pass_time = monotonic() - start
+        self.passes += 1
+
+    def read_stat(self, pid):
+        try:
+            with open(ospath.join(self.proc_dir, str(pid), "stat"), "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        # The command name is in parentheses and can contain spaces, so fields are counted from the last ")"
+        fields = data[data.rfind(b")") + 2:].split()
+        if len(fields) < 22:
+            return None
+        return {"pid": pid,
+                "ppid": int(fields[1]),
+                "cpu": int(fields[11]) + int(fields[12]),
+                "threads": int(fields[17]),
+                "start": int(fields[19]),
+                "rss": int(fields[21]) * self.page_size}
+
+    def read_io(self, pid):
+        read_bytes = write_bytes = 0
+        try:
+            with open(ospath.join(self.proc_dir, str(pid), "io"), "rb") as file:
+                for line in file:
+                    if line.startswith(b"read_bytes:"):
+                        read_bytes = int(line.split()[1])
+                    elif line.startswith(b"write_bytes:"):
+                        write_bytes = int(line.split()[1])
+        except (OSError, ValueError):
+            pass
+        return read_bytes, write_bytes
+
+    def count_fds(self, pid):
+        try:
+            return len(listdir(ospath.join(self.proc_dir, str(pid), "fd")))
+        except OSError:
+            return 0
+
+    def get_sample(self, key):
+        return self.samples.get(key)
+
+    def get_available(self):
+        return self.available
+
+    def get_totals(self):
+        samples = list(self.samples.values())
+        return {"instances": len(samples),
+                "pids": sum(i["pids"] for i in samples),
+                "cpu": sum(i["cpu"] for i in samples),
+                "rss": sum(i["rss"] for i in samples)}
+
+    def get_pass_time(self):
+        return self.pass_time
+
+    def get_passes(self):
+        return self.passes
+
+    @staticmethod
+    def format_bytes(size):
+        for unit in ["B", "KiB", "MiB", "GiB"]:
+            if abs(size) < 1024:
+                return f"{size:.1f} {unit}" if unit != "B" else f"{size:.0f} {unit}"
+            size /= 1024
+        return f"{size:.1f} TiB"
+
+    @classmethod
+    def format_sample(cls, sample):
+        return [f"CPU: {sample['cpu']:.1f}%",
+                f"Memory: {cls.format_bytes(sample['rss'])}",
+                f"Processes: {sample['pids']}, Threads: {sample['threads']}, Open files: {sample['fds']}",
+                f"Disk: {cls.format_bytes(sample['read_rate'])}/s read, "
+                f"{cls.format_bytes(sample['write_rate'])}/s written"]
@@ -0,0 +1,83 @@
+from threading import Lock
+
+
+class RoutingTable:
+    def __init__(self):
+        self.handles = []
+        self.routes = {}    # format {((controller, instance) or None, level or None): (handle1, handle2, ...)}
+        self.min_levels = {}    # format {(controller, instance): lowest level any recipient is subscribed to}
+        self.generation = 0     # bumped whenever min_levels is cleared, a level computed before that is stale
+        self.lock = Lock()
+
+    @staticmethod
+    def accepts(handle, focus, level=None):
+        if not handle.get_logged_in():
+            return False
+        if level is not None and level < handle.get_min_level():
+            return False
+        if not focus:
+            return True
+        if handle.is_focused():
+            return handle.check_focus(focus)
+        if handle.is_filtered():
+            return handle.check_filter(focus)
+        return True
+
+    def add_handle(self, handle):
+        with self.lock:
+            if handle not in self.handles:
+                self.handles.append(handle)
+            self.clear_min_levels()
+        self.update_handle(handle)
+
+    def remove_handle(self, handle):
+        with self.lock:
+            if handle in self.handles:
+                self.handles.remove(handle)
+            for key, recipients in self.routes.items():
+                if handle in recipients:
+                    self.routes[key] = tuple(i for i in recipients if i is not handle)
+            self.clear_min_levels()
+
+    def update_handle(self, handle):
+        with self.lock:
+            if handle not in self.handles:
+                return
+            for key, recipients in self.routes.items():
+                accepted = self.accepts(handle, *key)
+                if accepted and handle not in recipients:
+                    self.routes[key] = recipients + (handle,)
+                elif not accepted and handle in recipients:
+                    self.routes[key] = tuple(i for i in recipients if i is not handle)
+            self.clear_min_levels()
+
+    def clear_min_levels(self):
+        # Called with the lock held
+        self.min_levels = {}
+        self.generation += 1
+
+    def get_recipients(self, focus=None, level=None):
+        recipients = self.routes.get((focus, level))
+        if recipients is None:
+            with self.lock:
+                recipients = tuple(i for i in self.handles if self.accepts(i, focus, level))
+                self.routes[(focus, level)] = recipients
+        return recipients
+
+    def get_min_level(self, focus):
+        # The lowest level anyone receiving focus's output is subscribed to, None if no one receives it
+        min_levels = self.min_levels
+        if focus in min_levels:
+            return min_levels[focus]
+        with self.lock:
+            generation = self.generation
+        recipients = self.get_recipients(focus)
+        level = min((i.get_min_level() for i in recipients), default=None)
+        with self.lock:
+            # A handle changed while this was computed, the next call computes it again
+            if self.generation == generation:
+                self.min_levels[focus] = level
+        return level
+
+    def get_route_count(self):
+        return len(self.routes)
@@ -0,0 +1,38 @@
+from collections import deque
+from threading import Lock
+
+
+class Scrollback:
+    # Ring of recent output bounded by encoded size rather than line count, a few stack traces shouldn't
+    # push out an hour of short chat lines
+    def __init__(self, max_bytes=262144):
+        self.max_bytes = max_bytes
+        self.lines = deque()    # format deque([(focus, utf-8 bytes), ...])
+        self.size = 0
+        self.lock = Lock()
+
+    def append(self, line, focus=None):
+        data = line.encode(errors="replace")
+        if len(data) > self.max_bytes:
+            data = data[-self.max_bytes:]
+        with self.lock:
+            self.lines.append((focus, data))
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                self.size -= len(self.lines.popleft()[1])
+
+    def get_lines(self, check=None):
+        with self.lock:
+            lines = list(self.lines)
+        return [data.decode(errors="replace") for focus, data in lines if not check or check(focus)]
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+
+    def get_size(self):
+        return self.size
+
+    def clear(self):
+        with self.lock:
+            self.lines.clear()
+            self.size = 0
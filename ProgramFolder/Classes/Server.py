@@ -1,54 +1,153 @@
-from socket import socket
+from socket import socket, socketpair
 from socket import error as sock_error
 from select import select
-from time import sleep
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
+from time import sleep, monotonic
 from pickle import dumps, load, PickleError, HIGHEST_PROTOCOL
 from json import dumps as j_dumps
 from json import loads as j_loads
-from threading import Thread
+from threading import Thread, RLock, Lock
 from queue import Queue, Empty
+from collections import deque
 from io import BytesIO
+from .PacketBuffer import PacketBuffer
+from .LoopStats import LoopStats
 import ssl
 
 
 class ClientHandler:
-    def __init__(self, id_, socket_, address, version, server):
+    def __init__(self, id_, socket_, address, version, server, framed=False):
         self.id = id_
         self.socket = socket_
+        self.fileno = socket_.fileno()
         self.address = address
         self.version = version
         self.server = server
+        self.framed = framed
 
         self.bytes = b""
         self.bytes_queue = Queue()
 
+        self.packet_buffer = PacketBuffer(version) if framed else None
+        self.packets = Queue()
+
+        self.send_queue = deque()
+        self.send_queue_bytes = 0
+        self.send_lock = Lock()
+        self.write_waiting = False
+        self.congested = False
+        self.dropped_packets = 0
+        self.closed = False
+
     def get_id(self):
         return self.id
 
     def get_socket(self):
         return self.socket
 
+    def get_fileno(self):
+        return self.fileno
+
     def get_version(self):
         return self.version
 
+    def get_framed(self):
+        return self.framed
+
     def get_addr(self):
         return self.address
 
+    def encode(self, packet):
+        if self.framed:
+            return PacketBuffer.encode(packet, self.version)
+        elif self.version != -1:
+            return dumps(packet, protocol=self.version)
+        return j_dumps(packet).encode() + b"\x00"
+
     def send_packet(self, packet):
-        try:
-            if self.version != -1:
-                self.socket.send(dumps(packet, protocol=self.version))
-            else:
-                self.socket.send(j_dumps(packet).encode() + b"\x00")
-        except sock_error:
+        return self.queue_bytes(self.encode(packet), droppable=packet.get("type") == "text")
+
+    def queue_bytes(self, data, droppable=False):
+        over_budget = False
+        with self.send_lock:
+            if self.closed:
+                return False
+            # Console text is the only thing a congested client can miss without breaking its session
+            if droppable and self.congested and self.server.get_slow_client_policy() == "degrade":
+                self.dropped_packets += 1
+                return False
+            self.send_queue.append(memoryview(data))
+            self.send_queue_bytes += len(data)
+            high_water, low_water, budget = self.server.get_send_limits()
+            if self.send_queue_bytes > budget:
+                over_budget = True
+            elif self.send_queue_bytes > high_water:
+                self.congested = True
+        if over_budget:
+            self.server.log(f"Disconnecting {self.address}: send queue exceeded {budget} bytes")
             self.close()
+            return False
+        self.server.request_flush(self)
+        return True
+
+    def flush(self):
+        with self.send_lock:
+            while self.send_queue:
+                view = self.send_queue[0]
+                try:
+                    sent = self.socket.send(view)
+                except (BlockingIOError, ssl.SSLWantWriteError, ssl.SSLWantReadError):
+                    return False
+                self.send_queue_bytes -= sent
+                if sent < len(view):
+                    self.send_queue[0] = view[sent:]
+                    return False
+                self.send_queue.popleft()
+
+            high_water, low_water, budget = self.server.get_send_limits()
+            if self.congested and self.send_queue_bytes <= low_water:
+                self.congested = False
+                if self.dropped_packets:
+                    notice = {"type": "text", "newline": True, "loop": True,
+                              "text": f"[{self.dropped_packets} message(s) dropped while connection was slow]"}
+                    self.dropped_packets = 0
+                    data = self.encode(notice)
+                    self.send_queue.append(memoryview(data))
+                    self.send_queue_bytes += len(data)
+                    return False
+            return True
+
+    def has_pending(self):
+        return len(self.send_queue) > 0
+
+    def get_queue_size(self):
+        return len(self.send_queue), self.send_queue_bytes
+
+    def get_congested(self):
+        return self.congested
+
+    def get_dropped(self):
+        return self.dropped_packets
 
     def close(self):
+        with self.send_lock:
+            self.closed = True
+            self.send_queue.clear()
+            self.send_queue_bytes = 0
         self.server.close_connection(self.id)
 
     def add_bytes(self, bytes_):
         self.bytes_queue.put(bytes_)
 
+    def receive(self):
+        received = self.packet_buffer.recv_into(self.socket)
+        # TLS can hold decrypted bytes that select won't report as readable
+        while received and isinstance(self.socket, ssl.SSLSocket) and self.socket.pending():
+            received += self.packet_buffer.recv_into(self.socket)
+        for packet in self.packet_buffer.get_packets():
+            self.packets.put(packet)
+        return received
+
     def gather_bytes(self):
         while self.bytes_queue.qsize() > 0:
             try:
@@ -57,6 +156,12 @@ class ClientHandler:
                 break
 
     def get_packet(self):
+        if self.framed:
+            try:
+                return self.packets.get(False)
+            except Empty:
+                return None
+
         self.gather_bytes()
         if len(self.bytes) == 0:
             return None
@@ -91,16 +196,85 @@ class ClientHandler:
         return out
 
 
+class PendingConnection:
+    # An accepted socket still going through the TLS handshake and the version exchange. Every step is non-blocking
+    # and resumed on the socket's next selector event, so a slow or silent client never holds up the other clients.
+    def __init__(self, socket_, address, greeting):
+        self.socket = socket_
+        self.fileno = socket_.fileno()
+        self.address = address
+        self.handshaking = isinstance(socket_, ssl.SSLSocket)
+        self.outgoing = greeting
+        self.received = b""     # the client's 2 version bytes, which can arrive one at a time
+        self.want_write = False
+        self.started = monotonic()
+
+    def get_socket(self):
+        return self.socket
+
+    def get_fileno(self):
+        return self.fileno
+
+    def get_addr(self):
+        return self.address
+
+    def get_want_write(self):
+        return self.want_write
+
+    def get_age(self):
+        return monotonic() - self.started
+
+    def advance(self):
+        # Returns True once the client's version has arrived, raises sock_error if the connection failed
+        if self.handshaking:
+            try:
+                self.socket.do_handshake()
+            except ssl.SSLWantReadError:
+                self.want_write = False
+                return False
+            except ssl.SSLWantWriteError:
+                self.want_write = True
+                return False
+            self.handshaking = False
+        try:
+            while self.outgoing:
+                self.outgoing = self.outgoing[self.socket.send(self.outgoing):]
+            while len(self.received) < 2:
+                data = self.socket.recv(2 - len(self.received))
+                if not data:
+                    raise ConnectionResetError("Connection closed during the version exchange")
+                self.received += data
+        except (BlockingIOError, ssl.SSLWantReadError):
+            self.want_write = len(self.outgoing) > 0
+            return False
+        except ssl.SSLWantWriteError:
+            self.want_write = True
+            return False
+        return True
+
+    def get_version(self):
+        # Returns (framed, version), raises ValueError for anything that isn't a version
+        client_version = self.received.decode()
+        # Framed clients reply with their version followed by "F", "J" standing in for json
+        framed = client_version.endswith("F")
+        if framed:
+            client_version = "-1" if client_version[0] == "J" else client_version[0]
+        return framed, int(client_version)
+
+
 class Server(Thread):
     def __init__(self, logger=None):
         super(Server, self).__init__()
         self.wait_time = 0.1
+        self.recv_size = 1024
+        self.handshake_timeout = 5
         self.pickle_encoding = HIGHEST_PROTOCOL
 
         self.stopping = False
         self.running = False
         self.current_id = 0
         self.clients = {}
+        self.handshakes = {}    # format {fileno: PendingConnection}
         self.new_connections = Queue()
         self.old_connections = Queue()
 
@@ -111,12 +285,33 @@ class Server(Thread):
         self.certs = "", ""
         self.socket_list = []
 
+        self.reactor = True
+        self.selector = None
+        self.wakeup_sockets = None
+        self.fd_map = {}    # format {fileno: ClientHandler}
+        self.lock = RLock()
+        self.pending_flush = set()
+        self.wakeup_pending = False
+
+        self.send_high_water = 262144
+        self.send_low_water = 65536
+        self.send_budget = 4194304
+        self.slow_client_policy = "degrade"     # "degrade" drops console text while congested, "disconnect" doesn't
+
+        self.broadcast_encodes = 0
+        self.broadcast_encodes_saved = 0
+
+        self.event_queue = None
+        self.loop_stats = LoopStats()
+
         self.logger = logger
 
     def start(self):
         if not self.running:
             self.current_id = 0
             self.clients = {}
+            self.handshakes = {}
+            self.fd_map = {}
 
             self.new_connections.empty()
             self.old_connections.empty()
@@ -141,9 +336,17 @@ class Server(Thread):
                     sleep(1)
             self.socket.listen(10)
             if self.context:
-                wrapped_socket = self.context.wrap_socket(self.socket, server_side=True)
+                wrapped_socket = self.context.wrap_socket(self.socket, server_side=True, do_handshake_on_connect=False)
                 self.socket = wrapped_socket
 
+            if self.reactor:
+                self.selector = DefaultSelector()
+                self.wakeup_sockets = socketpair()
+                for sock in self.wakeup_sockets:
+                    sock.setblocking(False)
+                self.selector.register(self.socket, EVENT_READ)
+                self.selector.register(self.wakeup_sockets[0], EVENT_READ)
+
             self.update_sockets()
 
             self.running = True
@@ -151,11 +354,75 @@ class Server(Thread):
 
     def stop(self):
         self.stopping = True
-        self.socket.close()
+        if not self.selector:
+            self.socket.close()
         for i in self.get_client_ids():
             self.clients[i].close()
+        for connection in list(self.handshakes.values()):
+            self.drop_handshake(connection)
+        self.wakeup()
+
+    def wakeup(self):
+        if self.wakeup_sockets and not self.wakeup_pending:
+            self.wakeup_pending = True
+            try:
+                self.wakeup_sockets[1].send(b"\x00")
+            except sock_error:
+                pass
+
+    def request_flush(self, client):
+        if not self.selector:
+            return
+        with self.lock:
+            if client.write_waiting:
+                return
+            self.pending_flush.add(client)
+        self.wakeup()
 
     def run(self):
+        if self.selector:
+            self.run_reactor()
+        else:
+            self.run_poll()
+        self.running = False
+
+    def run_reactor(self):
+        stats = self.loop_stats
+        while not self.stopping:
+            # Wakes up now and then while handshakes are pending so silent ones time out
+            events = self.selector.select(1 if self.handshakes else None)
+            stats.start_tick()
+            for key, mask in events:
+                if key.fileobj == self.wakeup_sockets[0]:
+                    self.drain_wakeup()
+                    self.flush_pending()
+                    stats.mark("flush")
+                elif key.fileobj == self.socket:
+                    self.accept_connection()
+                    stats.mark("accept")
+                elif key.fd in self.handshakes:
+                    self.advance_handshake(self.handshakes[key.fd])
+                    stats.mark("handshake")
+                else:
+                    client = self.fd_map.get(key.fd)
+                    if client and mask & EVENT_WRITE:
+                        self.write_to_client(client)
+                        stats.mark("write")
+                    if client and mask & EVENT_READ:
+                        self.read_from_client(client)
+                        stats.mark("read")
+            if self.handshakes:
+                self.expire_handshakes()
+            stats.end_tick(len(events))
+
+        self.selector.close()
+        self.selector = None
+        self.socket.close()
+        for sock in self.wakeup_sockets:
+            sock.close()
+        self.wakeup_sockets = None
+
+    def run_poll(self):
         running = self.running
         while running:
             if self.wait_time > 0:
@@ -164,54 +431,169 @@ class Server(Thread):
                 running = False
                 self.socket.close()
                 continue
-            read_sockets, write_sockets, error_sockets = select(self.socket_list, [], [], 0)
+            self.loop_stats.start_tick()
+            with self.lock:
+                writers = [i.get_socket() for i in self.clients.values() if i.has_pending()]
+                writers += [i.get_socket() for i in self.handshakes.values() if i.get_want_write()]
+            read_sockets, write_sockets, error_sockets = select(self.socket_list, writers, [], 0)
+            self.loop_stats.mark("select")
+            for sock in set(read_sockets + write_sockets):
+                connection = self.handshakes.get(sock.fileno())
+                if connection:
+                    self.advance_handshake(connection)
+            for sock in write_sockets:
+                client = self.fd_map.get(sock.fileno())
+                if client:
+                    self.write_to_client(client)
+            self.loop_stats.mark("write")
             for sock in read_sockets:
                 if sock == self.socket:
-                    try:
-                        new_socket, address = self.socket.accept()
-                        new_socket.send(str(self.pickle_encoding).encode())
-                        client_version = new_socket.recv(2).decode()
-                        new_socket_version = int(client_version)
-                    except sock_error:
-                        continue
-
-                    client = ClientHandler(self.current_id,
-                                           new_socket,
-                                           address,
-                                           min(self.pickle_encoding, new_socket_version),
-                                           self)
-                    self.clients[self.current_id] = client
-                    self.new_connections.put(client.get_id())
-                    self.current_id += 1
-                    self.update_sockets()
+                    self.accept_connection()
                 else:
-                    id_ = -1
-                    data = b""
-                    for ids in self.clients:
-                        if self.clients[ids].get_socket() == sock:
-                            id_ = ids
-                            break
-                    error = False
-                    try:
-                        data = sock.recv(1024)
-                        if len(data) == 0:
-                            error = True
-                    except sock_error:
-                        error = True
-                    if error:
-                        if id_ != -1:
-                            self.close_connection(id_)
-                            continue
-                    if id_ != -1:
-                        client = self.get_client_from_id(id_)
-                        client.add_bytes(data)
+                    client = self.fd_map.get(sock.fileno())
+                    if client:
+                        self.read_from_client(client)
+            if self.handshakes:
+                self.expire_handshakes()
+            self.loop_stats.mark("read")
+            self.loop_stats.end_tick(len(read_sockets) + len(write_sockets))
+
+    def drain_wakeup(self):
+        try:
+            while self.wakeup_sockets[0].recv(1024):
+                pass
+        except sock_error:
+            pass
+        self.wakeup_pending = False
+
+    def flush_pending(self):
+        with self.lock:
+            clients = self.pending_flush
+            self.pending_flush = set()
+        for client in clients:
+            if client.get_id() in self.clients:
+                self.write_to_client(client)
+
+    def write_to_client(self, client):
+        try:
+            done = client.flush()
+        except sock_error:
+            self.close_connection(client.get_id())
+            return
+        if self.selector and done == client.write_waiting:
+            with self.lock:
+                if client.get_id() not in self.clients:
+                    return
+                client.write_waiting = not done
+                events = EVENT_READ if done else EVENT_READ | EVENT_WRITE
+                self.selector.modify(client.get_socket(), events)
+
+    def accept_connection(self):
+        try:
+            new_socket, address = self.socket.accept()
+            new_socket.setblocking(False)
+        except sock_error:
+            return
+        connection = PendingConnection(new_socket, address, str(self.pickle_encoding).encode())
+        with self.lock:
+            self.handshakes[connection.get_fileno()] = connection
+            if self.selector:
+                self.selector.register(new_socket, EVENT_READ)
+            self.update_sockets()
+        self.advance_handshake(connection)
 
-        self.running = False
+    def advance_handshake(self, connection):
+        try:
+            done = connection.advance()
+            if done:
+                framed, version = connection.get_version()
+        except (sock_error, ValueError):
+            self.drop_handshake(connection)
+            return
+        with self.lock:
+            if connection.get_fileno() not in self.handshakes:
+                return
+            if not done:
+                if self.selector:
+                    events = EVENT_READ | EVENT_WRITE if connection.get_want_write() else EVENT_READ
+                    self.selector.modify(connection.get_socket(), events)
+                return
+            del self.handshakes[connection.get_fileno()]
+            if self.selector:
+                self.selector.unregister(connection.get_socket())
+        self.add_client(connection.get_socket(), connection.get_addr(), version, framed)
+
+    def drop_handshake(self, connection):
+        with self.lock:
+            if self.handshakes.pop(connection.get_fileno(), None) is None:
+                return
+            if self.selector:
+                try:
+                    self.selector.unregister(connection.get_socket())
+                except (KeyError, ValueError):
+                    pass
+            connection.get_socket().close()
+            self.update_sockets()
+
+    def expire_handshakes(self):
+        for connection in list(self.handshakes.values()):
+            if connection.get_age() > self.handshake_timeout:
+                self.log(f"Dropping {connection.get_addr()}: no handshake within {self.handshake_timeout}s")
+                self.drop_handshake(connection)
+
+    def add_client(self, new_socket, address, new_socket_version, framed):
+        client = ClientHandler(self.current_id,
+                               new_socket,
+                               address,
+                               min(self.pickle_encoding, new_socket_version),
+                               self,
+                               framed=framed)
+        with self.lock:
+            self.clients[self.current_id] = client
+            self.fd_map[client.get_fileno()] = client
+            if self.selector:
+                self.selector.register(new_socket, EVENT_READ)
+            self.current_id += 1
+            self.update_sockets()
+        self.new_connections.put(client.get_id())
+        self.post_event()
+
+    def read_from_client(self, client):
+        if client.get_framed():
+            try:
+                received = client.receive()
+            except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                return
+            except (sock_error, ValueError, EOFError, PickleError, UnicodeDecodeError):
+                received = 0
+            if received == 0:
+                self.close_connection(client.get_id())
+            else:
+                self.post_event()
+            return
+
+        sock = client.get_socket()
+        try:
+            data = sock.recv(self.recv_size)
+            # TLS can hold decrypted bytes that select won't report as readable
+            while data and isinstance(sock, ssl.SSLSocket) and sock.pending():
+                data += sock.recv(sock.pending())
+        except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            return
+        except sock_error:
+            data = b""
+        if len(data) == 0:
+            self.close_connection(client.get_id())
+            return
+        client.add_bytes(data)
+        self.post_event()
 
     def update_sockets(self):
         self.socket_list = [self.socket]
         for i in self.clients:
             self.socket_list.append(self.clients[i].get_socket())
+        for i in self.handshakes.values():
+            self.socket_list.append(i.get_socket())
 
     def get_client_ids(self):
         return list(self.clients.keys())
@@ -230,6 +612,11 @@ class Server(Thread):
     def set_certs(self, certs):
         self.certs = certs
 
+    def reload_certs(self):
+        # Only affects new connections, ones already through the handshake keep the old certificate
+        if self.context and self.certs[0] and self.certs[1]:
+            self.context.load_cert_chain(self.certs[0], self.certs[1])
+
     def get_port(self):
         return self.port
 
@@ -254,10 +641,34 @@ class Server(Thread):
                 break
         return out
 
+    def broadcast(self, packet, clients):
+        encoded = {}    # format {(framed, version): bytes}
+        droppable = packet.get("type") == "text"
+        for client in clients:
+            key = (client.get_framed(), client.get_version())
+            if key not in encoded:
+                encoded[key] = client.encode(packet)
+            client.queue_bytes(encoded[key], droppable=droppable)
+        self.broadcast_encodes += len(encoded)
+        self.broadcast_encodes_saved += len(clients) - len(encoded)
+
+    def get_broadcast_stats(self):
+        return self.broadcast_encodes, self.broadcast_encodes_saved
+
     def close_connection(self, id_):
-        if id_ in self.clients:
+        with self.lock:
+            if id_ not in self.clients:
+                return
             self.old_connections.put(id_)
             client = self.clients[id_]
+            client.closed = True
+            self.pending_flush.discard(client)
+            self.fd_map.pop(client.get_fileno(), None)
+            if self.selector:
+                try:
+                    self.selector.unregister(client.socket)
+                except (KeyError, ValueError):
+                    pass
             try:
                 client.socket.shutdown(2)
             except sock_error:
@@ -265,10 +676,47 @@ class Server(Thread):
             client.socket.close()
             del self.clients[id_]
             self.update_sockets()
+        self.post_event()
+
+    def get_loop_stats(self):
+        return self.loop_stats
+
+    def set_event_queue(self, event_queue):
+        self.event_queue = event_queue
+
+    def post_event(self):
+        if self.event_queue:
+            self.event_queue.post("socket")
 
     def set_wait_time(self, t):
         self.wait_time = t
 
+    def set_send_limits(self, high_water, low_water, budget):
+        self.send_high_water = high_water
+        self.send_low_water = low_water
+        self.send_budget = budget
+
+    def get_send_limits(self):
+        return self.send_high_water, self.send_low_water, self.send_budget
+
+    def set_slow_client_policy(self, policy):
+        self.slow_client_policy = policy
+
+    def get_slow_client_policy(self):
+        return self.slow_client_policy
+
+    def get_client_queues(self):
+        with self.lock:
+            clients = list(self.clients.values())
+        return [(i.get_id(), i.get_addr(), *i.get_queue_size(), i.get_congested(), i.get_dropped())
+                for i in clients]
+
+    def set_reactor(self, reactor):
+        self.reactor = reactor
+
+    def get_reactor(self):
+        return self.reactor
+
     def get_running(self):
         return self.running
 
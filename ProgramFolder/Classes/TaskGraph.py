@@ -0,0 +1,111 @@
+from threading import Thread, Event, Timer, Lock
+from time import monotonic
+
+
+class TaskGraph:
+    # Runs each task on its own thread once its dependencies are ready. A task with a timeout counts as ready
+    # for its dependents once the timeout passes even if it is still running, so one slow network call can't
+    # hold up everything downstream of it.
+    def __init__(self):
+        self.tasks = {}     # format {name: {"function": f, "depends": [names], "timeout": seconds, ...}}
+        self.order = []
+        self.lock = Lock()
+        self.finished = Event()
+        self.done_callback = None
+        self.start_time = 0
+        self.remaining = 0
+
+    def add_task(self, name, function, depends=None, timeout=None):
+        self.tasks[name] = {"function": function, "depends": depends or [], "timeout": timeout,
+                            "ready": Event(), "status": "waiting", "error": None,
+                            "queued": 0, "started": 0, "ended": 0}
+        self.order.append(name)
+
+    def set_done_callback(self, callback):
+        self.done_callback = callback
+
+    def start(self):
+        self.start_time = monotonic()
+        self.remaining = len(self.tasks)
+        for name in self.order:
+            for depend in self.tasks[name]["depends"]:
+                if depend not in self.tasks:
+                    raise KeyError(f"Task {name} depends on unknown task {depend}")
+        for name in self.order:
+            Thread(target=self.run_task, args=(name,), daemon=True).start()
+        if not self.tasks:
+            self.finish()
+
+    def run_task(self, name):
+        task = self.tasks[name]
+        task["queued"] = monotonic()
+        for depend in task["depends"]:
+            self.tasks[depend]["ready"].wait()
+
+        task["started"] = monotonic()
+        task["status"] = "running"
+        timer = None
+        if task["timeout"] is not None:
+            timer = Timer(task["timeout"], self.timed_out, args=(name,))
+            timer.daemon = True
+            timer.start()
+        try:
+            task["function"]()
+            task["status"] = "done" if task["status"] == "running" else "done late"
+        except Exception as e:
+            task["error"] = e
+            task["status"] = "failed"
+        if timer:
+            timer.cancel()
+        task["ended"] = monotonic()
+        task["ready"].set()
+
+        with self.lock:
+            self.remaining -= 1
+            last = self.remaining == 0
+        if last:
+            self.finish()
+
+    def timed_out(self, name):
+        task = self.tasks[name]
+        if task["status"] == "running":
+            task["status"] = "timed out"
+            task["ready"].set()
+
+    def finish(self):
+        self.finished.set()
+        if self.done_callback:
+            self.done_callback(self)
+
+    def wait(self, name=None, timeout=None):
+        if name:
+            return self.tasks[name]["ready"].wait(timeout)
+        return self.finished.wait(timeout)
+
+    def get_status(self, name):
+        return self.tasks[name]["status"]
+
+    def get_error(self, name):
+        return self.tasks[name]["error"]
+
+    def get_timings(self):
+        # format [(name, seconds waiting on dependencies, seconds running, status), ...]
+        out = []
+        now = monotonic()
+        for name in self.order:
+            task = self.tasks[name]
+            if not task["started"]:
+                out.append((name, (now - task["queued"]) if task["queued"] else 0, 0, task["status"]))
+                continue
+            ended = task["ended"] or now
+            out.append((name, task["started"] - task["queued"], ended - task["started"], task["status"]))
+        return out
+
+    def get_lines(self):
+        out = [f"{'task':<16}{'waited':>10}{'ran':>10}  status"]
+        for name, waited, ran, status in self.get_timings():
+            if self.tasks[name]["error"]:
+                status += f" ({self.tasks[name]['error'].__repr__()})"
+            out.append(f"{name:<16}{waited:>9.2f}s{ran:>9.2f}s  {status}")
+        out.append(f"Startup took {monotonic() - self.start_time:.2f}s")
+        return out
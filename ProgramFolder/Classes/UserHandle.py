@@ -7,11 +7,13 @@ import queue
 class UserHandle:
     def __init__(self, user_data):
         self.user_data = user_data
+        self.route_callback = None
 
         self.filter_enabled = False
         self.default_filter_behavior = True  # True = allow if not specified; False = disallow if not specified
         self.filters = {}
         self.reset_filter()
+        self.min_level = 0  # lowest level of instance output shown, see OutputFilter.levels
 
         self.focus = ("", "")
         self.default_prefix = "->"
@@ -80,15 +82,18 @@ class UserHandle:
 
     def set_filter(self, enable):
         self.filter_enabled = enable
+        self.update_route()
 
     def modify_filter(self, enabled, controller="", instance=""):
         if not controller:
             return False
         if not instance:
             self.filters["controllers"][controller] = enabled
+            self.update_route()
             return True
         full_path = controller+"/"+instance
         self.filters["instances"][full_path] = enabled
+        self.update_route()
         return True
 
     def get_filter(self):
@@ -96,16 +101,25 @@ class UserHandle:
 
     def set_filter_default(self, enable):
         self.default_filter_behavior = enable
+        self.update_route()
 
     def get_filter_default(self):
         return self.default_filter_behavior
 
     def reset_filter(self):
         self.filters = {"controllers": {}, "instances": {}}
+        self.update_route()
 
     def is_filtered(self):
         return self.filter_enabled
 
+    def set_min_level(self, level):
+        self.min_level = level
+        self.update_route()
+
+    def get_min_level(self):
+        return self.min_level
+
     def check_filter(self, focus):
         allow = self.default_filter_behavior
         allow = self.filters["controllers"].get(focus[0], allow)
@@ -117,6 +131,7 @@ class UserHandle:
 
     def set_focus(self, module_name="", controller=""):
         self.focus = (module_name, controller)
+        self.update_route()
         if not self.focus[0]:
             self.set_prefix(self.default_prefix)
         else:
@@ -125,6 +140,9 @@ class UserHandle:
             else:
                 self.set_prefix(f"/{self.focus[0]}:")
 
+    def get_focus(self):
+        return self.focus
+
     def is_focused(self):
         return self.focus != ("", "")
 
@@ -137,17 +155,27 @@ class UserHandle:
             self.filters = filter_data.get("filters", self.filters)
             self.default_filter_behavior = filter_data.get("default", self.default_filter_behavior)
             self.filter_enabled = filter_data.get("enabled", self.filter_enabled)
+            self.min_level = filter_data.get("level", self.min_level)
+        self.update_route()
 
     def set_exit_callback(self, callback):
         self.exit_callback = callback
 
+    def set_route_callback(self, callback):
+        self.route_callback = callback
+
+    def update_route(self):
+        if self.route_callback:
+            self.route_callback(self)
+
     def exit(self):
         if not self.exited:
             self.exited = True
             if not self.user_data.is_user(self.username):
                 filter_data = {"filters": self.filters,
                                "default": self.default_filter_behavior,
-                               "enabled": self.filter_enabled}
+                               "enabled": self.filter_enabled,
+                               "level": self.min_level}
                 self.user_data.set_user_data(self.username, "filter_data", filter_data)
             if self.exit_callback:
                 self.exit_callback()
@@ -155,6 +183,9 @@ class UserHandle:
     def get_id(self):
         return -1
 
+    def get_connection(self):
+        return None
+
     @staticmethod
     def get_all_from_queue(q):
         out = []
@@ -167,20 +198,25 @@ class UserHandle:
 
 
 class ConsoleUserHandle(UserHandle):
-    def __init__(self, user_data, console, username, permissions):
+    def __init__(self, user_data, console, username, permissions, manager=None):
         super().__init__(user_data)
         self.set_username(username)
         self.set_permissions(permissions)
         self.logged_in = True
 
         self.console = console
+        self.manager = manager
+
+    def update(self):
+        if self.manager:
+            for text in self.console.get_completion_requests():
+                self.console.complete(text, self.manager.complete_command(self, text))
 
     def print(self, data, newline=True, loop=True):
         self.console.print(data, newline=newline, loop=loop)
 
     def get_input(self):
-        prefix = self.get_focus_prefix()
-        return [prefix + i for i in self.console.get_input()]
+        return self.console.get_input()
 
     def clear_console(self):
         self.console.clear_console()
@@ -240,14 +276,20 @@ class SocketUserHandle(UserHandle):
                             self.set_username(username)
                             self.load_data()
                             self.running = False
+                            self.logged_in = True
+                            self.update_route()
                             self.socket.send_packet({"type": "login_response", "response": "success"})
+                            self.manager.replay_scrollback(self)
                             self.manager.print_all(f"Got connection from {self.username}")
 
                         elif self.user_data.login_user(username, password_hash=hash_):
                             self.running = False
                             self.set_username(username)
                             self.load_data()
+                            self.logged_in = True
+                            self.update_route()
                             self.socket.send_packet({"type": "login_response", "response": "success"})
+                            self.manager.replay_scrollback(self)
                             self.manager.print_all(f"Got connection from {self.username}")
 
                         else:
@@ -278,12 +320,15 @@ class SocketUserHandle(UserHandle):
             if timeout != -1 and start_time + timeout < time():
                 return []
 
+    @staticmethod
+    def text_packet(data, newline=True, loop=True):
+        return {"type": "text", "newline": newline, "loop": loop, "text": f"{data}"}
+
     def print(self, data, newline=True, loop=True):
-        self.socket.send_packet({"type": "text", "newline": newline, "loop": loop, "text": f"{data}"})
+        self.socket.send_packet(self.text_packet(data, newline, loop))
 
     def get_input(self):
-        prefix = self.get_focus_prefix()
-        return [(prefix + i.get("text")) for i in self.get_packets("text")]
+        return [i.get("text") for i in self.get_packets("text")]
 
     def clear_console(self):
         self.socket.send_packet({"type": "clear_console"})
@@ -297,7 +342,8 @@ class SocketUserHandle(UserHandle):
 
     def update(self):
         if self.logged_in:
-            packets = self.get_packets(["change_password"])
+            packets = self.get_packets(["change_password", "complete", "agent_register", "agent_status",
+                                        "agent_output"])
             for p in packets:
                 if p["type"] == "change_password":
                     if self.user_data.update_user_password(self.username, hash_=p["hash"],
@@ -305,6 +351,12 @@ class SocketUserHandle(UserHandle):
                         self.print("Successfully changed password.")
                     else:
                         self.print("Failed to change password")
+                elif p["type"] == "complete":
+                    text = p.get("text", "")
+                    self.socket.send_packet({"type": "completions", "text": text,
+                                             "options": self.manager.complete_command(self, text)})
+                elif p["type"].startswith("agent_"):
+                    self.manager.agent_packet(self, p)
 
     def kick(self):
         self.socket.close()
@@ -312,6 +364,9 @@ class SocketUserHandle(UserHandle):
     def get_id(self):
         return self.id
 
+    def get_connection(self):
+        return self.socket
+
     def exit(self):
         self.running = False
         super().exit()
@@ -339,8 +394,7 @@ class BufferUserHandle(UserHandle):
         self.out_queue.put({"type": "text", "newline": newline, "loop": loop, "text": f"{data}"})
 
     def get_input(self):
-        prefix = self.get_focus_prefix()
-        return [(prefix + i.get("text")) for i in self.get_packets("text")]
+        return [i.get("text") for i in self.get_packets("text")]
 
     def clear_console(self):
         self.out_queue.put({"type": "clear_console"})
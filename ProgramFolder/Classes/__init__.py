@@ -20,4 +20,6 @@ from .UserHandle import SocketUserHandle
 from .UserHandle import BufferUserHandle
 from .PortHandler import PortHandler
 from .EnvManager import EnvManager
+from .TaskGraph import TaskGraph
+from .Agent import Agent
 
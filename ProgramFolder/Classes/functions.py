@@ -2,6 +2,8 @@ from subprocess import check_call, CalledProcessError, PIPE
 from sys import executable
 from platform import system
 from importlib import util, reload
+from datetime import datetime
+from time import time
 
 
 def install_requirements(requirements):
@@ -69,3 +71,17 @@ def parse_string_for_commands(string):
 
 def remove_chars(string, char_list):
     return "".join([i for i in string if i not in char_list])
+
+
+def parse_time(string):
+    # Accepts either an age such as 30s, 15m, 2h, 3d, 1w or a date like 2021-06-01 or 2021-06-01T13:30
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    if string[-1:].lower() in units:
+        try:
+            return time() - float(string[:-1]) * units[string[-1].lower()]
+        except ValueError:
+            pass
+    try:
+        return datetime.fromisoformat(string).timestamp()
+    except ValueError:
+        return None
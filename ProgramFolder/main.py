@@ -6,11 +6,13 @@ from Classes import ControllerManager
 from Classes import ConsoleUserHandle, SocketUserHandle
 from Classes import functions
 from Classes import PortHandler
+from Classes import TaskGraph
+from Classes import Agent
 from json import dumps, loads, JSONDecodeError
 from time import sleep, time
 from sys import version
 from socket import gethostbyname, gethostname
-from os import path as ospath, chdir, getcwd, system, getpid, kill, remove
+from os import path as ospath, chdir, getcwd, system, getpid, kill, remove, execv
 from sys import argv, executable
 from platform import system as platSys
 
@@ -22,7 +24,6 @@ from platform import system as platSys
 # make change password server side command
 # help for controllers
 # make it so gui buttons execute a command instead
-# remember console output in gui
 # cert auto-renewal
 
 # LIKE TO DO
@@ -30,7 +31,6 @@ from platform import system as platSys
 # add more servers (factorio, tf2/gmod, unturned)
 # run as admin
 # discord bot controller
-# hard exit servers in the event they hang/crash
 # commands/documentation
 # typing
 # execute commands from in game
@@ -48,20 +48,10 @@ from platform import system as platSys
 def main(config):
     if not isinstance(config["ip"], str) or len(config["ip"].split(".")) != 4:
         config["ip"] = gethostbyname(gethostname())
-    PortHandler.get_public_ip()
     PortHandler.set_ip(config["ip"])
     PortHandler.set_use_upnp(config["upnp"])
-    PortHandler.initialize_upnp()
     PortHandler.set_use_cloudflare(config["cloudflare"])
-    PortHandler.initialize_cloudflare(config["cloudflareEmail"], config["cloudflareApiKey"],
-                                      config["cloudflareDomain"], "serverserver")
-    if config["ssl"]:
-        PortHandler.set_use_certs(True)
-        PortHandler.initialize_certs("Env/certs", selfSigned=False,
-                                     cloudflare_email=config["cloudflareEmail"],
-                                     cloudflare_api_key=config["cloudflareApiKey"],
-                                     domain=config["cloudflareDomain"])
-    PortHandler.wipe_ports()
+    PortHandler.set_use_certs(config["ssl"])
 
     user_handles = []
 
@@ -78,6 +68,10 @@ def main(config):
                                                   Gui,
                                                   config)
 
+    Events = Manager.get_event_queue()
+    Console.set_event_queue(Events)
+    MainServer.set_event_queue(Events)
+
     if not config["headless"]:
         Console.start()
         Console.update_prefix("->")
@@ -87,23 +81,63 @@ def main(config):
 
     Manager.set_server_types_dir(config["serverInfoDir"])
     Manager.set_instance_data_file(config["instanceDataFile"])
+    Manager.set_instance_data_dir(config["instanceDataDir"])
     Manager.set_server_dir(config["serverDir"])
     Manager.init_commands()
-    Manager.load_server_types()
-    Manager.load_instances_from_file()
 
     Console.print(version)
     Console.print(f"Loaded {len(UserInfo.get_users())} user(s) from '{config['userInfoFile']}'")
-    Console.print(f"Loaded {len(Manager.get_server_names())} server type(s) from '{config['serverInfoDir']}'")
 
     server_port_handler = PortHandler()
-    if config["socketServer"]:
+
+    # <editor-fold desc="Startup Tasks">
+    def setup_upnp():
+        PortHandler.initialize_upnp()
+        PortHandler.wipe_ports()
+        if Startup.get_status("upnp") == "timed out" and PortHandler.upnp.get_connected():
+            setup_late_upnp()
+
+    def setup_late_upnp():
+        # Cloudflare, the certs and any ports requested in the meantime all went ahead without upnp, so once the
+        # first pass is over they're redone with it
+        Startup.wait("certs")
+        if not PortHandler.cloudflare.get_connected():
+            setup_cloudflare()
+        setup_certs()
+        PortHandler.reprovision_ports()
+        if PortHandler.get_use_certs():
+            # The web server loads the cert files for every connection so it picks up the new ones by itself
+            MainServer.reload_certs()
+
+    def setup_cloudflare():
+        PortHandler.initialize_cloudflare(config["cloudflareEmail"], config["cloudflareApiKey"],
+                                          config["cloudflareDomain"], "serverserver")
+
+    def setup_certs():
+        PortHandler.initialize_certs("Env/certs", selfSigned=False,
+                                     cloudflare_email=config["cloudflareEmail"],
+                                     cloudflare_api_key=config["cloudflareApiKey"],
+                                     domain=config["cloudflareDomain"])
+
+    def load_server_types():
+        Manager.load_server_types()
+        Console.print(f"Loaded {len(Manager.get_server_names())} server type(s) from '{config['serverInfoDir']}'")
+
+    def start_socket_server():
         MainServer.set_ip(config["ip"])
         MainServer.set_port(server_port_handler.request_port(config['socketPort'], description="Controller", TCP=True))
         MainServer.set_certs(PortHandler.get_cert_files())
+        MainServer.set_reactor(config["socketReactor"])
+        MainServer.set_send_limits(config["socketSendHighWater"], config["socketSendLowWater"],
+                                   config["socketSendBudget"])
+        MainServer.set_slow_client_policy(config["socketSlowClientPolicy"])
         MainServer.start()
+        if MainServer.get_running():
+            Console.print(f"Hosted socket server at {PortHandler.get_connection_to_port(MainServer.get_port())}")
+        else:
+            Console.print("Socket server: Disconnected")
 
-    if config["webserver"]:
+    def start_webserver():
         Gui.set_manager(Manager)
         Gui.set_secret_key(config["gui_secret_key"])
         Gui.set_ip(config["ip"])
@@ -111,40 +145,75 @@ def main(config):
         Gui.set_certs(PortHandler.get_cert_files())
         Gui.create_app()
         Gui.start()
+        if Gui.get_running():
+            Console.print(f"Hosted web server at {PortHandler.get_connection_to_port(Gui.get_port())}")
+        else:
+            Console.print("Web server: Disconnected")
 
-    if Gui.get_running():
-        Console.print(f"Hosted web server at {PortHandler.get_connection_to_port(Gui.get_port())}")
-    else:
-        Console.print(f"Web server: Disconnected")
-    if MainServer.get_running():
-        Console.print(f"Hosted socket server at {PortHandler.get_connection_to_port(MainServer.get_port())}")
-    else:
-        Console.print(f"Socket server: Disconnected")
-
-    Console.print(f"UPNP: " + ("Working" if PortHandler.upnp.get_connected() else "Disconnected"))
-    Console.print(f"CloudFlare: " + ("Working" if PortHandler.cloudflare.get_connected() else "Disconnected"))
+    def start_agent():
+        NodeAgent.start()
 
-    ServerHandle = ConsoleUserHandle(UserInfo, Console, "SERVER", 6)
-    user_handles.append(ServerHandle)
+    def startup_finished(graph):
+        Console.print("UPNP: " + ("Working" if PortHandler.upnp.get_connected() else "Disconnected"))
+        Console.print("CloudFlare: " + ("Working" if PortHandler.cloudflare.get_connected() else "Disconnected"))
+        Console.print("\n".join(graph.get_lines()))
+    # </editor-fold>
 
+    # Network discovery runs in the background, anything that needs it waits at most startupTaskTimeout
+    # seconds for it before carrying on with whatever has been found so far
+    timeout = config["startupTaskTimeout"]
+    Startup = TaskGraph()
+    Startup.add_task("public_ip", PortHandler.get_public_ip, timeout=timeout)
+    Startup.add_task("upnp", setup_upnp, timeout=timeout)
+    Startup.add_task("cloudflare", setup_cloudflare, depends=["public_ip", "upnp"], timeout=timeout)
+    Startup.add_task("certs", setup_certs, depends=["cloudflare"])
+    # No timeout, instances whose type isn't loaded yet would be skipped
+    Startup.add_task("server_types", load_server_types)
+    Startup.add_task("instances", Manager.load_instances_from_file, depends=["server_types", "cloudflare"])
+    # The servers only have to wait on the certs if they're serving over tls
+    server_depends = ["certs", "upnp"] if PortHandler.get_use_certs() else ["upnp"]
+    if config["socketServer"]:
+        Startup.add_task("socket_server", start_socket_server, depends=server_depends)
+    else:
+        Console.print("Socket server: Disconnected")
+    if config["webserver"]:
+        Startup.add_task("webserver", start_webserver, depends=server_depends)
+    else:
+        Console.print("Web server: Disconnected")
+    # Agents register once their instances are loaded so the coordinator gets the full list straight away
+    NodeAgent = None
+    if config["agentMode"]:
+        NodeAgent = Agent(Manager, UserInfo, config, run_user_command)
+        Startup.add_task("agent", start_agent, depends=["instances"])
+    Startup.set_done_callback(startup_finished)
+    Startup.start()
+
+    ServerHandle = ConsoleUserHandle(UserInfo, Console, "SERVER", 6, manager=Manager)
+    Manager.add_handle(ServerHandle)
+
+    Stats = Manager.get_loop_stats()
     running = True
     while running:
-        sleep(0.01)
+        # Blocks until a producer posts work, waking periodically for timeouts and other housekeeping
+        Events.wait(config["housekeepingInterval"])
+        Stats.start_tick()
+        events = 0
 
         for i in MainServer.get_new_connections():
             connection = MainServer.get_client_from_id(i)
             user_handle = SocketUserHandle(UserInfo, connection, id_=i, manager=Manager)
-            user_handles.append(user_handle)
+            Manager.add_handle(user_handle)
 
         for i in MainServer.get_old_connections():
             for h in user_handles:
                 if h.get_id() == i:
                     h.exit()
-                    user_handles.remove(h)
+                    Manager.remove_handle(h)
                     name = h.get_username()
                     if name:
                         Manager.print_all(f"Lost connection from {name}")
                     break
+        Stats.mark("connections")
 
         if Manager.get_reload_needed():
             file = ControllerManager.ControllerManager.get_file()
@@ -155,68 +224,71 @@ def main(config):
             ControllerManager_.init_commands()
             ControllerManager_.set_file(file)
             Manager.print_all("Reloaded controller manager")
+        Stats.mark("reload")
 
         if Manager.get_shutdown_needed():
             Manager.print_all("Server Shutting down")
             running = False
         if Gui.get_running():
             Gui.update()
-        Manager.flush_servers()
+        Stats.mark("gui")
+        events += Manager.flush_servers()
+        Stats.mark("flush_servers")
         for user in user_handles:
             user.update()
+        Stats.mark("handle_update")
+        for user in user_handles:
             items = user.get_input()
             for i_ in items:
                 if len(i_) > 0:
+                    events += 1
                     user.print(">" + i_)
-                    path = ""
+                    path = None
                     if i_.startswith("/"):
                         spl = i_.split(":")
-                        path = spl[0]
+                        path = [i for i in spl[0].split("/") if len(i) > 0]
                         parsed = functions.parse_string_for_commands(":".join(spl[1:]))
                     else:
                         parsed = functions.parse_string_for_commands(i_)
                     command = parsed[0]
                     args = parsed[1:]
 
+                    # Lines without a path run in whatever the user is focused on once the command is dispatched
                     if command:
-                        result = False
-                        if path:
-                            path = [i for i in path.split("/") if len(i) > 0]
-
-                            if len(path) == 1:
-                                controller = path[0]
-                                result = Manager.run_command_on_server_type(controller, command, user, *args)
-                                if not result:
-                                    result = Manager.run_command(command, user, *args,
-                                                                 controller=controller)
-
-                            elif len(path) == 2:
-                                controller = path[0]
-                                instance = path[1]
-                                result = Manager.run_command_on_server_instance(
-                                    controller, instance, command, user, *args)
-                                if not result:
-                                    result = Manager.run_command(command, user, *args,
-                                                                 controller=controller, instance=instance)
-                        else:
-                            result = Manager.run_command(command, user, *args)
-                        if not result:
-                            user.print("Error: unknown command. Try the \"help\" command")
-
+                        Manager.submit_command(user, command,
+                                               lambda p, u=user, c=command, a=args:
+                                               run_user_command(Manager, u, p, c, a),
+                                               path=path)
+        Stats.mark("commands")
+        Stats.end_tick(events)
+
+    if NodeAgent:
+        NodeAgent.stop()
+    # A hung command is left behind on its daemon thread rather than holding up the rest of shutdown
+    Manager.get_command_executor().stop(config["shutdownTimeout"])
     for handle in user_handles:
         handle.exit()
 
-    Console.print("Closing Server Instances")
-    Manager.close_instances()
+    handover = Manager.get_handover_needed()
+    if handover:
+        Console.print("Handing running servers over to the restarted process")
+        Manager.write_handover()
+    else:
+        Console.print("Closing Server Instances")
+        Manager.close_instances()
     Console.print("Saving user data")
     UserInfo.save()
     Console.print("Saving module data")
     Manager.save_instances_to_file()
+    Manager.get_instance_store().stop()
+    Manager.flush_logs()
     Console.print("Stopping socket server")
     MainServer.stop()
     Gui.stop()
     server_port_handler.remove()
-    PortHandler.close_connections(ports=True, cloudflare=False, delete=False)
+    if not handover:
+        # Handed over servers keep their forwarded ports, the new process wipes and re-adds them at startup
+        PortHandler.close_connections(ports=True, cloudflare=False, delete=False)
     start_time = time()
 
     while MainServer.running:
@@ -228,9 +300,35 @@ def main(config):
     Console.clear_console()
     sleep(0.5)
     Console.stop()
+    if handover:
+        # Same pid afterwards, so the servers stay children of the daemon and can still be reaped
+        if ospath.isfile(config["pidFile"]):
+            remove(config["pidFile"])
+        execv(executable, [executable, ospath.join(getcwd(), ospath.basename(__file__))] + argv[1:])
     exit()
 
 
+def run_user_command(manager, user, path, command, args):
+    result = False
+    if len(path) == 1:
+        controller = path[0]
+        result = manager.run_command_on_server_type(controller, command, user, *args)
+        if not result:
+            result = manager.run_command(command, user, *args, controller=controller)
+
+    elif len(path) == 2:
+        controller = path[0]
+        instance = path[1]
+        result = manager.run_command_on_server_instance(controller, instance, command, user, *args)
+        if not result:
+            result = manager.run_command(command, user, *args, controller=controller, instance=instance)
+
+    elif not path:
+        result = manager.run_command(command, user, *args)
+    if not result:
+        user.print("Error: unknown command. Try the \"help\" command")
+
+
 def check_pid(pid):
     """ Check For the existence of a unix pid. """
     try:
@@ -249,17 +347,60 @@ if __name__ == "__main__":
     chdir(ospath.dirname(ospath.join(getcwd(), __file__)))
     # <editor-fold desc="Base Config Values">
     configFilePath = "data/config.json"
+    # Lets several copies (a coordinator and its agents for instance) run from one checkout with their own config
+    if "--config" in argv[1:-1]:
+        configFilePath = argv[argv.index("--config") + 1]
 
     default_config = {
         "userInfoFile": "data/userdata.json",
         "serverInfoDir": "serverTypes/",
         "instanceDataFile": "data/controllerInstances.json",
+        "instanceDataDir": "data/instances",
+        "instanceSaveInterval": 2,
+        "instanceRestoreWorkers": 8,
+        "stopGracePeriod": 30,
+        "stopEscalationWait": 5,
+        "shutdownTimeout": 60,
+        "outputQueueLines": 5000,
+        "outputQueuePolicy": "coalesce",
+        "outputDropPatterns": [],
+        "resourceSampleInterval": 5,
+        "cpuPolicy": "none",
+        "cpuCoresPerInstance": 0,
+        "instanceNice": 0,
+        "memoryBudget": 0,
+        "memoryReserve": 1024,
+        "queueStarts": True,
+        "agentMode": False,
+        "agentName": "",
+        "agentUsername": "",
+        "agentPassword": "",
+        "agentStatusInterval": 2,
+        "agentReconnectInterval": 5,
+        "agentPermission": 5,
+        "coordinatorIp": "127.0.0.1",
+        "coordinatorPort": 10000,
+        "coordinatorSsl": False,
+        "coordinatorVerifyCert": True,
+        "processHandover": True,
+        "handoverFile": "data/handover.json",
         "serverDir": "../ServerFolder",
         "pidFile": "data/serverserver.pid",
         "envDir": "Env",
         "ssl": True,
         "socketServer": True,
         "socketPort": 10000,
+        "socketReactor": True,
+        "socketSendHighWater": 262144,
+        "socketSendLowWater": 65536,
+        "socketSendBudget": 4194304,
+        "socketSlowClientPolicy": "degrade",
+        "commandWorkers": 4,
+        "housekeepingInterval": 1,
+        "instanceLogs": True,
+        "scrollbackBytes": 262144,
+        "scrollbackMinLevel": "INFO",
+        "globalScrollbackBytes": 1048576,
         "webserver": True,
         "webServerPort": 80,
         "ip": "127.0.0.1",
@@ -269,7 +410,8 @@ if __name__ == "__main__":
         "cloudflareEmail": "",
         "cloudflareApiKey": "",
         "cloudflareDomain": "",
-        "gui_secret_key": "1234567youprobablydontwantthis"
+        "gui_secret_key": "1234567youprobablydontwantthis",
+        "startupTaskTimeout": 5
     }
 
     # </editor-fold>
@@ -299,13 +441,14 @@ if __name__ == "__main__":
 
     no_new = len(argv) > 1 and "headless" in argv[1:]
     script = ospath.join(getcwd(), ospath.basename(__file__))
+    script_args = f"--config {configFilePath} headless"
     if configData["headless"] and not no_new:
         if platSys() == "Windows":
-            system(f"start {executable[:-4]}w.exe {script} headless")
+            system(f"start {executable[:-4]}w.exe {script} {script_args}")
         elif platSys() == "Linux":
-            system(f"nohup {executable} {script} headless &")
+            system(f"nohup {executable} {script} {script_args} &")
         elif platSys() == "Darwin":
-            system(f"{executable} {script} headless &")
+            system(f"{executable} {script} {script_args} &")
 
     else:
         try:
@@ -1,16 +1,16 @@
 from Classes import BaseController
 from requests import get, exceptions
 from os import path as ospath
-from os import chdir, getcwd
-from subprocess import Popen, PIPE
 from threading import Thread
-from time import sleep
 from json import loads
 
 
 class Controller(BaseController):
     type = "Minecraft"
+    output_filters = [r"Can't keep up! Is the server overloaded", r"Saving chunks for level", r"ThreadedAnvilChunkStorage",
+                      r"Thread RCON Client", r"RCON Client /[\d.:]+ (started|shutting down)"]
     minecraft_jar_versions = []
+    manifest_timeout = 10
     latest_version = ""
 
     @classmethod
@@ -55,6 +55,16 @@ class Controller(BaseController):
     def get_info(self):
         return f"Version: {self.version}"
 
+    def get_memory(self):
+        return self.memory_to_use
+
+    def port_updated(self, port, previous):
+        if port != previous and self.port == previous:
+            self.add_to_queue(f"Port {previous} was taken, moved to {port}")
+            self.port = port
+            self.save_data()
+        super().port_updated(port, previous)
+
     def save_data(self):
         self.data = {"port": self.port,
                      "jar_name": self.jar_name,
@@ -65,41 +75,27 @@ class Controller(BaseController):
 
     def run(self, just_setup=False):
         try:
-            self.running = True
+            self.set_running(True)
             if not self.initial_setup():
                 self.add_to_queue("Setup failed")
-                self.running = False
+                self.set_running(False)
                 return False
             if not just_setup:
+                # Output is read by the shared process io thread which clears running once the server exits
                 self.run_server()
-            self.running = False
+                return True
+            self.set_running(False)
         except Exception as e:
-            self.running = False
+            self.set_running(False)
             self.add_to_queue("Error running server:" + str(e))
 
+    def get_java_args(self, java_path):
+        return [java_path, f"-Xmx{self.memory_to_use}M", f"-Xms{self.memory_to_use}M", "-jar", self.jar_name, "nogui"]
+
     def run_server(self):
         java_path = self.get_java_path()
-        old_dir = ospath.abspath(getcwd())
-        chdir(self.path)
         self.add_to_queue(f"Starting server at {self.get_address()}")
-        self.process = Popen(
-            f"{java_path} -Xmx{self.memory_to_use}M -Xms{self.memory_to_use}M -jar {self.jar_name} nogui",
-            stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        chdir(old_dir)
-        poll = self.process.poll()
-
-        while poll is None:
-            sleep(0.1)
-            out = self.process.stdout.readline().decode()
-            out = out.replace("\n", "")
-            if len(out) > 0:
-                self.add_to_queue(out)
-            poll = self.process.poll()
-        self.add_to_queue("Server Closed")
-        self.process.stdin.close()
-        self.process.stdout.close()
-        self.process.stderr.close()
-        self.process = None
+        self.attach_process(self.launch_server_process(self.get_java_args(java_path)))
 
     def start(self):
         if not self.running:
@@ -111,7 +107,7 @@ class Controller(BaseController):
             try:
                 self.process.stdin.write(b"stop\n")
                 self.process.stdin.flush()
-            except ValueError:
+            except (ValueError, OSError):
                 pass
 
     def shutdown(self):
@@ -125,7 +121,6 @@ class Controller(BaseController):
 
     def initial_setup(self):
         java_path = self.get_java_path()
-        old_dir = ospath.abspath(getcwd())
         if not ospath.isfile(ospath.join(self.path, self.jar_name)):
             self.add_to_queue("Jar file missing")
             if not self.download_jar():
@@ -135,14 +130,8 @@ class Controller(BaseController):
 
         if not ospath.isfile(ospath.join(self.path, "eula.txt")):
             self.add_to_queue("Running setup for eula")
-            chdir(self.path)
-            self.process = Popen(
-                f"{java_path} -Xmx{self.memory_to_use}M -Xms{self.memory_to_use}M -jar {self.jar_name} nogui",
-                stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            chdir(old_dir)
-            self.process.stdin.write(b"stop\n")
-            self.process.stdin.flush()
-            self.process.communicate()
+            self.process = self.launch_process(self.get_java_args(java_path))
+            self.process.communicate(b"stop\n")
             if self.process.poll() != 0:
                 self.add_to_queue("Error running jar file, is the correct version of java installed?")
                 self.process = None
@@ -154,7 +143,6 @@ class Controller(BaseController):
             data = eula.read()
             eula.close()
             if "eula=true" in data and ospath.isdir(ospath.join(self.path, self.world_file)):
-                chdir(old_dir)
                 return True
             self.add_to_queue("Editing eula")
             eula = open(ospath.join(self.path, "eula.txt"), "w")
@@ -163,15 +151,9 @@ class Controller(BaseController):
             eula.close()
 
         self.add_to_queue("Running initial setup")
-        chdir(self.path)
-        self.process = Popen(f"{java_path} -Xmx{self.memory_to_use}M -Xms{self.memory_to_use}M -jar {self.jar_name} "
-                             f"nogui", stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        chdir(old_dir)
-        self.process.stdin.write(b"stop\n")
-        self.process.stdin.flush()
-        self.process.communicate()
+        self.process = self.launch_process(self.get_java_args(java_path))
+        self.process.communicate(b"stop\n")
         self.process = None
-        chdir(old_dir)
         self.add_to_queue("Finished initial setup")
         return True
 
@@ -179,7 +161,7 @@ class Controller(BaseController):
         data = []
         out = []
         properties = {"server-port": self.port, "server-ip": self.port_handler.get_ip(), "level-name": self.world_file}
-        if ospath.isfile(self.property_file_name):
+        if ospath.isfile(ospath.join(self.path, self.property_file_name)):
             file = open(ospath.join(self.path, self.property_file_name), "r")
             data = file.read().split("\n")
             file.close()
@@ -223,7 +205,7 @@ class Controller(BaseController):
         return download_url
 
     def download_jar(self):
-        if not ospath.isfile(self.jar_name):
+        if not ospath.isfile(ospath.join(self.path, self.jar_name)):
             self.add_to_queue("Downloading jar file")
             download_url = self.get_download_url()
 
@@ -253,8 +235,9 @@ class Controller(BaseController):
     @classmethod
     def load_minecraft_jar_versions(cls):
         try:
-            raw = get("https://launchermeta.mojang.com/mc/game/version_manifest.json").text
-        except exceptions.ConnectionError:
+            raw = get("https://launchermeta.mojang.com/mc/game/version_manifest.json",
+                      timeout=cls.manifest_timeout).text
+        except (exceptions.ConnectionError, exceptions.Timeout):
             return
         j = loads(raw)
         versions = j.get("versions")
@@ -275,11 +258,11 @@ class Controller(BaseController):
     def init_commands(cls):
         super().init_commands()
 
-        @cls.add_command(["mnc"])
+        @cls.add_command(["mnc"], fast=True)
         def t(self, user, *args):
             user.print("OOGA BOOGA")
 
-        @cls.add_command(["_"])
+        @cls.add_command(["_"], fast=True)
         def start(self, user, *args):
             if not len(args) > 0:
                 user.print("Error: no message given")
@@ -289,7 +272,7 @@ class Controller(BaseController):
                 try:
                     self.process.stdin.write((inp + "\n").encode())
                     self.process.stdin.flush()
-                except ValueError:
+                except (ValueError, OSError):
                     user.print("Error: server not running")
                     return False
                 return True
@@ -0,0 +1,31 @@
+from os import path as ospath
+import importlib
+import socket
+import types
+import sys
+
+PROGRAM_DIR = ospath.dirname(ospath.dirname(ospath.abspath(__file__)))
+CLASSES_DIR = ospath.join(PROGRAM_DIR, "Classes")
+
+
+def load_class_module(name):
+    # Importing the Classes package runs its requirements install, the tests only need the modules themselves
+    if "Classes" not in sys.modules:
+        package = types.ModuleType("Classes")
+        package.__path__ = [CLASSES_DIR]
+        sys.modules["Classes"] = package
+    return importlib.import_module(f"Classes.{name}")
+
+
+def load_controller(file_name):
+    # Controller modules do "from Classes import BaseController", the package itself isn't imported for the tests
+    base_controller = load_class_module("BaseController").BaseController
+    sys.modules["Classes"].BaseController = base_controller
+    module_from_file = load_class_module("functions").module_from_file
+    return module_from_file(ospath.join(PROGRAM_DIR, "serverTypes", file_name), "Controller")
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
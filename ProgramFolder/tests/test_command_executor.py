@@ -0,0 +1,81 @@
+from threading import Event
+from time import sleep
+import unittest
+
+from tests.support import load_class_module
+from tests.test_federation import Node, ControllerManager
+
+CommandExecutor = load_class_module("CommandExecutor").CommandExecutor
+UserHandle = load_class_module("UserHandle")
+
+
+class TestCommandExecutor(unittest.TestCase):
+    def test_stop_waits_for_running_commands(self):
+        executor = CommandExecutor(workers=2)
+        executor.start()
+        started = Event()
+        finished = []
+
+        def slow():
+            started.set()
+            sleep(0.3)
+            finished.append(True)
+
+        executor.submit("handle", "slow", slow)
+        started.wait(5)
+        executor.stop()
+        self.assertEqual(finished, [True])
+        self.assertEqual(executor.get_in_flight(), [])
+
+    def test_locked_commands_create_once(self):
+        ControllerManager.init_commands()
+        node = Node({"commandWorkers": 8})
+        try:
+            count = 8
+            controller = node.controller
+            # Building the instance takes a while, unlocked every create would pass the existence check and build
+            # its own instance, with its own ports and directories, before one of them wins the add
+            original = controller.__init__
+            built = []
+
+            def slow_init(instance, name, *args):
+                original(instance, name, *args)
+                built.append(name)
+                sleep(0.05)
+            controller.__init__ = slow_init
+
+            handles = [UserHandle.BufferUserHandle(node.user_data, f"admin{i}", 5) for i in range(count)]
+            for handle in handles:
+                node.manager.submit_command(handle, "createinstance",
+                                            lambda path, h=handle: node.manager.run_command(
+                                                "createinstance", h, "fake", "same", "--node", "local"))
+            executor = node.manager.get_command_executor()
+            while executor.get_queued_count():
+                sleep(0.01)
+            executor.stop()
+            self.assertEqual(built, ["same"])
+            self.assertEqual(node.manager.get_instance_registry().get_count(), 1)
+        finally:
+            node.stop()
+
+    def test_queued_focus_applies_to_later_commands(self):
+        ControllerManager.init_commands()
+        node = Node({"commandWorkers": 2})
+        try:
+            handle = UserHandle.BufferUserHandle(node.user_data, "admin", 5)
+            release = Event()
+            paths = []
+            node.manager.submit_command(handle, "slow", lambda path: release.wait(5))
+            node.manager.submit_command(handle, "focus", lambda path: handle.set_focus("fake", "a"))
+            node.manager.submit_command(handle, "status", paths.append)
+            release.set()
+            executor = node.manager.get_command_executor()
+            while executor.get_queued_count() or executor.get_in_flight():
+                sleep(0.01)
+            self.assertEqual(paths, [["fake", "a"]])
+        finally:
+            node.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
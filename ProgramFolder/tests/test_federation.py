@@ -0,0 +1,253 @@
+from threading import Thread, Event
+from time import sleep, monotonic
+import tempfile
+import unittest
+
+from tests.support import load_class_module, get_free_port
+
+ControllerManager = load_class_module("ControllerManager").ControllerManager
+UserHandle = load_class_module("UserHandle")
+UserData = load_class_module("UserData").UserData
+Server = load_class_module("Server").Server
+Agent = load_class_module("Agent").Agent
+
+
+def run_user_command(manager, user, path, command, args):
+    # Same routing as main.run_user_command
+    result = False
+    if len(path) == 1:
+        result = manager.run_command_on_server_type(path[0], command, user, *args)
+        if not result:
+            result = manager.run_command(command, user, *args, controller=path[0])
+    elif len(path) == 2:
+        result = manager.run_command_on_server_instance(path[0], path[1], command, user, *args)
+        if not result:
+            result = manager.run_command(command, user, *args, controller=path[0], instance=path[1])
+    elif not path:
+        result = manager.run_command(command, user, *args)
+    if not result:
+        user.print("Error: unknown command. Try the \"help\" command")
+
+
+class Console:
+    def print(self, value, **kwargs):
+        pass
+
+
+class FakeController:
+    # Just enough of a controller to be listed, started and talked to, output goes through the manager like a
+    # real instance's does
+    type = "fake"
+    remote = False
+    manager = None
+
+    def __init__(self, name, data=None, port_handler=None, *args):
+        self.name = name
+        self.running = False
+        self.lines = []
+
+    @classmethod
+    def run_class_command(cls, *args, **kwargs):
+        return False
+
+    @classmethod
+    def find_command(cls, *args, **kwargs):
+        return None
+
+    def get_name(self):
+        return self.name
+
+    def get_running(self):
+        return self.running
+
+    def get_address(self):
+        return "127.0.0.1:1"
+
+    def get_info(self):
+        return ""
+
+    def get_data(self):
+        return {}
+
+    def get_log(self):
+        return None
+
+    def get_memory(self):
+        return 0
+
+    def get_resource_lines(self):
+        return []
+
+    def get_output_lines(self):
+        return []
+
+    def output(self, line):
+        self.lines.append((f"[{self.type}/{self.name}]:{line}", 2))
+        self.manager.output_ready(self)
+
+    def get_queue(self):
+        lines, self.lines = self.lines, []
+        return lines
+
+    def start(self):
+        self.running = True
+        self.output("Started")
+
+    def stop(self):
+        self.running = False
+
+    def run_command(self, name, handle, *args, **kwargs):
+        if name == "say":
+            self.output(" ".join(args))
+            handle.print("said")
+            return True
+        return False
+
+
+class Node:
+    # A manager with its own socket server and main loop, like one ServerServer process
+    def __init__(self, config, server_port=None):
+        self.user_data = UserData()
+        self.user_data.create_user("agent", password="pw")
+        self.user_data.set_user_data("agent", "permission", 5)
+        self.handles = []
+        self.server = Server()
+        self.manager = ControllerManager(Console(), self.handles, lambda: None, "", self.server, self.user_data,
+                                         None, config)
+        self.manager.set_instance_data_dir(tempfile.mkdtemp())
+        # Each node's controller class points at its own manager, like a controller module loaded by that manager
+        self.controller = type("FakeController", (FakeController,), {"manager": self.manager})
+        self.manager.server_types = {"fake": {"module": self.controller, "file": ""}}
+        self.manager.init_instance_storage()
+        if server_port:
+            self.server.set_ip("127.0.0.1")
+            self.server.set_port(server_port)
+            self.server.start()
+        self.stopping = Event()
+        self.thread = Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def add_instance(self, name):
+        instance = self.controller(name)
+        self.manager.get_instance_registry().add(instance)
+        return instance
+
+    def loop(self):
+        while not self.stopping.is_set():
+            self.manager.get_event_queue().wait(0.02)
+            for i in self.server.get_new_connections():
+                handle = UserHandle.SocketUserHandle(self.user_data, self.server.get_client_from_id(i), id_=i,
+                                                     manager=self.manager)
+                self.manager.add_handle(handle)
+            for i in self.server.get_old_connections():
+                for handle in list(self.handles):
+                    if handle.get_id() == i:
+                        handle.exit()
+                        self.manager.remove_handle(handle)
+            self.manager.flush_servers()
+            for handle in list(self.handles):
+                handle.update()
+
+    def stop(self):
+        self.stopping.set()
+        self.server.stop()
+
+
+class TestFederation(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        ControllerManager.init_commands()
+
+    def setUp(self):
+        port = get_free_port()
+        self.coordinator = Node({"memoryBudget": 4096}, server_port=port)
+        self.coordinator.add_instance("local1")
+        self.agents = []
+        for index in range(2):
+            config = {"agentName": f"a{index}", "agentUsername": "agent", "agentPassword": "pw",
+                      "coordinatorIp": "127.0.0.1", "coordinatorPort": port, "agentStatusInterval": 0.1,
+                      "memoryBudget": 8192}
+            node = Node(config)
+            node.add_instance(f"r{index}")
+            agent = Agent(node.manager, node.user_data, config, run_user_command)
+            agent.start()
+            self.agents.append((node, agent))
+
+        self.manager = self.coordinator.manager
+        self.user = UserHandle.BufferUserHandle(self.coordinator.user_data, "admin", 5)
+        self.manager.add_handle(self.user)
+        self.seen = []
+        self.wait_for(lambda: len(self.manager.get_nodes()) == 2)
+
+    def tearDown(self):
+        for node, agent in self.agents:
+            agent.stop()
+            node.stop()
+        self.coordinator.stop()
+
+    def wait_for(self, check, timeout=10):
+        end = monotonic() + timeout
+        while monotonic() < end:
+            if check():
+                return True
+            sleep(0.05)
+        self.fail(f"Timed out, output so far: {self.get_text()}")
+
+    def command(self, text, path=()):
+        run_user_command(self.manager, self.user, list(path), text.split()[0], text.split()[1:])
+
+    def get_text(self):
+        self.seen += [i["text"] for i in self.user.get_events() if i.get("type") == "text"]
+        return self.seen
+
+    def test_register(self):
+        instances = self.manager.get_instance_registry()
+        self.wait_for(lambda: instances.has("fake", "r0") and instances.has("fake", "r1"))
+        self.assertEqual(instances.get("fake", "r0").get_node().get_name(), "a0")
+        self.assertEqual(instances.get("fake", "r1").get_node().get_name(), "a1")
+        self.assertFalse(instances.get("fake", "local1").remote)
+
+    def test_placement(self):
+        # The coordinator's own budget is full so the least loaded agent gets the instance
+        self.manager.get_memory_ledger().commit("other", 4096)
+        self.agents[0][0].manager.get_memory_ledger().commit("other", 4096)
+        self.wait_for(lambda: self.manager.get_nodes()["a0"].get_load().get("memory_used") == 4096)
+        self.command("createinstance fake newone")
+        agent_instances = self.agents[1][0].manager.get_instance_registry()
+        self.wait_for(lambda: agent_instances.has("fake", "newone"))
+        self.wait_for(lambda: self.manager.get_instance_registry().get("fake", "newone") is not None)
+        self.assertEqual(self.manager.get_instance_registry().get("fake", "newone").get_node().get_name(), "a1")
+
+    def test_command_proxying_and_output(self):
+        instances = self.manager.get_instance_registry()
+        self.wait_for(lambda: instances.has("fake", "r1"))
+        # A local start waiting for memory doesn't hold up an agent's instance
+        self.manager.get_memory_ledger().enqueue("queued", 1, lambda: None)
+        self.command("start fake r1")
+        remote_instance = self.agents[1][0].manager.get_instance_registry().get("fake", "r1")
+        self.wait_for(lambda: remote_instance.get_running())
+        self.wait_for(lambda: instances.get("fake", "r1").get_running())
+        # The agent's own reply reaches the user
+        self.wait_for(lambda: "Starting fake/r1." in self.get_text())
+
+        self.command("say hello there", ("fake", "r1"))
+        self.wait_for(lambda: "said" in self.get_text())
+        self.wait_for(lambda: "[fake/r1]:hello there" in self.get_text())
+        self.assertIn("[fake/r1]:Started", self.get_text())
+
+    def test_commands_and_completion(self):
+        self.command("commands")
+        self.wait_for(lambda: any("-createserver" in i for i in self.get_text()))
+        self.assertIn("createinstance", self.manager.complete_command(self.user, "createin"))
+
+    def test_disconnect(self):
+        instances = self.manager.get_instance_registry()
+        self.wait_for(lambda: instances.has("fake", "r0"))
+        self.agents[0][1].stop()
+        self.wait_for(lambda: "a0" not in self.manager.get_nodes())
+        self.assertFalse(instances.has("fake", "r0"))
+        self.assertTrue(instances.has("fake", "r1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
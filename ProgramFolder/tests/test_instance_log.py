@@ -0,0 +1,54 @@
+from threading import Thread
+import tempfile
+import shutil
+import re
+from time import sleep
+import unittest
+
+from tests.support import load_class_module
+
+InstanceLog = load_class_module("InstanceLog").InstanceLog
+
+
+class SlowLog(InstanceLog):
+    # Gives the writer time to move the pending lines into a block right after a reader copied them
+    def get_pending(self):
+        pending = super(SlowLog, self).get_pending()
+        sleep(0.001)
+        return pending
+
+
+class TestInstanceLog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log = SlowLog(self.directory)
+
+    def tearDown(self):
+        self.log.close(flush=False)
+        shutil.rmtree(self.directory)
+
+    def test_reads_while_writing(self):
+        # Lines moving from pending to a block are never seen twice or missed
+        count = 2000
+
+        def write():
+            for i in range(count):
+                self.log.append(str(i))
+                if i % 20 == 10:
+                    sleep(0.001)
+                elif i % 20 == 0:
+                    self.log.write_pending(force=True)
+
+        thread = Thread(target=write)
+        thread.start()
+        pattern = re.compile(".")
+        while thread.is_alive():
+            for lines in (self.log.tail(400), self.log.since(0), self.log.grep(pattern, limit=400)):
+                numbers = [int(i[1]) for i in lines]
+                self.assertEqual(numbers, list(range(numbers[0], numbers[0] + len(numbers))) if numbers else [])
+        thread.join()
+        self.assertEqual([int(i[1]) for i in self.log.tail(10)], list(range(count - 10, count)))
+
+
+if __name__ == "__main__":
+    unittest.main()
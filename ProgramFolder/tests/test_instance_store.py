@@ -0,0 +1,42 @@
+from os import path as ospath
+from json import dumps
+import tempfile
+import shutil
+import unittest
+
+from tests.support import load_class_module
+
+InstanceStore = load_class_module("InstanceStore").InstanceStore
+
+
+class TestImport(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = InstanceStore(ospath.join(self.directory, "instances"))
+        self.file_path = ospath.join(self.directory, "instances.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_file(self, data):
+        with open(self.file_path, "w") as file:
+            file.write(dumps(data))
+
+    def test_import(self):
+        self.write_file({"minecraft": [{"name": "a", "data": {"port": 1}}, {"name": "b", "data": {}}],
+                         "other": [{"name": "c", "data": {}}]})
+        self.assertTrue(self.store.import_file(self.file_path))
+        self.assertEqual(sorted(self.store.get_records()),
+                         [("minecraft", "a", {"port": 1}), ("minecraft", "b", {}), ("other", "c", {})])
+        self.assertFalse(ospath.exists(ospath.join(self.directory, "instances.import")))
+
+    def test_failed_import_leaves_no_records(self):
+        # The second type's entry is missing its data after the first type's records were written
+        self.write_file({"minecraft": [{"name": "a", "data": {}}], "other": [{"name": "c"}]})
+        self.assertFalse(self.store.import_file(self.file_path))
+        self.assertFalse(self.store.has_records())
+        self.assertFalse(ospath.exists(ospath.join(self.directory, "instances.import")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+from threading import Thread
+from time import sleep, monotonic
+from os import path as ospath
+from os import chmod, getcwd, makedirs
+from sys import executable
+from json import loads
+import tempfile
+import shutil
+import unittest
+
+from tests.support import load_controller
+
+Controller = load_controller("minecraft.py")
+
+# Records how it was started, then behaves just enough like a server for the eula and setup runs
+FAKE_JAVA = f"""#!{executable}
+import json, os, sys
+with open("java_calls.jsonl", "a") as file:
+    file.write(json.dumps({{"cwd": os.getcwd(), "args": sys.argv[1:]}}) + "\\n")
+if not os.path.isfile("eula.txt"):
+    with open("eula.txt", "w") as file:
+        file.write("eula=false\\n")
+else:
+    os.makedirs("world", exist_ok=True)
+for line in sys.stdin:
+    if line.strip() == "stop":
+        break
+"""
+
+
+class EnvManager:
+    def __init__(self, java):
+        self.java = java
+
+    def java_is_installed(self):
+        return True
+
+    def get_java_executor(self):
+        return self.java
+
+
+class PortHandler:
+    def set_update_callback(self, callback):
+        pass
+
+    def request_port(self, port, **kwargs):
+        return port
+
+    def get_connection_to_port(self, port):
+        return f"127.0.0.1:{port}"
+
+    def get_ip(self):
+        return "127.0.0.1"
+
+
+class Console:
+    def print(self, value, **kwargs):
+        pass
+
+
+class Manager:
+    def __init__(self, server_dir, java):
+        self.server_dir = server_dir
+        self.env_manager = EnvManager(java)
+        self.console = Console()
+        self.config = {"instanceLogs": False, "processHandover": False}
+        self.started = []
+
+    def get_server_dir(self):
+        return self.server_dir
+
+    def get_config(self):
+        return self.config
+
+    def get_env_manager(self):
+        return self.env_manager
+
+    def get_console(self):
+        return self.console
+
+    def get_output_level(self, focus):
+        return 0
+
+    def instance_changed(self, instance):
+        pass
+
+    def running_changed(self, instance, running):
+        pass
+
+    def output_ready(self, instance):
+        pass
+
+    def process_started(self, instance, process):
+        self.started.append(instance)
+
+    def process_stopped(self, instance):
+        pass
+
+
+class TestConcurrentLaunch(unittest.TestCase):
+    count = 16
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        java = ospath.join(self.directory, "java")
+        with open(java, "w") as file:
+            file.write(FAKE_JAVA)
+        chmod(java, 0o755)
+        self.manager = Manager(ospath.join(self.directory, "servers"), java)
+        Controller.set_manager(self.manager)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def wait_for(self, check, timeout=30):
+        end = monotonic() + timeout
+        while not check():
+            if monotonic() > end:
+                self.fail("Timed out waiting for the instances")
+            sleep(0.05)
+
+    def test_concurrent_starts(self):
+        cwd = getcwd()
+        instances = []
+        for i in range(self.count):
+            instance = Controller(f"server{i}", None, PortHandler(), "1.0")
+            makedirs(instance.path, exist_ok=True)
+            open(ospath.join(instance.path, instance.jar_name), "w").close()
+            instances.append(instance)
+
+        threads = [Thread(target=i.start) for i in instances]
+        for thread in threads:
+            thread.start()
+        self.wait_for(lambda: len(self.manager.started) == self.count)
+        for instance in instances:
+            instance.stop()
+        self.wait_for(lambda: not any(i.get_running() for i in instances))
+
+        self.assertEqual(getcwd(), cwd)
+        for instance in instances:
+            with open(ospath.join(instance.path, "java_calls.jsonl"), "r") as file:
+                calls = [loads(line) for line in file]
+            # The eula run, the initial setup and the server itself
+            self.assertEqual(len(calls), 3, instance.name)
+            for call in calls:
+                self.assertEqual(ospath.realpath(call["cwd"]), ospath.realpath(instance.path))
+                self.assertEqual(call["args"], instance.get_java_args("java")[1:])
+
+
+if __name__ == "__main__":
+    unittest.main()
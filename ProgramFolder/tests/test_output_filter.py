@@ -0,0 +1,24 @@
+import unittest
+
+from tests.support import load_class_module
+
+OutputFilter = load_class_module("OutputFilter").OutputFilter
+
+
+class TestOutputFilter(unittest.TestCase):
+    def test_stack_trace_keeps_level(self):
+        output_filter = OutputFilter()
+        lines = ["[12:00:00] [Server thread/ERROR]: Encountered an unexpected exception",
+                 "java.lang.IllegalStateException: boom",
+                 "\tat net.minecraft.server.Main.main(Main.java:1)",
+                 "[12:00:01] [Server thread/INFO]: Done",
+                 "no prefix"]
+        levels = [OutputFilter.get_level_name(output_filter.classify(i)) for i in lines]
+        self.assertEqual(levels, ["ERROR", "ERROR", "ERROR", "INFO", "INFO"])
+
+    def test_unprefixed_first_line(self):
+        self.assertEqual(OutputFilter().classify("Starting"), OutputFilter.get_level("INFO"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+from subprocess import Popen, PIPE
+from sys import executable
+from time import sleep, monotonic
+import unittest
+
+from tests.support import load_class_module
+
+OutputQueue = load_class_module("OutputQueue").OutputQueue
+ProcessIO = load_class_module("ProcessIO").ProcessIO
+
+# Writes far more lines than the queue below holds, then one last line once it is let through
+FLOOD = "import sys\nfor i in range(200000):\n    sys.stdout.write(f'{i}\\n')\nprint('done')\n"
+QUIET = "import time\nfor i in range(20):\n    print(i, flush=True)\n    time.sleep(0.02)\n"
+
+
+class TestBlockPolicy(unittest.TestCase):
+    def test_pauses_until_drained(self):
+        calls = []
+        queue = OutputQueue(max_lines=2, policy="block", pause=lambda: calls.append("pause"),
+                            resume=lambda: calls.append("resume"))
+        for i in range(4):
+            self.assertTrue(queue.put(str(i)))
+        # Lines read before the pause took effect are kept rather than dropped
+        self.assertEqual(calls, ["pause"])
+        self.assertEqual([i[0] for i in queue.get_all()], ["0", "1", "2", "3"])
+        self.assertEqual(calls, ["pause", "resume"])
+        self.assertEqual(queue.get_dropped(), 0)
+
+    def test_block_without_callbacks_coalesces(self):
+        self.assertEqual(OutputQueue(policy="block").get_policy(), "coalesce")
+
+    def test_full_queue_does_not_stall_other_streams(self):
+        process_io = ProcessIO()
+        flood = Popen([executable, "-c", FLOOD], stdout=PIPE)
+        quiet = Popen([executable, "-c", QUIET], stdout=PIPE)
+        queue = OutputQueue(max_lines=100, policy="block", pause=lambda: process_io.pause(flood),
+                            resume=lambda: process_io.resume(flood))
+        quiet_lines = []
+        process_io.register(flood, [flood.stdout], queue.put)
+        process_io.register(quiet, [quiet.stdout], quiet_lines.append)
+
+        # Nothing drains the flood's queue, the other process is still read in full
+        end = monotonic() + 10
+        while len(quiet_lines) < 20 and monotonic() < end:
+            sleep(0.05)
+        self.assertEqual(quiet_lines, [str(i) for i in range(20)])
+        self.assertTrue(queue.get_paused())
+        self.assertLess(queue.get_size(), 100 + ProcessIO.chunk_size)
+
+        lines = []
+        end = monotonic() + 30
+        while (not lines or lines[-1][0] != "done") and monotonic() < end:
+            lines += queue.get_all()
+            sleep(0.01)
+        self.assertEqual(len(lines), 200001)
+        self.assertEqual(queue.get_dropped(), 0)
+        flood.wait(10)
+        quiet.wait(10)
+
+    def test_failing_callback_does_not_stop_reading(self):
+        errors = []
+        process_io = ProcessIO(logger=errors.append)
+        failing = Popen([executable, "-c", QUIET], stdout=PIPE)
+        quiet = Popen([executable, "-c", QUIET], stdout=PIPE)
+        quiet_lines = []
+        closed = []
+
+        def fail(line):
+            raise ValueError(line)
+
+        def fail_close(process):
+            raise ValueError("closed")
+        process_io.register(failing, [failing.stdout], fail, fail_close)
+        process_io.register(quiet, [quiet.stdout], quiet_lines.append, closed.append)
+
+        end = monotonic() + 10
+        while not closed and monotonic() < end:
+            sleep(0.05)
+        self.assertEqual(quiet_lines, [str(i) for i in range(20)])
+        self.assertEqual(closed, [quiet])
+        failing.wait(10)
+        end = monotonic() + 5
+        while len(errors) < 21 and monotonic() < end:
+            sleep(0.05)
+        self.assertEqual(len(errors), 21)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+from os import path as ospath
+from os import listdir, set_blocking
+from time import sleep, monotonic
+from sys import executable
+import tempfile
+import shutil
+import unittest
+
+from tests.support import load_class_module
+from tests.test_federation import Node, FakeController, ControllerManager
+
+ProcessHandover = load_class_module("ProcessHandover")
+FifoProcess = ProcessHandover.FifoProcess
+HandoverFile = ProcessHandover.HandoverFile
+
+# Starts a child of its own, like a server wrapper script would, and writes the child's pid
+WRAPPER = """
+import subprocess, sys, time
+child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+with open("child.pid", "w") as file:
+    file.write(str(child.pid))
+time.sleep(60)
+"""
+# Echoes every line back until stdin is closed for good
+ECHO = "import sys\nfor line in sys.stdin:\n    sys.stdout.write(line)\n    sys.stdout.flush()\n"
+
+
+class HandoverController(FakeController):
+    def __init__(self, name, *args):
+        super().__init__(name, *args)
+        self.process = None
+
+    def adopt_process(self, process):
+        self.process = process
+        self.running = True
+
+    def get_handover_record(self):
+        if not self.process:
+            return None
+        return {"type": self.type, "name": self.name, **self.process.get_record()}
+
+
+@unittest.skipUnless(FifoProcess.get_supported(), "needs fifos")
+class TestSignals(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def wait_for(self, check, timeout=10):
+        end = monotonic() + timeout
+        while not check():
+            if monotonic() > end:
+                self.fail("Timed out")
+            sleep(0.05)
+
+    def test_terminate_reaches_children(self):
+        process = FifoProcess.launch([executable, "-c", WRAPPER], ospath.join(self.directory, "fifos"),
+                                     cwd=self.directory)
+        pid_file = ospath.join(self.directory, "child.pid")
+        self.wait_for(lambda: ospath.isfile(pid_file) and open(pid_file).read())
+        with open(pid_file, "r") as file:
+            child = int(file.read())
+        process.terminate()
+        process.wait(10)
+        self.wait_for(lambda: FifoProcess.read_start_time(child) is None)
+
+
+class LaunchedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.process = FifoProcess.launch([executable, "-c", ECHO], ospath.join(self.directory, "fifos"),
+                                          cwd=self.directory)
+        # The daemon that started it goes away
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+    def tearDown(self):
+        self.process.kill()
+        self.process.wait(10)
+        shutil.rmtree(self.directory)
+
+    def exchange(self, process, line):
+        process.stdin.write(line)
+        process.stdin.flush()
+        stdout = process.stdout.fileno()
+        set_blocking(stdout, True)
+        return process.stdout.readline()
+
+
+@unittest.skipUnless(FifoProcess.get_supported(), "needs fifos")
+class TestAdopt(LaunchedTestCase):
+    def test_adopt_from_record(self):
+        adopted = FifoProcess.adopt(**self.process.get_record())
+        self.assertIsNotNone(adopted)
+        self.assertEqual(self.exchange(adopted, b"hello\n"), b"hello\n")
+        self.assertIsNone(adopted.poll())
+        adopted.stdin.close()
+        adopted.stdout.close()
+
+    def test_mismatched_start_time(self):
+        record = self.process.get_record()
+        record["start_time"] += 1
+        self.assertIsNone(FifoProcess.adopt(**record))
+
+
+class TestHandoverFile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.handover = HandoverFile(ospath.join(self.directory, "handover.json"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        records = [{"type": "fake", "name": "a", "pid": 1, "start_time": 2, "fifo_dir": "x"}]
+        self.assertFalse(self.handover.exists())
+        self.handover.write(records)
+        self.assertTrue(self.handover.exists())
+        self.assertEqual(self.handover.read(), records)
+        self.assertEqual(listdir(self.directory), ["handover.json"])
+        self.handover.remove()
+        self.assertFalse(self.handover.exists())
+
+    def test_unreadable_file(self):
+        self.assertEqual(self.handover.read(), [])
+        with open(self.handover.file_path, "w") as file:
+            file.write("{")
+        self.assertEqual(self.handover.read(), [])
+
+
+@unittest.skipUnless(FifoProcess.get_supported(), "needs fifos")
+class TestManagerHandover(LaunchedTestCase):
+    def setUp(self):
+        super().setUp()
+        ControllerManager.init_commands()
+        self.file_path = ospath.join(self.directory, "handover.json")
+        self.node = Node({"handoverFile": self.file_path})
+        controller = type("HandoverController", (HandoverController,), {"manager": self.node.manager})
+        self.node.manager.server_types = {"fake": {"module": controller, "file": ""}}
+        self.node.controller = controller
+
+    def tearDown(self):
+        self.node.stop()
+        super().tearDown()
+
+    def test_adopt_and_hand_over_again(self):
+        record = self.process.get_record()
+        alive = {"type": "fake", "name": "a", **record}
+        stale = {"type": "fake", "name": "b", **record, "start_time": record["start_time"] + 1}
+        orphan = {"type": "fake", "name": "c", **record}
+        HandoverFile(self.file_path).write([alive, stale, orphan])
+        a = self.node.add_instance("a")
+        b = self.node.add_instance("b")
+
+        self.assertEqual(self.node.manager.adopt_instances(), 1)
+        self.assertIsNotNone(a.process)
+        self.assertIsNone(b.process)
+        self.assertEqual(self.exchange(a.process, b"hello\n"), b"hello\n")
+        # Nothing could take the orphan so it stays in the file for later
+        self.assertEqual(HandoverFile(self.file_path).read(), [orphan])
+
+        # The next handover carries both the adopted server and the orphan
+        self.assertEqual(self.node.manager.write_handover(), [alive, orphan])
+        self.assertEqual(HandoverFile(self.file_path).read(), [alive, orphan])
+        a.process.stdin.close()
+        a.process.stdout.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+from socket import create_connection
+from subprocess import run, DEVNULL
+from shutil import which
+from os import path as ospath
+from time import sleep, monotonic
+import tempfile
+import shutil
+import ssl
+import unittest
+
+from tests.support import load_class_module, get_free_port
+
+Server = load_class_module("Server").Server
+
+
+class TestHandshake(unittest.TestCase):
+    certs = None
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = Server()
+        self.server.set_ip("127.0.0.1")
+        self.server.set_port(get_free_port())
+        self.server.handshake_timeout = 1.5
+        if self.certs:
+            self.server.set_certs(self.certs(self.directory))
+        self.server.start()
+        self.sockets = []
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+        self.server.stop()
+        self.server.join(5)
+        shutil.rmtree(self.directory)
+
+    def connect(self):
+        sock = create_connection(("127.0.0.1", self.server.get_port()), timeout=5)
+        if self.certs:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            sock = context.wrap_socket(sock)
+        self.sockets.append(sock)
+        return sock
+
+    def wait_for_connections(self, count, timeout=5):
+        end = monotonic() + timeout
+        ids = []
+        while len(ids) < count and monotonic() < end:
+            ids += self.server.get_new_connections()
+            sleep(0.02)
+        return ids
+
+    def test_silent_client_does_not_block_others(self):
+        self.connect()      # never sends its version
+        sock = self.connect()
+        sock.recv(1)
+        # The version bytes can arrive one at a time
+        sock.send(b"5")
+        sleep(0.1)
+        sock.send(b"F")
+        ids = self.wait_for_connections(1, timeout=0.8)
+        self.assertEqual(len(ids), 1)
+        self.assertTrue(self.server.get_client_from_id(ids[0]).get_framed())
+
+    def test_silent_client_times_out(self):
+        self.connect()
+        end = monotonic() + 5
+        while self.server.handshakes and monotonic() < end:
+            sleep(0.05)
+        self.assertEqual(self.server.handshakes, {})
+        self.assertEqual(self.server.get_client_ids(), [])
+
+
+def make_certs(directory):
+    cert, key = ospath.join(directory, "cert.pem"), ospath.join(directory, "key.pem")
+    run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+         "-keyout", key, "-out", cert], stdout=DEVNULL, stderr=DEVNULL, check=True)
+    return cert, key
+
+
+@unittest.skipUnless(which("openssl"), "needs openssl to make a certificate")
+class TestTlsHandshake(TestHandshake):
+    certs = staticmethod(make_certs)
+
+
+if __name__ == "__main__":
+    unittest.main()